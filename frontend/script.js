@@ -28,7 +28,11 @@ let AARRR_KR = ['유입', '구매', '재구매', '매출', '추천'];
 let STYLES_KR = ['긴박', '정보', 'FOMO', '감성', '시즌'];
 
 const API_BASE = window.API_BASE || (location.origin && location.origin !== "null" ? location.origin : "");
-const API_ENDPOINT = API_BASE ? `${API_BASE.replace(/\/$/, "")}/generate_batch` : "";
+const API_ENDPOINT = API_BASE ? `${API_BASE.replace(/\/$/, "")}/generate_batch_stream` : "";
+const STREAM_ENDPOINT = API_BASE ? `${API_BASE.replace(/\/$/, "")}/generate_stream` : "";
+const CATALOG_BASE = API_BASE ? `${API_BASE.replace(/\/$/, "")}/api` : "";
+const PRODUCT_PAGE_SIZE = 12;
+const productPages = new Map();
 
 const $ = id => document.getElementById(id);
 
@@ -39,18 +43,59 @@ document.addEventListener('DOMContentLoaded', () => {
 
 async function loadData() {
     try {
-        const [prod, brand, persona, camp, brandImg] = await Promise.all([
-            fetch('../data/products.json').then(r => r.json()),
-            fetch('../data/brand_stories.json').then(r => r.json()),
+        const [brand, persona, camp, brandImg] = await Promise.all([
+            loadBrands(),
             fetch('../data/personas.json').then(r => r.json()),
             fetch('../data/campaign_events.json').then(r => r.json()),
             fetch('./brand_images.json').then(r => r.json())
         ]);
-        PRODUCTS = prod; BRANDS_DATA = brand; PERSONAS = persona; CAMPAIGN_EVENTS = camp; BRAND_IMAGES = brandImg;
+        BRANDS_DATA = brand; PERSONAS = persona; CAMPAIGN_EVENTS = camp; BRAND_IMAGES = brandImg;
         renderBrands();
     } catch (e) { console.error('Data load error:', e); renderBrands(); }
 }
 
+// Brands come from the slim catalog API; the raw data files are only a fallback
+// for running the frontend without the server.
+async function loadBrands() {
+    if (CATALOG_BASE) {
+        try {
+            const res = await fetch(`${CATALOG_BASE}/brands`);
+            if (res.ok) {
+                const { brands } = await res.json();
+                return Object.fromEntries(brands.map(b => [b.name, b]));
+            }
+        } catch (e) { console.warn('Catalog API unavailable, using data files:', e); }
+    }
+    const [prod, brand] = await Promise.all([
+        fetch('../data/products.json').then(r => r.json()),
+        fetch('../data/brand_stories.json').then(r => r.json())
+    ]);
+    PRODUCTS = prod;
+    return brand;
+}
+
+// One page of products for a brand/category: { items, total, categories }.
+async function fetchProductPage(brand, cat) {
+    const key = `${brand}\u0000${cat}`;
+    if (productPages.has(key)) return productPages.get(key);
+
+    let page;
+    if (CATALOG_BASE && !PRODUCTS.length) {
+        const params = new URLSearchParams({ brand, page: '1', page_size: String(PRODUCT_PAGE_SIZE) });
+        if (cat !== 'all') params.set('category', cat);
+        const res = await fetch(`${CATALOG_BASE}/products?${params}`);
+        if (!res.ok) throw new Error(await res.text() || res.statusText);
+        page = await res.json();
+    } else {
+        const brandProds = PRODUCTS.filter(p => p.brand_name === brand);
+        const categories = [...new Set(brandProds.map(p => p.sub_category || p.category).filter(Boolean))];
+        const filtered = cat === 'all' ? brandProds : brandProds.filter(p => (p.sub_category || p.category) === cat);
+        page = { items: filtered.slice(0, PRODUCT_PAGE_SIZE), total: filtered.length, categories };
+    }
+    productPages.set(key, page);
+    return page;
+}
+
 function setupEvents() {
     $('back-btn').onclick = prevStep;
     $('next-btn').onclick = nextStep;
@@ -132,23 +177,31 @@ function renderBrands(isExpert = false) {
     }).join('');
 }
 
-function renderProducts(cat = 'all') {
+async function renderProducts(cat = 'all') {
     if (!state.selectedBrand) return;
 
-    const brandProds = PRODUCTS.filter(p => p.brand_name === state.selectedBrand);
-    const cats = [...new Set(brandProds.map(p => p.sub_category || p.category).filter(Boolean))];
+    const brand = state.selectedBrand;
+    let page;
+    try {
+        page = await fetchProductPage(brand, cat);
+    } catch (e) {
+        console.error('Product load error:', e);
+        page = { items: [], categories: [] };
+    }
+    if (state.selectedBrand !== brand) return;
+    const cats = page.categories;
 
     const tabsEl = state.mode === 'expert' ? $('expert-category-tabs') : $('category-tabs');
     tabsEl.innerHTML = `<button class="category-tab ${cat === 'all' ? 'active' : ''}" data-category="all">전체</button>` +
         cats.slice(0, 4).map(c => `<button class="category-tab ${cat === c ? 'active' : ''}" data-category="${c}">${c}</button>`).join('');
 
-    const filtered = cat === 'all' ? brandProds : brandProds.filter(p => (p.sub_category || p.category) === cat);
+    const filtered = page.items;
     const listEl = state.mode === 'expert' ? $('expert-product-list') : $('product-list');
 
     if (!filtered.length) { listEl.innerHTML = '<p style="padding:20px;color:#888;">제품 없음</p>'; return; }
 
-    listEl.innerHTML = filtered.slice(0, 12).map(p => {
-        const img = p.image_urls?.[0] || '';
+    listEl.innerHTML = filtered.map(p => {
+        const img = p.image_url || p.image_urls?.[0] || '';
         const price = parseInt(p.price) || 0;
         return `
             <div class="product-item ${state.selectedProduct?.product_id === p.product_id ? 'selected' : ''}" onclick="selectProduct('${p.product_id}')">
@@ -225,7 +278,8 @@ function selectBrand(b) {
 }
 
 function selectProduct(id) {
-    state.selectedProduct = PRODUCTS.find(p => p.product_id === id);
+    state.selectedProduct = PRODUCTS.find(p => p.product_id === id)
+        || [...productPages.values()].flatMap(page => page.items).find(p => p.product_id === id);
 
     if (state.mode === 'expert' && state.selectedProduct) {
         $('custom-product-name').value = state.selectedProduct.name;
@@ -269,32 +323,53 @@ function goToStep(step) {
     updateSidebar();
 }
 
+const LOAD_STEPS = ['load-step-1', 'load-step-2', 'load-step-3'];
+
+function setLoadingStep(i) {
+    LOAD_STEPS.forEach((s, j) => {
+        $(s).classList.toggle('active', j === i);
+        $(s).classList.toggle('done', j < i);
+    });
+}
+
 async function generateMessages() {
     const overlay = $('loading-overlay');
     overlay.style.display = 'flex';
+    setLoadingStep(0);
 
-    const steps = ['load-step-1', 'load-step-2', 'load-step-3'];
-    for (let i = 0; i < steps.length; i++) {
-        steps.forEach((s, j) => {
-            $(s).classList.toggle('active', j === i);
-            $(s).classList.toggle('done', j < i);
-        });
-        await new Promise(r => setTimeout(r, 800));
+    try {
+        if (await streamGeneratedMessages(overlay)) return;
+    } catch (e) {
+        console.error('Stream API error:', e);
+        // Mockups are already on screen; keep whatever has streamed in.
+        if (state.currentStep === 4) return;
     }
-    steps.forEach(s => { $(s).classList.remove('active'); $(s).classList.add('done'); });
 
-    let generatedMap = null;
     try {
-        generatedMap = await requestGeneratedMessages();
+        if (await requestGeneratedMessages(overlay)) return;
     } catch (e) {
         console.error('Generate API error:', e);
+        if (state.currentStep === 4) return;
     }
 
     overlay.style.display = 'none';
-    renderPhoneMockups(generatedMap);
+    renderPhoneMockups(null);
     goToStep(4);
 }
 
+// Hides the loading overlay and shows pending mockups, once.
+function mockupRevealer(overlay) {
+    let shown = false;
+    return () => {
+        if (shown) return;
+        shown = true;
+        LOAD_STEPS.forEach(s => { $(s).classList.remove('active'); $(s).classList.add('done'); });
+        overlay.style.display = 'none';
+        renderPhoneMockups(null, true);
+        goToStep(4);
+    };
+}
+
 
 function splitMessage(text, brand) {
     const cleaned = String(text || '').trim();
@@ -308,17 +383,14 @@ function splitMessage(text, brand) {
     return { title: `[${brand}] \uba54\uc2dc\uc9c0`, body: cleaned };
 }
 
-async function requestGeneratedMessages() {
-    if (!API_ENDPOINT) {
-        throw new Error('API base is not configured');
-    }
+function buildGenerateItems() {
     if (!state.selectedBrand || !state.selectedProduct || state.stageIndex === null || state.styleIndex === null) {
         return null;
     }
     if (!state.selectedProduct.product_id) {
         return null;
     }
-    const items = PERSONAS.map((p, idx) => ({
+    return PERSONAS.map((p, idx) => ({
         persona: idx,
         brand: state.selectedBrand,
         product: state.selectedProduct.name,
@@ -326,29 +398,139 @@ async function requestGeneratedMessages() {
         style_index: state.styleIndex,
         is_event: state.selectedEvent ? 1 : 0
     }));
-    const res = await fetch(API_ENDPOINT, {
+}
+
+async function readEventStream(res, onEvent) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, sep);
+            buffer = buffer.slice(sep + 2);
+            let event = 'message', data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (data) onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
+// Streams stage events and Exaone tokens into the phone mockups as they decode.
+// Returns false when streaming is not available so the caller can fall back.
+async function streamGeneratedMessages(overlay) {
+    const items = buildGenerateItems();
+    if (!STREAM_ENDPOINT || !items) return false;
+
+    const res = await fetch(STREAM_ENDPOINT, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ items })
+        body: JSON.stringify({ items, verbose: false })
     });
-    if (!res.ok) {
+    if (!res.ok || !res.body) {
         const text = await res.text();
         throw new Error(text || res.statusText);
     }
-    const data = await res.json();
-    const results = data.results || [];
-    const map = {};
-    results.forEach((result, idx) => {
-        const personaName = PERSONAS[idx]?.name || result?.persona_profile?.name;
-        const message = result?.exaone?.result_raw || result?.crm_message;
-        if (personaName && message) {
-            map[personaName] = splitMessage(message, state.selectedBrand);
+
+    const brand = state.selectedBrand;
+    const raw = {};
+    const show = mockupRevealer(overlay);
+
+    const handlers = {
+        qwen_done: ({ index, draft }) => {
+            setLoadingStep(1);
+            show();
+            if (!raw[index]) updatePhoneMockup(index, splitMessage(draft, brand), 'draft');
+        },
+        rag_done: () => setLoadingStep(2),
+        token: ({ index, text }) => {
+            show();
+            raw[index] = (raw[index] || '') + text;
+            updatePhoneMockup(index, splitMessage(raw[index], brand), 'streaming');
+        },
+        result: ({ index, result }) => {
+            const message = result?.exaone?.result_raw || result?.crm_message;
+            if (message) updatePhoneMockup(index, splitMessage(message, brand), 'done');
+        },
+        error: ({ detail }) => { throw new Error(detail); }
+    };
+    await readEventStream(res, (event, data) => handlers[event]?.(data));
+    show();
+    return true;
+}
+
+async function readNdjsonStream(res, onLine) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let sep;
+        while ((sep = buffer.indexOf('\n')) !== -1) {
+            const line = buffer.slice(0, sep).trim();
+            buffer = buffer.slice(sep + 1);
+            if (line) onLine(JSON.parse(line));
         }
+    }
+}
+
+// Reads /generate_batch_stream line by line: stage progress drives the loading
+// steps, and each persona's mockup is filled in as soon as its message is done.
+// Returns false when the API is not available so the caller can fall back.
+async function requestGeneratedMessages(overlay) {
+    const items = buildGenerateItems();
+    if (!API_ENDPOINT || !items) return false;
+
+    const res = await fetch(API_ENDPOINT, {
+        method: 'POST',
+        // The UI waits on this call, so it runs in the interactive lane, not the bulk one.
+        headers: { 'Content-Type': 'application/json', 'X-Priority': 'interactive' },
+        body: JSON.stringify({ items, verbose: false })
     });
-    return map;
+    if (!res.ok || !res.body) {
+        const text = await res.text();
+        throw new Error(text || res.statusText);
+    }
+
+    const brand = state.selectedBrand;
+    const show = mockupRevealer(overlay);
+    const drafted = new Set();
+    const retrieved = new Set();
+
+    const handlers = {
+        qwen_done: ({ index }) => {
+            drafted.add(index);
+            setLoadingStep(drafted.size < items.length ? 0 : 1);
+        },
+        rag_done: ({ index }) => {
+            retrieved.add(index);
+            if (retrieved.size === items.length) setLoadingStep(2);
+        },
+        exaone_done: ({ index, text }) => {
+            show();
+            updatePhoneMockup(index, splitMessage(text, brand), 'done');
+        },
+        result: ({ index, result }) => {
+            show();
+            const message = result?.exaone?.result_raw || result?.crm_message;
+            if (message) updatePhoneMockup(index, splitMessage(message, brand), 'done');
+        },
+        error: ({ detail }) => { throw new Error(detail); }
+    };
+    await readNdjsonStream(res, line => handlers[line.event]?.(line));
+    show();
+    return true;
 }
 
-function renderPhoneMockups(generatedMap) {
+function renderPhoneMockups(generatedMap, pending = false) {
     const brand = state.selectedBrand;
     const info = BRAND_IMAGES[brand] || {};
     const color = info.color || '#3182F6';
@@ -381,10 +563,13 @@ function renderPhoneMockups(generatedMap) {
         }
     };
 
-    const msgs = PERSONAS.map(p => {
+    const msgs = PERSONAS.map((p, idx) => {
     const generated = generatedMap && generatedMap[p.name];
-    const fallback = personaMessages[p.name] || { title: `[${brand}] \uba54\uc2dc\uc9c0`, body: `${product} \uc9c0\uae08 \ud655\uc778\ud558\uc138\uc694` };
+    const fallback = pending
+        ? { title: `[${brand}] 메시지 작성 중...`, body: '' }
+        : (personaMessages[p.name] || { title: `[${brand}] \uba54\uc2dc\uc9c0`, body: `${product} \uc9c0\uae08 \ud655\uc778\ud558\uc138\uc694` });
     return {
+        index: idx,
         name: p.name,
         ...PERSONA_INFO[p.name],
         ...(generated || fallback)
@@ -404,7 +589,7 @@ function renderPhoneMockups(generatedMap) {
     });
 
     $('phone-carousel').innerHTML = msgs.map(m => `
-        <div class="phone-mockup">
+        <div class="phone-mockup${pending && m.index !== undefined ? ' is-pending' : ''}"${m.index !== undefined ? ` data-index="${m.index}"` : ''}>
             <div class="iphone-frame">
                 <div class="iphone-screen">
                     <div style="text-align:right;color:#fff;font-size:13px;margin-bottom:60px;padding-right:8px;">9:41</div>
@@ -424,6 +609,20 @@ function renderPhoneMockups(generatedMap) {
     `).join('');
 }
 
+// Replaces the title/body of one persona's mockup; status is 'draft' | 'streaming' | 'done'.
+function updatePhoneMockup(index, message, status) {
+    const el = document.querySelector(`#phone-carousel .phone-mockup[data-index="${index}"]`);
+    if (!el) return;
+    el.classList.remove('is-pending', 'is-draft', 'is-streaming');
+    if (status !== 'done') el.classList.add(`is-${status}`);
+    el.querySelector('.notif-title').textContent = message.title;
+    el.querySelector('.notif-body').innerHTML = escapeHtml(message.body).replace(/\n/g, '<br>');
+}
+
+function escapeHtml(text) {
+    return String(text).replace(/[&<>"']/g, c => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' }[c]));
+}
+
 function resetWizard() {
     state = { currentStep: 1, selectedBrand: null, selectedProduct: null, stageIndex: null, styleIndex: null, selectedEvent: null, mode: state.mode, customData: {} };
     document.querySelectorAll('.brand-card').forEach(c => c.classList.remove('selected'));
@@ -1,29 +1,117 @@
 # server.py
 import argparse
+import asyncio
+import csv
+import gzip
+import hashlib
+import hmac
+import importlib.util
+import io
 import os
 import sys
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout, as_completed
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from threading import Lock
-from typing import List, Union
+from threading import Lock, Thread
+from typing import Dict, List, Literal, Optional, Union
 
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError, model_validator
+from pydantic.json_schema import SkipJsonSchema
 from pyngrok import ngrok
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 SRC_DIR = Path(__file__).resolve().parent / "src"
 if str(SRC_DIR) not in sys.path:
     sys.path.insert(0, str(SRC_DIR))
 
+import admission
+import fast_json
+from cancellation import Cancelled, CancelToken, JointToken
+import metrics
+from catalog import Catalog
 import run_qwen_exaone_pipeline as pipeline
+from jobs import JobManager
+from model_registry import ModelCapacityError
+from response_cache import ResponseCache, make_cache_key
+from result_store import ResultStore
+from singleflight import SingleFlight
+from stage_store import REQUEST_FIELDS, reusable_stages
 
 BASE_DIR = Path(__file__).resolve().parent
 FRONTEND_DIR = BASE_DIR / "frontend"
 DATA_DIR = BASE_DIR / "data"
+JOBS_DIR = Path(os.getenv("JOBS_DIR", str(BASE_DIR / "jobs")))
+
+DEFAULT_QWEN_MODEL = "Qwen/Qwen2.5-1.5B-Instruct"
+DEFAULT_EXA_MODEL = "LGAI-EXAONE/EXAONE-4.0-1.2B"
+
+# Generation engines: the transformers Qwen→Exaone pipeline, or the GGUF slm_v2 pipeline (llama.cpp).
+QWEN_EXAONE = pipeline.ENGINE
+SLM_V2 = "slm_v2"
+ENGINES = (QWEN_EXAONE, SLM_V2)
+# slm_v2 runs on llama-cpp-python; without it, requests for that engine are rejected at validation.
+SLM_V2_AVAILABLE = importlib.util.find_spec("llama_cpp") is not None
+DEFAULT_ENGINE = os.getenv("DEFAULT_ENGINE", QWEN_EXAONE)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _POOL, _JOBS, _RESULTS
+    pool_size = int(os.getenv("WORKER_POOL_SIZE", "0"))
+    warmup = os.getenv("WARMUP", "1") == "1"
+    if pool_size > 0:
+        from worker_pool import WorkerPool
+
+        preload = os.getenv("WORKER_PRELOAD", "1") == "1"
+        init_func = _warmup if warmup else (_preload_default_context if preload else None)
+        _POOL = WorkerPool(pool_size, init_func=init_func)
+        _BATCHER.concurrency = pool_size
+    elif warmup:
+        Thread(target=_warmup, name="warmup", daemon=True).start()
+    else:
+        _set_component("warmup", "skipped")
+    results_path = os.getenv("RESULT_STORE_PATH", str(BASE_DIR / "results" / "results.sqlite"))
+    if results_path:
+        _RESULTS = ResultStore(
+            results_path,
+            batch_size=int(os.getenv("RESULT_STORE_BATCH_SIZE", "64")),
+            flush_interval=float(os.getenv("RESULT_STORE_FLUSH_MS", "1000")) / 1000.0,
+        )
+        _RESULTS.start()
+    _JOBS = JobManager(str(JOBS_DIR), _run_job_rows, chunk_size=int(os.getenv("JOBS_CHUNK_SIZE", "32")))
+    _JOBS.start()
+    try:
+        yield
+    finally:
+        _JOBS.shutdown()
+        if _RESULTS is not None:
+            _RESULTS.shutdown()
+            _RESULTS = None
+        if _POOL is not None:
+            _POOL.shutdown()
+            _POOL = None
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when available (see ``fast_json``)."""
+
+    def render(self, content) -> bytes:
+        return fast_json.dumps(content)
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -34,6 +122,8 @@ app.add_middleware(
 
 
 class GenerateRequest(BaseModel):
+    """One message to generate; ``engine`` defaults to the brand's engine (``ENGINE_BY_BRAND``)."""
+
     persona: Union[int, str]
     brand: str
     product: str
@@ -41,48 +131,122 @@ class GenerateRequest(BaseModel):
     style_index: int
     is_event: int = 0
     top_k: int = 3
-    qwen_model: str = "Qwen/Qwen2.5-1.5B-Instruct"
-    exa_model: str = "LGAI-EXAONE/EXAONE-4.0-1.2B"
+    qwen_model: str = DEFAULT_QWEN_MODEL
+    exa_model: str = DEFAULT_EXA_MODEL
     disable_cache: bool = False
     n: int = 1
+    seed: Optional[int] = None
+    fields: Optional[List[str]] = None
+    verbose: bool = True
+    timeout_ms: Optional[int] = None
+    deadline_ms: Optional[int] = None
+    # Absolute fallback deadline (epoch seconds), set by the server from ``deadline_ms`` on arrival.
+    deadline_at: SkipJsonSchema[Optional[float]] = None
+    engine: Optional[Literal["qwen_exaone", "slm_v2"]] = None
+    # Stage ids of an earlier result still valid for this request, set by /regenerate.
+    reuse: SkipJsonSchema[Optional[Dict[str, str]]] = None
+
+    @model_validator(mode="after")
+    def _resolve_engine(self):
+        if self.engine is None:
+            self.engine = ENGINE_BY_BRAND.get(self.brand, DEFAULT_ENGINE)
+        if self.engine == SLM_V2 and not SLM_V2_AVAILABLE:
+            raise ValueError(f"{SLM_V2} engine unavailable: llama-cpp-python is not installed")
+        if self.engine != QWEN_EXAONE and self.n > 1:
+            raise ValueError(f"n > 1 is only supported by the {QWEN_EXAONE} engine")
+        return self
 
 
 class BatchRequest(BaseModel):
     items: List[GenerateRequest]
     disable_cache: bool = False
+    fields: Optional[List[str]] = None
+    verbose: Optional[bool] = None
+    timeout_ms: Optional[int] = None
+    deadline_ms: Optional[int] = None
 
+    def apply_defaults(self):
+        """Copy batch-level options onto every item."""
+        for item in self.items:
+            if self.disable_cache:
+                item.disable_cache = True
+            if self.fields is not None:
+                item.fields = self.fields
+            if self.verbose is not None:
+                item.verbose = self.verbose
+            if self.deadline_ms is not None and item.deadline_ms is None:
+                item.deadline_ms = self.deadline_ms
+        return self.items
 
-_PIPELINE_LOCK = Lock()
-_PIPELINE_CONTEXT = {}
 
+def _arm_deadline(req: GenerateRequest):
+    """Start a request's ``deadline_ms`` budget now, i.e. queueing counts against it."""
+    if req.deadline_ms and req.deadline_at is None:
+        req.deadline_at = time.time() + req.deadline_ms / 1000.0
+    return req
 
-def _get_context(qwen_model: str, exa_model: str, disable_cache: bool):
-    if disable_cache:
-        if hasattr(pipeline, "_set_cache_enabled"):
-            pipeline._set_cache_enabled(False)
-        if hasattr(pipeline, "load_json") and hasattr(pipeline.load_json, "cache_clear"):
-            pipeline.load_json.cache_clear()
-        return {"data": None, "q_generator": None, "exa_generator": None}
 
-    if hasattr(pipeline, "_set_cache_enabled"):
-        pipeline._set_cache_enabled(True)
+class CampaignMatrixRequest(BaseModel):
+    """Every persona x stage x style combination for one product (empty lists mean all)."""
 
-    key = (qwen_model, exa_model)
+    brand: str
+    product: str
+    personas: Optional[List[Union[int, str]]] = None
+    stage_indices: Optional[List[int]] = None
+    style_indices: Optional[List[int]] = None
+    is_event: int = 0
+    top_k: int = 3
+    qwen_model: str = DEFAULT_QWEN_MODEL
+    exa_model: str = DEFAULT_EXA_MODEL
+    disable_cache: bool = False
+    seed: Optional[int] = None
+    fields: Optional[List[str]] = None
+    verbose: bool = False
+    timeout_ms: Optional[int] = None
+    stream: bool = False
+
+
+def _project(req: GenerateRequest, result):
+    """Trim a pipeline result to the request's ``fields`` (or the slim set when not verbose)."""
+    if req.fields:
+        return pipeline.project_fields(result, req.fields)
+    if not req.verbose:
+        return pipeline.project_fields(result, pipeline.SLIM_FIELDS)
+    return result
+
+
+_PIPELINE_LOCK = Lock()
+_PIPELINE_DATA = None
+_POOL = None
+_JOBS = None
+_RESULTS = None
+_RESPONSE_CACHE = None
+_RESPONSE_CACHE_LOCK = Lock()
+
+
+def _shared_data():
+    global _PIPELINE_DATA
     with _PIPELINE_LOCK:
-        cached = _PIPELINE_CONTEXT.get(key)
-        if cached:
-            return cached
-        base = Path(pipeline.__file__).resolve().parent.parent
-        data = pipeline._load_data(str(base))
-        q_generator = pipeline._get_qwen_generator(qwen_model)
-        exa_generator = pipeline._get_exaone_generator(exa_model)
-        cached = {"data": data, "q_generator": q_generator, "exa_generator": exa_generator}
-        _PIPELINE_CONTEXT[key] = cached
-        return cached
+        if _PIPELINE_DATA is None:
+            base = Path(pipeline.__file__).resolve().parent.parent
+            _PIPELINE_DATA = pipeline._load_data(str(base))
+        return _PIPELINE_DATA
 
 
-def _run_pipeline(req: GenerateRequest):
-    args = argparse.Namespace(
+def _get_context(disable_cache: bool = False):
+    """A fresh per-request ``PipelineContext``; models are leased from the model registry per batch.
+
+    Cached requests share the data loaded once per process. ``disable_cache``
+    only affects this request's context (its data is re-read and the
+    pipeline caches are skipped); nothing shared is cleared.
+    """
+    if disable_cache:
+        return pipeline.PipelineContext(use_cache=False)
+    return pipeline.PipelineContext(data=_shared_data())
+
+
+def _to_args(req: GenerateRequest):
+    return argparse.Namespace(
         persona=req.persona,
         brand=req.brand,
         product=req.product,
@@ -95,41 +259,1457 @@ def _run_pipeline(req: GenerateRequest):
         out_path=None,
         batch_json=None,
         disable_cache=req.disable_cache,
+        seed=req.seed,
+        deadline_at=req.deadline_at,
+        reuse=req.reuse,
     )
-    ctx = _get_context(req.qwen_model, req.exa_model, req.disable_cache)
-    return pipeline._run_pipeline(
-        args,
-        data=ctx.get("data"),
-        q_generator=ctx.get("q_generator"),
-        exa_generator=ctx.get("exa_generator"),
+
+
+def _run_pipeline(req: GenerateRequest):
+    return _run_pipeline_batch([req])[0]
+
+
+def _run_pipeline_batch(reqs: List[GenerateRequest], on_event=None, cancel_tokens=None):
+    """Run requests that share one engine and model pair as a single batched pipeline pass."""
+    context = _get_context(reqs[0].disable_cache)
+    if reqs[0].engine == SLM_V2:
+        import slm_v2_engine
+
+        return slm_v2_engine.run_batch(
+            [_to_args(req) for req in reqs], context, on_event=on_event, cancel_tokens=cancel_tokens
+        )
+    return pipeline._run_pipeline_batch(
+        [_to_args(req) for req in reqs],
+        context=context,
+        on_event=on_event,
+        cancel_tokens=cancel_tokens,
     )
 
 
-@app.post("/generate")
-def generate(req: GenerateRequest):
+def _run_pipeline_candidates(req: GenerateRequest, on_event=None, cancel_token=None):
+    """``req.n`` sampled variants of one request from a single shared-prefill pass."""
+    return pipeline._run_pipeline_batch(
+        [_to_args(req)],
+        context=_get_context(req.disable_cache),
+        on_event=on_event,
+        n=req.n,
+        cancel_tokens=[cancel_token],
+    )
+
+
+def _run_campaign_matrix(req: CampaignMatrixRequest, on_event=None, cancel_token=None):
+    return pipeline._run_campaign_matrix(
+        argparse.Namespace(**req.model_dump()),
+        context=_get_context(req.disable_cache),
+        on_event=on_event,
+        batch_size=_BATCHER.max_batch_size,
+        cancel_token=cancel_token,
+    )
+
+
+def _pool_matrix_task(req_dict, deadline=None, on_event=None, cancel=None):
+    token = cancel.token(0, deadline) if cancel is not None else None
+    result = _run_campaign_matrix(CampaignMatrixRequest(**req_dict), on_event=on_event, cancel_token=token)
+    pipeline.flush_stages()
+    return result
+
+
+def _pool_candidates_task(req_dict, deadline=None, on_event=None, cancel=None):
+    token = cancel.token(0, deadline) if cancel is not None else None
+    result = _run_pipeline_candidates(GenerateRequest(**req_dict), on_event=on_event, cancel_token=token)
+    pipeline.flush_stages()
+    return result
+
+
+def _pool_task(req_dicts, deadlines=None, on_event=None, cancel=None):
+    """Worker-process entry point: rebuild the requests and run them as one batch."""
+    tokens = None
+    if cancel is not None:
+        tokens = [cancel.token(i, deadline) for i, deadline in enumerate(deadlines or [None] * len(req_dicts))]
+    results = _run_pipeline_batch([GenerateRequest(**d) for d in req_dicts], on_event=on_event, cancel_tokens=tokens)
+    # /regenerate is answered from the API process, which only sees stage records once they are written.
+    pipeline.flush_stages()
+    return results
+
+
+def _slm_v2_preload() -> bool:
+    """Load the slm_v2 models at startup: by default only when some brand (or the default) routes to it."""
+    routed = SLM_V2 in (DEFAULT_ENGINE, *ENGINE_BY_BRAND.values())
+    return os.getenv("SLM_V2_PRELOAD", "1" if routed else "0") == "1"
+
+
+def _preload_slm_v2():
+    import slm_v2_engine
+
+    slm_v2_engine.preload()
+
+
+def _preload_default_context():
+    _shared_data()
+    pipeline._get_qwen_generator(DEFAULT_QWEN_MODEL)
+    pipeline._get_exaone_generator(DEFAULT_EXA_MODEL)
+    if _slm_v2_preload():
+        _preload_slm_v2()
+
+
+_COMPONENTS = {name: {"status": "pending"} for name in ("data", "embedder", "qwen", "exaone", "slm_v2", "warmup")}
+_COMPONENTS_LOCK = Lock()
+
+
+def _set_component(name: str, status: str, **extra):
+    with _COMPONENTS_LOCK:
+        _COMPONENTS[name] = dict(status=status, **extra)
+
+
+def _warm_step(name: str, func):
+    _set_component(name, "loading")
+    start = time.time()
     try:
-        if req.n <= 1:
-            result = _run_pipeline(req)
-            return {"result": result}
-        results = []
-        for _ in range(req.n):
-            results.append(_run_pipeline(req))
-        return {"results": results}
+        func()
     except Exception as exc:
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
+        _set_component(name, "failed", error=str(exc))
+        raise
+    _set_component(name, "ready", seconds=round(time.time() - start, 3))
 
 
-@app.post("/generate_batch")
-def generate_batch(req: BatchRequest):
+def _warm_request(data) -> GenerateRequest:
+    """A dummy request for the default model pair, used to warm freshly loaded models."""
+    product = data["products"][0]
+    return GenerateRequest(
+        persona=0,
+        brand=product.get("brand_name", ""),
+        product=product.get("name", ""),
+        stage_index=0,
+        style_index=0,
+        engine=QWEN_EXAONE,
+    )
+
+
+def _warmup():
+    """Load the default model pair and run one dummy request end to end.
+
+    Components are loaded one at a time so ``/healthz`` can show where a slow
+    or failing boot is stuck; the final pass warms allocators and kernels.
+    """
+    print("[Warmup] start")
     try:
-        results = []
-        for item in req.items:
-            if req.disable_cache:
-                item.disable_cache = True
-            results.append(_run_pipeline(item))
-        return {"results": results}
+        _warm_step("data", _shared_data)
+        _warm_step("embedder", lambda: pipeline.vectorize_texts(["워밍업 문장"]))
+        _warm_step("qwen", lambda: pipeline._get_qwen_generator(DEFAULT_QWEN_MODEL))
+        _warm_step("exaone", lambda: pipeline._get_exaone_generator(DEFAULT_EXA_MODEL))
+        if _slm_v2_preload():
+            _warm_step("slm_v2", _preload_slm_v2)
+        else:
+            _set_component("slm_v2", "skipped")
+
+        def dummy_request():
+            _run_pipeline_batch([_warm_request(_shared_data())])
+
+        _warm_step("warmup", dummy_request)
     except Exception as exc:
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
+        print(f"[Warmup] failed: {exc}")
+        raise
+    print("[Warmup] done")
+
+
+def _readiness():
+    """(ready, detail) for the probes; in pool mode readiness comes from the workers."""
+    if _POOL is not None:
+        workers = _POOL.stats()
+        ready = all(w["alive"] and w["ready"] and not w["init_error"] for w in workers)
+        return ready, {"workers": workers}
+    with _COMPONENTS_LOCK:
+        components = {name: dict(state) for name, state in _COMPONENTS.items()}
+    ready = components["warmup"]["status"] in ("ready", "skipped")
+    return ready, {"components": components, "models": pipeline._MODEL_REGISTRY.stats()}
+
+
+def _get_response_cache():
+    global _RESPONSE_CACHE
+    with _RESPONSE_CACHE_LOCK:
+        if _RESPONSE_CACHE is None:
+            path = os.getenv("RESPONSE_CACHE_PATH", str(BASE_DIR / "cache" / "responses.sqlite"))
+            _RESPONSE_CACHE = ResponseCache(
+                path=path or None,
+                max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+                ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", "86400")),
+            )
+        return _RESPONSE_CACHE
+
+
+def _request_params(req: GenerateRequest):
+    """The parameters that determine a request's output (projection fields excluded)."""
+    return {
+        "persona": str(req.persona),
+        "brand": req.brand,
+        "product": req.product,
+        "stage_index": req.stage_index,
+        "style_index": req.style_index,
+        "is_event": req.is_event,
+        "top_k": req.top_k,
+        "seed": req.seed,
+        "qwen_model": req.qwen_model,
+        "exa_model": req.exa_model,
+        "version": pipeline.serving()["version"],
+        **({"n": req.n} if req.n > 1 else {}),
+        **({"engine": req.engine} if req.engine != QWEN_EXAONE else {}),
+    }
+
+
+def _response_cache_key(req: GenerateRequest):
+    """Cache key for a seeded request; unseeded requests sample freely and are never cached."""
+    if req.seed is None or req.disable_cache:
+        return None
+    return make_cache_key(_request_params(req))
+
+
+# In-flight coalescing: identical requests (same parameters and seed, or both
+# unseeded) running at the same time share one pipeline pass.
+COALESCE_ENDPOINTS = {
+    name.strip()
+    for name in os.getenv("COALESCE_ENDPOINTS", "generate,generate_batch,generate_stream,generate_batch_stream,jobs").split(",")
+    if name.strip()
+}
+_FLIGHTS = SingleFlight()
+
+
+def _coalesces(endpoint: str) -> bool:
+    return endpoint in COALESCE_ENDPOINTS
+
+
+def _flight_key(req: GenerateRequest):
+    # A caller with a tighter deadline may get a fallback tier, so deadlines are not shared.
+    # Likewise a regeneration reusing an earlier draft is not the same computation as a fresh run.
+    return make_cache_key(dict(
+        _request_params(req), disable_cache=req.disable_cache, deadline_ms=req.deadline_ms, reuse=req.reuse
+    ))
+
+
+def _full_tier(result) -> bool:
+    """Fallback results (Qwen draft or template, see ``deadline_ms``) are never cached.
+
+    Neither are results of a model version that is no longer serving (e.g.
+    from a worker that swapped before the rest of the pool), nor messages
+    taken from the semantic cache, which were generated for another request.
+    slm_v2 results have neither fallback tiers nor hot-swapped versions.
+    """
+    if result.get("cache") == "semantic":
+        return False
+    if result.get("engine") == SLM_V2:
+        return True
+    return result.get("tier", "exaone") == "exaone" and result.get("version") == pipeline.serving()["version"]
+
+
+def _store_results(reqs: List[GenerateRequest], results):
+    """Hand freshly generated results to the result store's background writer."""
+    if _RESULTS is None:
+        return
+    for req, result in zip(reqs, results):
+        adapter_id = result.get("exaone", {}).get("adapter_id")
+        _RESULTS.record(make_cache_key(_request_params(req)), result, adapter_id=adapter_id)
+
+
+def _queue_depth():
+    queue = _BATCHER._queue
+    return queue.qsize() if queue is not None else 0
+
+
+def _cache_hit_ratio():
+    stats = _get_response_cache().stats()
+    lookups = stats["hits"] + stats["misses"]
+    return stats["hits"] / lookups if lookups else 0.0
+
+
+def _worker_inflight():
+    if _POOL is None:
+        return []
+    return [({"worker": w["worker"]}, w["inflight"]) for w in _POOL.stats()]
+
+
+def _semantic_cache_state():
+    cache = pipeline._SEMANTIC_CACHE
+    if cache is None:
+        return []
+    stats = cache.stats()
+    return [({"state": state}, stats[state]) for state in ("entries", "bytes", "hits", "misses", "evictions")]
+
+
+def _job_counts():
+    counts = {}
+    for job in _JOBS.list() if _JOBS is not None else []:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    return [({"status": status}, n) for status, n in sorted(counts.items())]
+
+
+_STAGE_LATENCY = metrics.REGISTRY.summary(
+    "crm_stage_latency_seconds", "Per-request pipeline stage latency (load, rag, qwen, exaone, total)."
+)
+_TOKENS_PER_SECOND = metrics.REGISTRY.summary(
+    "crm_generation_tokens_per_second", "Generated tokens per second of each batched model pass."
+)
+_BATCH_SIZE = metrics.REGISTRY.summary("crm_batch_size", "Rows per pipeline batch.")
+_GENERATED_TOKENS = metrics.REGISTRY.counter("crm_generated_tokens_total", "Generated tokens per stage and model.")
+_ROWS = metrics.REGISTRY.counter("crm_rows_total", "Pipeline rows by outcome (generated, cache_hit, error).")
+_TIERS = metrics.REGISTRY.counter("crm_result_tier_total", "Generated results by tier (exaone, qwen, template, slm_v2).")
+_INFLIGHT = metrics.REGISTRY.gauge("crm_inflight_rows", "Rows currently being generated.")
+metrics.REGISTRY.gauge("crm_queue_depth", "Requests waiting in the /generate micro-batcher.", func=_queue_depth)
+metrics.REGISTRY.gauge("crm_response_cache_hit_ratio", "Response cache hits / lookups.", func=_cache_hit_ratio)
+metrics.REGISTRY.gauge(
+    "crm_response_cache_entries", "Response cache entries in memory.",
+    func=lambda: _get_response_cache().stats()["entries"],
+)
+metrics.REGISTRY.gauge(
+    "crm_model_memory_bytes", "Bytes held by models in the registry.",
+    func=lambda: pipeline._MODEL_REGISTRY.stats()["used_bytes"],
+)
+metrics.REGISTRY.gauge("crm_worker_inflight", "Batches in flight per pool worker.", func=_worker_inflight)
+metrics.REGISTRY.gauge("crm_jobs", "Background jobs by status.", func=_job_counts)
+metrics.REGISTRY.gauge(
+    "crm_semantic_cache",
+    "Near-duplicate Exaone cache of this process (entries, bytes, hits, misses, evictions).",
+    func=_semantic_cache_state,
+)
+metrics.REGISTRY.gauge(
+    "crm_coalesced_inflight", "Distinct computations that identical requests can currently join.",
+    func=lambda: _FLIGHTS.stats()["inflight"],
+)
+
+
+def _observe_batch(reqs: List[GenerateRequest], results):
+    """Feed one generated batch's timing into the metrics registry."""
+    if not results:
+        return
+    # The models that actually ran (the slm_v2 engine reports its GGUF models here).
+    qwen_model = results[0].get("qwen", {}).get("model", reqs[0].qwen_model)
+    exa_model = results[0].get("exaone", {}).get("model", reqs[0].exa_model)
+    stage_models = {"qwen": qwen_model, "exaone": exa_model}
+    for result in results:
+        timing = result.get("timing", {})
+        for stage in ("load", "rag", "qwen", "exaone", "total"):
+            if stage in timing:
+                _STAGE_LATENCY.observe(timing[stage], stage=stage, model=stage_models.get(stage, f"{qwen_model}+{exa_model}"))
+    _BATCH_SIZE.observe(len(results))
+    for result in results:
+        _TIERS.inc(tier=result.get("tier", "exaone"))
+    timing = results[0].get("timing", {})
+    for stage, model in stage_models.items():
+        tokens = sum(r.get("timing", {}).get(f"{stage}_tokens", 0) for r in results)
+        _GENERATED_TOKENS.inc(tokens, stage=stage, model=model)
+        if timing.get(stage):
+            _TOKENS_PER_SECOND.observe(tokens / timing[stage], stage=stage, model=model)
+
+
+def _submit_batch(reqs: List[GenerateRequest], on_event=None, coalesce=False, one_caller=False, tokens=None):
+    """Start one same-model batch and return a concurrent Future for its results.
+
+    Seeded requests found in the response cache are answered from it. With
+    ``coalesce``, a request identical to one already being generated joins
+    that computation (and replays its events) instead of running again;
+    only the rest are generated, and their results are cached on the way out.
+    ``one_caller`` marks ``reqs`` as a single client's list, whose unseeded
+    duplicates are separate samples rather than one computation.
+
+    ``tokens`` holds one ``CancelToken`` (or None) per request. Requests
+    already cancelled are dropped before the batch starts; the result slot of
+    a cancelled request holds a ``Cancelled`` exception instead of a result.
+    """
+    tokens = list(tokens or [None] * len(reqs))
+    cache = _get_response_cache()
+    keys = [_response_cache_key(req) for req in reqs]
+    results = [None] * len(reqs)
+    misses = []
+    flights = {}
+    joined = []
+    dropped = 0
+    for i, key in enumerate(keys):
+        if tokens[i] is not None and tokens[i].cancelled:
+            results[i] = Cancelled(tokens[i].reason)
+            dropped += 1
+            continue
+        cached = cache.get(key) if key is not None else None
+        if cached is not None:
+            results[i] = dict(cached, cache="hit")
+            continue
+        if coalesce:
+            # The shared computation is cancelled only when every caller waiting on it is.
+            flight, leader = _FLIGHTS.join(_flight_key(reqs[i]), JointToken)
+            if leader:
+                flight.token.add(tokens[i] or CancelToken())
+                flights[i] = flight
+            elif flight.token.cancelled:
+                pass
+            elif one_caller and reqs[i].seed is None and any(flight is own for own in flights.values()):
+                pass
+            else:
+                flight.token.add(tokens[i] or CancelToken())
+                joined.append((i, flight))
+                continue
+        misses.append(i)
+
+    _ROWS.inc(dropped, outcome="cancelled")
+    _ROWS.inc(len(reqs) - len(misses) - len(joined) - dropped, outcome="cache_hit")
+    _ROWS.inc(len(joined), outcome="coalesced")
+    outer = Future()
+    remaining = [bool(misses) + len(joined)]
+    remaining_lock = Lock()
+
+    def part_done(exc=None):
+        with remaining_lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if outer.done():
+            return
+        if exc is not None:
+            outer.set_exception(exc)
+        elif last:
+            outer.set_result(results)
+
+    if not remaining[0]:
+        outer.set_result(results)
+        return outer
+
+    for i, flight in joined:
+        if on_event is not None:
+            flight.subscribe(lambda name, payload, i=i: on_event(name, dict(payload, index=i)))
+
+        def joined_done(future, i=i):
+            try:
+                results[i] = dict(future.result(), cache="coalesced")
+            except Cancelled as exc:
+                results[i] = exc
+            except Exception as exc:
+                part_done(exc)
+                return
+            part_done()
+
+        flight.future.add_done_callback(joined_done)
+
+    if not misses:
+        return outer
+
+    run_tokens = [flights[i].token if i in flights else tokens[i] for i in misses]
+
+    def miss_events(name, payload):
+        i = misses[payload["index"]]
+        if on_event is not None:
+            on_event(name, dict(payload, index=i))
+        if i in flights:
+            flights[i].emit(name, payload)
+
+    def finish(inner):
+        _INFLIGHT.dec(len(misses))
+        try:
+            generated = inner.result()
+        except Exception as exc:
+            _ROWS.inc(len(misses), outcome="cancelled" if isinstance(exc, Cancelled) else "error")
+            for flight in flights.values():
+                _FLIGHTS.finish(flight, exc=exc)
+            if isinstance(exc, Cancelled):
+                for i in misses:
+                    results[i] = exc
+                part_done()
+            else:
+                part_done(exc)
+            return
+        kept = []
+        for i, token, result in zip(misses, run_tokens, generated):
+            if token is not None and token.cancelled:
+                # Decoding stopped early for this row; its caller is gone, so drop the partial text.
+                result = Cancelled(token.reason)
+            else:
+                kept.append((i, result))
+                if keys[i] is not None and _full_tier(result):
+                    cache.put(keys[i], result)
+            results[i] = result
+            if i in flights:
+                if isinstance(result, Cancelled):
+                    _FLIGHTS.finish(flights[i], exc=result)
+                else:
+                    _FLIGHTS.finish(flights[i], result=result)
+        _ROWS.inc(len(kept), outcome="generated")
+        _ROWS.inc(len(misses) - len(kept), outcome="cancelled")
+        _observe_batch([reqs[i] for i, _ in kept], [result for _, result in kept])
+        _store_results([reqs[i] for i, _ in kept], [result for _, result in kept])
+        part_done()
+
+    _INFLIGHT.inc(len(misses))
+    events = miss_events if (on_event is not None or flights) else None
+    try:
+        inner = _start_batch([reqs[i] for i in misses], on_event=events, tokens=run_tokens)
+    except BaseException as exc:
+        # Nothing will finish the flights this call leads; fail them so their followers do not wait forever.
+        _INFLIGHT.dec(len(misses))
+        for flight in flights.values():
+            _FLIGHTS.finish(flight, exc=exc)
+        raise
+    inner.add_done_callback(finish)
+    return outer
+
+
+def _submit_candidates(req: GenerateRequest, coalesce=False, token=None):
+    """Start an ``n > 1`` request and return a concurrent Future for its ``n`` results."""
+    cache = _get_response_cache()
+    key = _response_cache_key(req)
+    cached = cache.get(key) if key is not None else None
+    outer = Future()
+    if cached is not None:
+        _ROWS.inc(req.n, outcome="cache_hit")
+        outer.set_result([dict(result, cache="hit") for result in cached])
+        return outer
+
+    flight = None
+    if coalesce:
+        flight, leader = _FLIGHTS.join(_flight_key(req), JointToken)
+        if leader:
+            flight.token.add(token or CancelToken())
+        elif not flight.token.cancelled:
+            flight.token.add(token or CancelToken())
+            _ROWS.inc(req.n, outcome="coalesced")
+
+            def joined_done(future):
+                try:
+                    outer.set_result([dict(result, cache="coalesced") for result in future.result()])
+                except Exception as exc:
+                    outer.set_exception(exc)
+
+            flight.future.add_done_callback(joined_done)
+            return outer
+        else:
+            flight = None
+    run_token = flight.token if flight is not None else token
+
+    def finish(inner):
+        _INFLIGHT.dec(req.n)
+        try:
+            results = inner.result()
+            if run_token is not None:
+                run_token.raise_if_cancelled()
+        except Exception as exc:
+            _ROWS.inc(req.n, outcome="cancelled" if isinstance(exc, Cancelled) else "error")
+            if flight is not None:
+                _FLIGHTS.finish(flight, exc=exc)
+            outer.set_exception(exc)
+            return
+        _ROWS.inc(req.n, outcome="generated")
+        _observe_batch([req] * len(results), results)
+        _store_results([req] * len(results), results)
+        if key is not None and all(_full_tier(result) for result in results):
+            cache.put(key, results)
+        if flight is not None:
+            _FLIGHTS.finish(flight, result=results)
+        outer.set_result(results)
+
+    _INFLIGHT.inc(req.n)
+    if _POOL is not None:
+        try:
+            inner = _POOL.submit(_pool_candidates_task, req.model_dump(), run_token.deadline if run_token else None)
+        except BaseException as exc:
+            _INFLIGHT.dec(req.n)
+            if flight is not None:
+                _FLIGHTS.finish(flight, exc=exc)
+            raise
+        _link_cancel(inner, [run_token])
+    else:
+        inner = Future()
+        try:
+            inner.set_result(_run_pipeline_candidates(req, cancel_token=run_token))
+        except Exception as exc:
+            inner.set_exception(exc)
+    inner.add_done_callback(finish)
+    return outer
+
+
+def _link_cancel(future, tokens):
+    """Forward cancels of API-side tokens to the pool worker running ``future``."""
+    for row, token in enumerate(tokens):
+        if token is not None:
+            token.on_cancel(lambda row=row: _POOL.cancel(future, row))
+
+
+def _start_batch(reqs: List[GenerateRequest], on_event=None, tokens=None):
+    """Start one same-model batch and return a concurrent Future for its results.
+
+    In worker-pool mode the batch goes to the least-loaded worker process;
+    otherwise it runs right here, in the calling thread.
+    """
+    if _POOL is not None:
+        deadlines = [token.deadline if token is not None else None for token in tokens or []] or None
+        future = _POOL.submit(_pool_task, [req.model_dump() for req in reqs], deadlines, on_event=on_event)
+        _link_cancel(future, tokens or [])
+        return future
+    future = Future()
+    try:
+        future.set_result(_run_pipeline_batch(reqs, on_event=on_event, cancel_tokens=tokens))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+def _batch_key(req: GenerateRequest):
+    return (req.engine, req.qwen_model, req.exa_model, req.disable_cache)
+
+
+def _run_chunks(
+    items: List[GenerateRequest], on_event=None, on_result=None, coalesce=False, token=None, lane=None, tenants=None
+):
+    """Run a request list as same-model chunks, in parallel across pool workers.
+
+    ``on_event`` receives pipeline events with request-level indices and
+    ``on_result(index, result)`` is called as soon as each chunk finishes.
+    ``token`` cancels the whole call; it raises ``Cancelled`` once cancelled.
+
+    With a ``lane``, every chunk waits for its own admission slot under its
+    item's tenant (``tenants``, one per item), so a large batch takes turns
+    with other tenants chunk by chunk instead of holding the models for its
+    whole length.
+    """
+
+    def chunk_events(indices):
+        if on_event is None:
+            return None
+        return lambda name, payload: on_event(name, dict(payload, index=indices[payload["index"]]))
+
+    results = [None] * len(items)
+    for item in items:
+        _arm_deadline(item)
+    tenants = tenants or [admission.DEFAULT_TENANT] * len(items)
+    chunks = pipeline._group_batches(
+        list(zip(items, tenants)), _BATCHER.max_batch_size, key=lambda pair: (_batch_key(pair[0]), pair[1])
+    )
+    futures = {}
+    for indices in chunks:
+        ticket = _acquire_slot(lane, tenants[indices[0]], token) if lane is not None else None
+        try:
+            future = _submit_batch(
+                [items[i] for i in indices], on_event=chunk_events(indices), coalesce=coalesce, one_caller=True,
+                tokens=[token] * len(indices),
+            )
+        except BaseException:
+            _release_slot(ticket)
+            raise
+        future.add_done_callback(lambda _, ticket=ticket: _release_slot(ticket))
+        futures[future] = indices
+    for future in as_completed(futures):
+        indices = futures[future]
+        for i, result in zip(indices, future.result()):
+            if isinstance(result, Cancelled):
+                raise result
+            results[i] = result = _project(items[i], result)
+            if on_result is not None:
+                on_result(i, result)
+    return results
+
+
+class MicroBatcher:
+    """Collects concurrent /generate calls over a short window and runs them batched.
+
+    Requests are grouped by model pair; each group goes through the pipeline as
+    one batched Qwen pass and one batched Exaone pass, and every caller gets its
+    own result back. Batches run one at a time, so requests arriving while the
+    models are busy are picked up together in the next batch.
+    """
+
+    def __init__(self, max_batch_size: int = 8, max_wait_ms: float = 20.0, concurrency: int = 1):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.concurrency = max(1, concurrency)
+        self._queue = None
+        self._slots = None
+        self._worker = None
+
+    def _ensure_started(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._worker = asyncio.get_running_loop().create_task(self._loop())
+
+    async def submit(self, req: GenerateRequest, token: Optional[CancelToken] = None):
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((req, future, token))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _loop(self):
+        while True:
+            batch = await self._collect()
+            groups = {}
+            for req, future, token in batch:
+                if future.cancelled():
+                    continue
+                if token is not None and token.cancelled:
+                    # The caller left (or ran out of time) while queued: never start it.
+                    _ROWS.inc(outcome="cancelled")
+                    _resolve(future, exc=Cancelled(token.reason))
+                    continue
+                groups.setdefault(_batch_key(req), []).append((req, future, token))
+            for items in groups.values():
+                await self._slots.acquire()
+                task = asyncio.get_running_loop().create_task(self._run_group(items))
+                task.add_done_callback(lambda _: self._slots.release())
+
+    async def _run_group(self, items):
+        reqs = [req for req, _, _ in items]
+        tokens = [token for _, _, token in items]
+        try:
+            results = await _execute(reqs, tokens)
+        except Exception as exc:
+            if len(items) == 1 or isinstance(exc, Cancelled):
+                for _, future, _ in items:
+                    _resolve(future, exc=exc)
+                return
+            # Re-run one by one so a bad row only fails its own caller.
+            for req, future, token in items:
+                try:
+                    result = (await _execute([req], [token]))[0]
+                except Exception as item_exc:
+                    _resolve(future, exc=item_exc)
+                else:
+                    _resolve(future, result=result)
+            return
+        for (_, future, _), result in zip(items, results):
+            _resolve(future, result=result)
+
+
+async def _execute(reqs: List[GenerateRequest], tokens=None):
+    submit = lambda: _submit_batch(reqs, coalesce=_coalesces("generate"), tokens=tokens)  # noqa: E731
+    if _POOL is not None:
+        return await asyncio.wrap_future(submit())
+    return await run_in_threadpool(lambda: submit().result())
+
+
+def _resolve(future, result=None, exc=None):
+    if future.done():
+        return
+    if isinstance(result, Cancelled):
+        result, exc = None, result
+    if exc is not None:
+        future.set_exception(exc)
+    else:
+        future.set_result(result)
+
+
+_BATCHER = MicroBatcher(
+    max_batch_size=int(os.getenv("GENERATE_MAX_BATCH_SIZE", "8")),
+    max_wait_ms=float(os.getenv("GENERATE_MAX_WAIT_MS", "20")),
+)
+
+
+def _make_admission():
+    max_concurrency = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16"))
+    if max_concurrency <= 0:
+        return None
+    return admission.AdmissionController(
+        max_concurrency=max_concurrency,
+        max_pending=int(os.getenv("ADMISSION_MAX_PENDING", "64")),
+        bulk_share=float(os.getenv("ADMISSION_BULK_SHARE", "0.5")),
+        tenant_weights={k: float(v) for k, v in _parse_tenant_map(os.getenv("TENANT_WEIGHTS", "")).items()},
+        tenant_caps={k: int(v) for k, v in _parse_tenant_map(os.getenv("TENANT_CAPS", "")).items()},
+        tenant_max_concurrency=int(os.getenv("TENANT_MAX_CONCURRENCY", "0")),
+    )
+
+
+def _parse_tenant_map(value: str):
+    """``"설화수=2,라네즈=1"`` -> ``{"설화수": "2", "라네즈": "1"}``."""
+    pairs = (item.split("=", 1) for item in value.split(",") if "=" in item)
+    return {key.strip(): val.strip() for key, val in pairs if key.strip()}
+
+
+_ADMISSION = _make_admission()
+# ``"설화수=slm_v2"``: brands whose requests default to another engine.
+ENGINE_BY_BRAND = _parse_tenant_map(os.getenv("ENGINE_BY_BRAND", ""))
+for _engine in [DEFAULT_ENGINE, *ENGINE_BY_BRAND.values()]:
+    if _engine not in ENGINES:
+        raise ValueError(f"Unknown engine {_engine!r}; expected one of {', '.join(ENGINES)}")
+
+
+def _lane(request: Request, default: str) -> str:
+    """Priority lane for a request; the ``X-Priority`` header overrides the endpoint default."""
+    lane = request.headers.get("x-priority", "").strip().lower()
+    return lane if lane in admission.LANES else default
+
+
+def _api_tenant(request: Request) -> Optional[str]:
+    """Tenant for an ``X-API-Key`` caller; the key itself is never used as a label."""
+    api_key = request.headers.get("x-api-key", "").strip()
+    if not api_key:
+        return None
+    return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+def _brand_tenant(brand: Optional[str]) -> str:
+    """A catalog brand (or one named in TENANT_WEIGHTS/TENANT_CAPS) is its own tenant; anything else shares one."""
+    if not brand:
+        return admission.DEFAULT_TENANT
+    configured = set(_ADMISSION.tenant_weights) | set(_ADMISSION.tenant_caps) if _ADMISSION is not None else set()
+    if brand in configured or any(b["name"] == brand for b in _CATALOG.brands()):
+        return brand
+    return admission.OTHER_TENANT
+
+
+def _tenant(request: Optional[Request], brand: Optional[str]) -> str:
+    """Fair-share key: the API key when one is sent, else the brand the request is for."""
+    return (_api_tenant(request) if request is not None else None) or _brand_tenant(brand)
+
+
+def _batch_tenants(request: Request, req: BatchRequest) -> List[str]:
+    return [_tenant(request, item.brand) for item in req.items]
+
+
+def _check_batch(lane: str, tenants: List[str]):
+    """Raise ``Overloaded`` up front if any tenant of a batch would be rejected; slots are taken per chunk later."""
+    if _ADMISSION is None:
+        return
+    for tenant in dict.fromkeys(tenants or [admission.DEFAULT_TENANT]):
+        _ADMISSION.check(lane, tenant)
+
+
+@asynccontextmanager
+async def _admitted(lane: str, tenant: str = admission.DEFAULT_TENANT):
+    if _ADMISSION is None:
+        yield
+        return
+    future = _ADMISSION.acquire(lane, tenant=tenant)
+    try:
+        ticket = await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        _ADMISSION.cancel(future)
+        raise
+    try:
+        yield
+    finally:
+        _ADMISSION.release(ticket)
+
+
+def _acquire_slot(lane: str, tenant: str, token: Optional[CancelToken] = None):
+    """Block until ``tenant`` gets a slot in ``lane``; give up with ``Cancelled`` if ``token`` is."""
+    if _ADMISSION is None:
+        return None
+    future = _ADMISSION.acquire(lane, block=True, tenant=tenant)
+    while True:
+        try:
+            return future.result(timeout=DISCONNECT_POLL_S)
+        except FutureTimeout:
+            if token is not None and token.cancelled:
+                _ADMISSION.cancel(future)
+                raise Cancelled(token.reason)
+
+
+def _release_slot(ticket):
+    if ticket is not None:
+        _ADMISSION.release(ticket)
+
+
+@app.exception_handler(admission.Overloaded)
+async def _overloaded(request: Request, exc: admission.Overloaded):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(ModelCapacityError)
+async def _model_capacity(request: Request, exc: ModelCapacityError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "30"})
+
+
+@app.exception_handler(Cancelled)
+async def _cancelled(request: Request, exc: Cancelled):
+    # A disconnected client never sees this; it is the answer to an expired timeout_ms.
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+
+GENERATE_TIMEOUT_MS = int(os.getenv("GENERATE_TIMEOUT_MS", "0"))
+DISCONNECT_POLL_S = float(os.getenv("DISCONNECT_POLL_MS", "250")) / 1000.0
+
+
+def _cancel_token(timeout_ms: Optional[int]) -> CancelToken:
+    return CancelToken.with_timeout(timeout_ms or GENERATE_TIMEOUT_MS)
+
+
+@asynccontextmanager
+async def _cancel_on_disconnect(request: Request, timeout_ms: Optional[int]):
+    """Yield a request's cancel token, cancelled if the client disconnects before the block ends."""
+    token = _cancel_token(timeout_ms)
+
+    async def watch():
+        while not token.cancelled:
+            if await request.is_disconnected():
+                token.cancel("client disconnected")
+                return
+            await asyncio.sleep(DISCONNECT_POLL_S)
+
+    task = asyncio.get_running_loop().create_task(watch())
+    try:
+        yield token
+    finally:
+        task.cancel()
+
+
+def _admission_state():
+    if _ADMISSION is None:
+        return []
+    lanes = _ADMISSION.stats()["lanes"]
+    return [({"lane": lane, "state": state}, n) for lane, s in lanes.items() for state, n in s.items()]
+
+
+metrics.REGISTRY.gauge("crm_admission", "Admission slots per lane (active, pending, rejected).", func=_admission_state)
+
+
+def _tenant_state():
+    if _ADMISSION is None:
+        return []
+    tenants = _ADMISSION.stats()["tenants"]
+    return [
+        ({"tenant": tenant, "state": state}, s[state])
+        for tenant, s in sorted(tenants.items())
+        for state in ("active", "pending", "granted", "usage_seconds")
+    ]
+
+
+metrics.REGISTRY.gauge(
+    "crm_tenant", "Fair-share scheduler per tenant (active, pending, granted slots, usage_seconds).", func=_tenant_state
+)
+
+
+@app.post("/generate")
+async def generate(req: GenerateRequest, request: Request):
+    _arm_deadline(req)
+    lane, tenant = _lane(request, admission.INTERACTIVE), _tenant(request, req.brand)
+    async with _cancel_on_disconnect(request, req.timeout_ms) as token, _admitted(lane, tenant):
+        try:
+            token.raise_if_cancelled()
+            if req.n <= 1:
+                result = await _BATCHER.submit(req, token)
+                return FastJSONResponse({"result": _project(req, result)})
+            submit = lambda: _submit_candidates(req, coalesce=_coalesces("generate"), token=token)  # noqa: E731
+            if _POOL is not None:
+                results = await asyncio.wrap_future(submit())
+            else:
+                results = await run_in_threadpool(lambda: submit().result())
+            return FastJSONResponse({"results": [_project(req, result) for result in results]})
+        except (ModelCapacityError, Cancelled):
+            raise
+        except Exception as exc:
+            raise HTTPException(status_code=500, detail=str(exc)) from exc
+
+
+@app.post("/generate_batch")
+async def generate_batch(req: BatchRequest, request: Request):
+    lane, tenants = _lane(request, admission.BULK), _batch_tenants(request, req)
+    _check_batch(lane, tenants)
+    async with _cancel_on_disconnect(request, req.timeout_ms) as token:
+        try:
+            results = await run_in_threadpool(
+                _run_chunks, req.apply_defaults(), coalesce=_coalesces("generate_batch"), token=token,
+                lane=lane, tenants=tenants,
+            )
+            return FastJSONResponse({"results": results})
+        except (ModelCapacityError, Cancelled):
+            raise
+        except Exception as exc:
+            raise HTTPException(status_code=500, detail=str(exc)) from exc
+
+
+class RegenerateRequest(BaseModel):
+    """An earlier result (its ``result_id``) with some parameters changed; omitted ones keep their old value."""
+
+    result_id: str
+    persona: Optional[Union[int, str]] = None
+    brand: Optional[str] = None
+    product: Optional[str] = None
+    stage_index: Optional[int] = None
+    style_index: Optional[int] = None
+    is_event: Optional[int] = None
+    top_k: Optional[int] = None
+    qwen_model: Optional[str] = None
+    exa_model: Optional[str] = None
+    seed: Optional[int] = None
+    fields: Optional[List[str]] = None
+    verbose: bool = True
+    timeout_ms: Optional[int] = None
+    deadline_ms: Optional[int] = None
+
+
+@app.post("/regenerate")
+async def regenerate(body: RegenerateRequest, request: Request):
+    """Re-run only the stages the changed parameters invalidate.
+
+    The earlier result's record (request parameters and content-addressed
+    stage ids, see ``stage_store``) is loaded and the changes applied; the
+    leading stages whose inputs are unchanged are reused from the stage
+    store and the rest, always including Exaone, are computed again. A style
+    change reuses highlights, the Qwen draft and CRM snippets; a stage change
+    reuses highlights and the draft (unless the draft carries a stage event).
+    """
+    record = await run_in_threadpool(pipeline.stage_record, body.result_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"unknown or expired result_id: {body.result_id}")
+    params = dict(record["request"], **body.model_dump(include=set(REQUEST_FIELDS), exclude_unset=True))
+    try:
+        req = GenerateRequest(
+            **params,
+            engine=QWEN_EXAONE,
+            fields=body.fields,
+            verbose=body.verbose,
+            timeout_ms=body.timeout_ms,
+            deadline_ms=body.deadline_ms,
+        )
+    except ValidationError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+    req.reuse = reusable_stages(record, params)
+    return await generate(req, request)
+
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up; reports per-component load state."""
+    ready, detail = _readiness()
+    return {"status": "ok", "ready": ready, **detail}
+
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: 200 only once the default models are loaded and warmed."""
+    ready, detail = _readiness()
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, **detail})
+
+
+class SwapRequest(BaseModel):
+    """A new serving version: a new Exaone adapter and/or replacements for the default models."""
+
+    version: str
+    adapter_id: Optional[str] = None
+    qwen_model: Optional[str] = None
+    exa_model: Optional[str] = None
+
+
+def _swap_models(body: SwapRequest, load: bool = True):
+    models = {}
+    if body.qwen_model:
+        models[f"qwen:{DEFAULT_QWEN_MODEL}"] = body.qwen_model
+    if body.exa_model:
+        models[f"exaone:{DEFAULT_EXA_MODEL}"] = body.exa_model
+    data = _shared_data() if load else None
+    return pipeline.swap_version(
+        body.version,
+        adapter_id=body.adapter_id,
+        models=models,
+        warm_args=[_to_args(_warm_request(data))] if load else None,
+        data=data,
+        load=load,
+    )
+
+
+def _pool_swap_task(body_dict, on_event=None, cancel=None):
+    return _swap_models(SwapRequest(**body_dict))
+
+
+def _check_admin(request: Request):
+    """Admin routes fail closed: without ``ADMIN_TOKEN`` configured they are refused outright."""
+    token = os.getenv("ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=403, detail="admin API disabled (ADMIN_TOKEN is not set)")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), token):
+        raise HTTPException(status_code=403, detail="admin token required")
+
+
+@app.get("/admin/models")
+def admin_models(request: Request):
+    _check_admin(request)
+    return {"serving": pipeline.serving(), "models": pipeline._MODEL_REGISTRY.stats()}
+
+
+@app.post("/admin/models")
+def admin_swap_models(body: SwapRequest, request: Request):
+    """Hot-swap the serving models/adapter without dropping traffic.
+
+    The new version is loaded next to the serving one and warmed with a dummy
+    request, then traffic flips to it; requests already running finish on the
+    old models, which are unloaded as soon as they are done. In worker-pool
+    mode the workers swap one at a time, so the rest keep serving meanwhile.
+    Dead workers are skipped and a worker whose swap fails does not stop the
+    others; both are listed in ``failed``.
+    """
+    _check_admin(request)
+    if _POOL is None:
+        return {"serving": _swap_models(body)}
+    workers, failed = [], []
+    for worker in range(_POOL.num_workers):
+        if not _POOL._live(worker):
+            failed.append({"worker": worker, "error": "worker is not running"})
+            continue
+        try:
+            workers.append(_POOL.submit(_pool_swap_task, body.model_dump(), worker=worker).result())
+        except Exception as exc:
+            print(f"[Admin] worker {worker} failed to swap to {body.version}: {exc}")
+            failed.append({"worker": worker, "error": str(exc)})
+    if not workers:
+        raise HTTPException(status_code=502, detail={"message": "no worker swapped", "failed": failed})
+    # The API process serves no models itself; it only needs the version for cache keys.
+    return {"serving": _swap_models(body, load=False), "workers": workers, "failed": failed}
+
+
+_CATALOG = Catalog(str(DATA_DIR))
+_COMPRESS_MIN_BYTES = 1024
+
+
+def _catalog_response(request: Request, payload) -> Response:
+    """JSON with a weak ETag (304 on match), Cache-Control and br/gzip negotiation."""
+    body = fast_json.dumps(payload)
+    etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=300", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    accept = request.headers.get("accept-encoding", "")
+    if len(body) >= _COMPRESS_MIN_BYTES:
+        if brotli is not None and "br" in accept:
+            body = brotli.compress(body)
+            headers["Content-Encoding"] = "br"
+        elif "gzip" in accept:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/brands")
+def api_brands(request: Request):
+    return _catalog_response(request, {"brands": _CATALOG.brands()})
+
+
+@app.get("/api/products")
+def api_products(
+    request: Request,
+    brand: Optional[str] = None,
+    category: Optional[str] = None,
+    q: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 12,
+):
+    page_size = max(1, min(page_size, 100))
+    return _catalog_response(request, _CATALOG.products(brand, category, q, page, page_size))
+
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def _parse_date(value: Optional[str], end: bool = False) -> Optional[float]:
+    """ISO date or datetime -> epoch seconds; a bare ``end`` date covers that whole day."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"invalid date: {value}") from exc
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed.timestamp()
+
+
+@app.get("/results")
+def list_results(
+    brand: Optional[str] = None,
+    stage: Optional[str] = None,
+    persona: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = 50,
+    offset: int = 0,
+):
+    """Past generated results, newest first; ``since``/``until`` are ISO dates (UTC)."""
+    if _RESULTS is None:
+        raise HTTPException(status_code=404, detail="result store is disabled")
+    return _RESULTS.query(
+        brand=brand,
+        stage=stage,
+        persona=persona,
+        since=_parse_date(since),
+        until=_parse_date(until, end=True),
+        limit=max(1, min(limit, 500)),
+        offset=max(0, offset),
+    )
+
+
+def _job_row(row) -> dict:
+    """Validate one batch row (JSON item or CSV line) into GenerateRequest fields."""
+    normalized = pipeline._normalize_row(row)
+    cleaned = {k: v for k, v in normalized.items() if v is not None and v != ""}
+    return GenerateRequest(**cleaned).model_dump()
+
+
+def _run_job_rows(rows):
+    # Background work never gets a 429; each chunk waits its turn in the bulk lane.
+    return _run_chunks(
+        [GenerateRequest(**row) for row in rows], coalesce=_coalesces("jobs"), lane=admission.BULK,
+        tenants=[row.get("tenant") or _tenant(None, row.get("brand")) for row in rows],
+    )
+
+
+def _parse_csv(text: str):
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+@app.post("/jobs")
+async def create_job(request: Request):
+    """Queue a batch as a background job: JSON ``{"items": [...]}``/list, CSV body or CSV upload."""
+    content_type = request.headers.get("content-type", "")
+    disable_cache = False
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or not hasattr(upload, "read"):
+            raise HTTPException(status_code=400, detail="multipart upload needs a 'file' field")
+        rows = _parse_csv((await upload.read()).decode("utf-8-sig"))
+        source = "csv"
+    elif "csv" in content_type:
+        rows = _parse_csv((await request.body()).decode("utf-8-sig"))
+        source = "csv"
+    else:
+        try:
+            payload = await request.json()
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail="body must be JSON or CSV") from exc
+        rows = payload
+        if isinstance(payload, dict):
+            rows = payload.get("items", [])
+            disable_cache = bool(payload.get("disable_cache", False))
+            for key in ("fields", "verbose"):
+                if payload.get(key) is not None and isinstance(rows, list):
+                    rows = [dict(row, **{key: payload[key]}) if isinstance(row, dict) else row for row in rows]
+        source = "json"
+    if not isinstance(rows, list) or not rows:
+        raise HTTPException(status_code=400, detail="job needs at least one row")
+
+    validated = []
+    for idx, row in enumerate(rows):
+        try:
+            item = _job_row(row)
+        except (ValueError, ValidationError) as exc:
+            raise HTTPException(status_code=422, detail=f"row {idx}: {exc}") from exc
+        if disable_cache:
+            item["disable_cache"] = True
+        if _api_tenant(request):
+            item["tenant"] = _api_tenant(request)
+        validated.append(item)
+    return _JOBS.submit(validated, source=source)
+
+
+@app.get("/jobs")
+def list_jobs():
+    return {"jobs": _JOBS.list()}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    status = _JOBS.get(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return status
+
+
+@app.get("/jobs/{job_id}/results")
+def get_job_results(job_id: str):
+    if _JOBS.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    path = _JOBS.results_path(job_id)
+    if not os.path.exists(path):
+        open(path, "a").close()
+    return FileResponse(path, media_type="application/x-ndjson", filename=f"{job_id}.jsonl")
+
+
+def _sse(event: str, payload) -> str:
+    return f"event: {event}\ndata: {fast_json.dumps_str(payload)}\n\n"
+
+
+def _ndjson(event: str, payload) -> Optional[str]:
+    # Per-token deltas are left to the SSE endpoint; a line per item is what NDJSON readers want.
+    if event == "token":
+        return None
+    return fast_json.dumps_str(dict(payload, event=event)) + "\n"
+
+
+def _stream_batch(items: List[GenerateRequest], send, coalesce=False, token=None, lane=None, tenants=None):
+    _run_chunks(
+        items, on_event=send, on_result=lambda i, result: send("result", {"index": i, "result": result}),
+        coalesce=coalesce, token=token, lane=lane, tenants=tenants,
+    )
+
+
+def _event_stream(
+    req: BatchRequest, request: Request, lane: str, render, media_type: str, endpoint: str
+) -> StreamingResponse:
+    """Run ``req`` in the threadpool and stream its events, each formatted by ``render``."""
+    tenants = _batch_tenants(request, req)
+    # Reject before the 200 and the stream start; slots are taken per chunk in run().
+    _check_batch(lane, tenants)
+    req.apply_defaults()
+
+    def work(send, token):
+        _stream_batch(req.items, send, _coalesces(endpoint), token, lane, tenants)
+        return len(req.items)
+
+    return _streaming_response(work, _cancel_token(req.timeout_ms), render, media_type)
+
+
+def _streaming_response(work, token: CancelToken, render, media_type: str) -> StreamingResponse:
+    """Run ``work(send, token)`` in the threadpool and stream what it sends, formatted by ``render``.
+
+    ``work`` returns the ``count`` of the final ``done`` event; an exception
+    ends the stream with an ``error`` event instead.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def send(event, payload):
+        loop.call_soon_threadsafe(queue.put_nowait, (event, payload))
+
+    async def run():
+        try:
+            count = await run_in_threadpool(work, send, token)
+        except Exception as exc:
+            send("error", {"detail": str(exc)})
+        else:
+            send("done", {"count": count})
+
+    async def events():
+        task = loop.create_task(run())
+        try:
+            while True:
+                event, payload = await queue.get()
+                chunk = render(event, payload)
+                if chunk is not None:
+                    yield chunk
+                if event in ("done", "error"):
+                    break
+        finally:
+            if not task.done():
+                # The client went away mid-stream: stop generating for it.
+                token.cancel("client disconnected")
+                task.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/generate_stream")
+async def generate_stream(req: BatchRequest, request: Request):
+    """Server-sent events for a batch: stage events, Exaone tokens, then each result.
+
+    Events: ``qwen_done`` (with the Qwen draft), ``rag_done``, ``token``
+    (``{"index", "text"}``), ``exaone_done`` (a row's final text), ``result``,
+    and finally ``done`` or ``error``.
+    """
+    lane = _lane(request, admission.INTERACTIVE)
+    return _event_stream(req, request, lane, _sse, "text/event-stream", "generate_stream")
+
+
+@app.post("/generate_batch_stream")
+async def generate_batch_stream(req: BatchRequest, request: Request):
+    """/generate_batch as NDJSON: one JSON line per event, written as soon as it happens.
+
+    Every line has an ``event`` key: ``qwen_done`` / ``rag_done`` (stage
+    progress per item), ``exaone_done`` (``{"index", "text"}`` the moment an
+    item's message is decoded), ``result`` (``{"index", "result"}``, projected
+    like /generate_batch) and finally ``done`` or ``error``. Items are indexed
+    in request order but arrive in completion order.
+    """
+    lane = _lane(request, admission.BULK)
+    return _event_stream(req, request, lane, _ndjson, "application/x-ndjson", "generate_batch_stream")
+
+
+def _matrix_cell(req: CampaignMatrixRequest, index: int, result):
+    return {
+        "index": index,
+        "persona": result.get("persona_input"),
+        "stage_index": result.get("stage_index"),
+        "style_index": result.get("style_index"),
+        "result": _project(req, result),
+    }
+
+
+def _cell_request(req: CampaignMatrixRequest, result) -> GenerateRequest:
+    return GenerateRequest(
+        persona=result["persona_input"], brand=req.brand, product=req.product, stage_index=result["stage_index"],
+        style_index=result["style_index"], is_event=req.is_event, top_k=req.top_k, qwen_model=req.qwen_model,
+        exa_model=req.exa_model, disable_cache=req.disable_cache, seed=req.seed,
+    )
+
+
+def _run_matrix(req: CampaignMatrixRequest, lane: str, tenant: str, token: CancelToken, send=None):
+    """Generate the whole grid under one admission slot; ``send`` gets plan/draft/cell events."""
+
+    def on_event(name, payload):
+        if name == "cell":
+            payload = _matrix_cell(req, payload["index"], payload["result"])
+        send(name, payload)
+
+    events = on_event if send is not None else None
+    ticket = _acquire_slot(lane, tenant, token)
+    try:
+        token.raise_if_cancelled()
+        if _POOL is not None:
+            future = _POOL.submit(_pool_matrix_task, req.model_dump(), token.deadline, on_event=events)
+            _link_cancel(future, [token])
+            outputs, plan = future.result()
+        else:
+            outputs, plan = _run_campaign_matrix(req, on_event=events, cancel_token=token)
+    finally:
+        _release_slot(ticket)
+    token.raise_if_cancelled()
+    _ROWS.inc(len(outputs), outcome="generated")
+    _store_results([_cell_request(req, result) for result in outputs], outputs)
+    return outputs, plan
+
+
+@app.post("/campaign_matrix")
+async def campaign_matrix(req: CampaignMatrixRequest, request: Request):
+    """Messages for every persona x stage x style cell of one product.
+
+    Shared work (highlights per persona, a Qwen draft per persona and event,
+    CRM retrieval per stage and draft, template pools per style and stage) is
+    computed once for the whole grid and generation is batched across cells.
+    The response is ``{"plan", "cells"}``; with ``stream`` it is NDJSON with
+    ``plan``, ``qwen_done`` and one ``cell`` line per finished cell, then
+    ``done`` or ``error``. Results are slim unless ``verbose`` or ``fields``.
+    """
+    lane, tenant = _lane(request, admission.BULK), _tenant(request, req.brand)
+    if _ADMISSION is not None:
+        _ADMISSION.check(lane, tenant)
+    if req.stream:
+        def work(send, token):
+            return len(_run_matrix(req, lane, tenant, token, send=send)[0])
+
+        return _streaming_response(work, _cancel_token(req.timeout_ms), _ndjson, "application/x-ndjson")
+    async with _cancel_on_disconnect(request, req.timeout_ms) as token:
+        try:
+            outputs, plan = await run_in_threadpool(_run_matrix, req, lane, tenant, token)
+        except (ModelCapacityError, Cancelled):
+            raise
+        except Exception as exc:
+            raise HTTPException(status_code=500, detail=str(exc)) from exc
+        return FastJSONResponse({"plan": plan, "cells": [_matrix_cell(req, i, r) for i, r in enumerate(outputs)]})
 
 
 app.mount("/data", StaticFiles(directory=str(DATA_DIR)), name="data")
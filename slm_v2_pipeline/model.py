@@ -7,6 +7,7 @@ Polisher: HyperCLOVAX 0.5B (GGUF)
 """
 
 import os
+import threading
 import time
 import warnings
 
@@ -34,20 +35,29 @@ QWEN_4B_PATH = os.path.expanduser(
 
 
 class ModelSingleton:
-    """모델 싱글톤 부모 클래스"""
+    """모델 싱글톤 부모 클래스
+
+    llama.cpp 모델 하나는 동시에 한 요청만 디코딩할 수 있으므로, 서버의 여러 스레드가
+    같은 모델을 쓸 때는 모델별 락으로 차례대로 생성합니다.
+    """
     _instance = None
     _model = None
     _path = None
+    _init_lock = threading.Lock()
     
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
+        with ModelSingleton._init_lock:
+            if cls._instance is None:
+                cls._instance = super().__new__(cls)
+                cls._instance._lock = threading.Lock()
         return cls._instance
     
     def _load_model(self, name):
-        if self._model is not None:
-            return
-        
+        with self._lock:
+            if self._model is None:
+                self._load(name)
+
+    def _load(self, name):
         print(f"[{name}] 모델 로딩 중: {os.path.basename(self._path)}...")
         import llama_cpp
         self._model = llama_cpp.Llama(
@@ -61,14 +71,15 @@ class ModelSingleton:
         print(f"[{name}] 모델 로딩 완료 ✓")
     
     def generate(self, messages, max_tokens=300, temperature=0.5):
-        t_start = time.time()
-        response = self._model.create_chat_completion(
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            top_p=0.9,
-            repeat_penalty=1.1,
-        )
+        with self._lock:
+            t_start = time.time()
+            response = self._model.create_chat_completion(
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=0.9,
+                repeat_penalty=1.1,
+            )
         text = response['choices'][0]['message']['content']
         duration = time.time() - t_start
         return text.strip(), duration
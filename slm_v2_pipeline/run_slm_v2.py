@@ -15,24 +15,36 @@ import sys
 import time
 from datetime import datetime, timezone
 
-# 현재 폴더 기준 import
-pipeline_dir = os.path.dirname(os.path.abspath(__file__))
-sys.path.insert(0, pipeline_dir)
-
-# 부모 폴더(src)도 추가 (rag_utils, generate_marketing 사용 위함)
-src_dir = os.path.join(os.path.dirname(pipeline_dir), 'src')
-if os.path.exists(src_dir):
-    sys.path.insert(0, src_dir)
-
-from steps_v2 import (
-    ReviewSummarizer,
-    BriefGenerator,
-    PersonaWriter,
-    GoalSetter,
-    BrandStyler,
-    FinalPolisher,
-)
-from keyword_tokenizer import preprocess_reviews_with_frequency, preprocess_reviews_with_sentiment
+if __package__:
+    # 패키지로 import된 경우(server.py의 slm_v2 엔진): sys.path를 건드리지 않음
+    from .steps_v2 import (
+        ReviewSummarizer,
+        BriefGenerator,
+        PersonaWriter,
+        GoalSetter,
+        BrandStyler,
+        FinalPolisher,
+    )
+    from .keyword_tokenizer import preprocess_reviews_with_frequency, preprocess_reviews_with_sentiment
+else:
+    # 현재 폴더 기준 import
+    pipeline_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, pipeline_dir)
+
+    # 부모 폴더(src)도 추가 (rag_utils, generate_marketing 사용 위함)
+    src_dir = os.path.join(os.path.dirname(pipeline_dir), 'src')
+    if os.path.exists(src_dir):
+        sys.path.insert(0, src_dir)
+
+    from steps_v2 import (
+        ReviewSummarizer,
+        BriefGenerator,
+        PersonaWriter,
+        GoalSetter,
+        BrandStyler,
+        FinalPolisher,
+    )
+    from keyword_tokenizer import preprocess_reviews_with_frequency, preprocess_reviews_with_sentiment
 
 
 def load_json(path):
@@ -79,52 +91,23 @@ def top_highlights_for_product(persona, product, top_k=3):
     return highlights
 
 
-def main():
-    parser = argparse.ArgumentParser(description='SLM-Optimized 6-Stage CRM Pipeline')
-    parser.add_argument('--persona', required=True, help='페르소나 인덱스(0~) 또는 이름')
-    parser.add_argument('--brand', required=True, help='브랜드명 (에뛰드, 설화수, 이니스프리, 라네즈, 헤라, 에스트라)')
-    parser.add_argument('--product', required=True, help='제품명 (부분 일치 가능)')
-    parser.add_argument('--stage_index', type=int, required=True, help='CRM 목적 인덱스 (0=Acquisition, 1=Activation, 2=Retention, 3=Revenue, 4=Referral)')
-    parser.add_argument('--top_k', type=int, default=3, help='리뷰 Top-K')
-    parser.add_argument('--out_dir', default=None, help='출력 디렉토리')
-    args = parser.parse_args()
+def run_steps(persona, product, brand, aarrr_stage, highlights_data, log=print, check=None):
+    """한 메시지에 대한 Step 0~6 실행 (파일 저장 없음)
 
-    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    data_dir = os.path.join(base, 'data')
-    
-    # 인덱스를 기반으로 AARRR 스테이지 문자열 설정
-    if 0 <= args.stage_index < len(STAGE_ORDER):
-        aarrr_stage = STAGE_ORDER[args.stage_index]
-    else:
-        aarrr_stage = STAGE_ORDER[0]
-        print(f"[경고] 잘못된 stage_index. 기본값({aarrr_stage})으로 진행합니다.")
-
-    # 데이터 로드
-    personas = load_json(os.path.join(data_dir, 'personas.json'))
-    products = load_json(os.path.join(data_dir, 'products.json'))
-    
-    persona = find_persona(personas, args.persona)
-    product = find_product(products, args.brand, args.product)
+    데이터 로드와 하이라이트 추출은 호출하는 쪽에서 합니다(CLI는 매번, 서버는 미리 로드한 데이터).
+    ``check``는 모델 단계마다 먼저 호출되며, 예외를 던지면 그 자리에서 중단합니다.
+    """
+    check = check or (lambda: None)
     persona_name = persona.get('name', 'default')
-    product_name = product.get('name', args.product)
-    
-    # 출력 디렉토리 설정
-    out_dir = args.out_dir or os.path.join(base, 'outputs', 'slm_v2_logs')
-    os.makedirs(out_dir, exist_ok=True)
-
-    print(f"\n{'='*60}")
-    print(f"[SLM v2 Pipeline] {args.brand} - {product_name}")
-    print(f"[Persona] {persona_name} | [Stage] {aarrr_stage}")
-    print(f"{'='*60}\n")
+    product_name = product.get('name', '')
 
     timeline = []
     total_start = time.time()
 
     # === Step 0: 하이라이트 추출 (RAG) & 빈도수 키워드 추출 ===
-    print("[Step 0/7] 데이터 추출 중 (RAG & Tokenizer)...")
+    log("[Step 0/7] 데이터 추출 중 (RAG & Tokenizer)...")
     
     # 1. RAG 하이라이트
-    highlights_data = top_highlights_for_product(persona, product, top_k=args.top_k)
     highlight_texts = [h['snippet'] for h in highlights_data]
     rag_str = ', '.join(highlight_texts) if highlight_texts else ""
     
@@ -136,58 +119,61 @@ def main():
     # 두 소스 결합
     combined_input = f"RAG 하이라이트: {rag_str}\n빈도수 높은 키워드: {freq_keywords_str}"
     
-    print(f"  ✓ RAG 하이라이트: {rag_str[:60]}...")
-    print(f"  ✓ 빈도 Top-15: {freq_keywords_str[:60]}...\n")
+    log(f"  ✓ RAG 하이라이트: {rag_str[:60]}...")
+    log(f"  ✓ 빈도 Top-15: {freq_keywords_str[:60]}...\n")
 
+    check()
     # === Step 1: ReviewSummarizer (긍정 키워드 추출) ===
-    print("[Step 1/7] 리뷰에서 긍정 키워드 추출 중...")
+    log("[Step 1/7] 리뷰에서 긍정 키워드 추출 중...")
     # 결합된 입력을 전달
     positive_kw, dur0 = ReviewSummarizer().run(combined_input)
     timeline.append({"step": "ReviewSummarizer", "duration": dur0})
-    print(f"  ✓ 완료 ({dur0:.1f}s)")
-    print(f"  ✨ 긍정 키워드: {positive_kw[:80]}...\n")
+    log(f"  ✓ 완료 ({dur0:.1f}s)")
+    log(f"  ✨ 긍정 키워드: {positive_kw[:80]}...\n")
 
+    check()
     # === Step 2: BriefGenerator (키워드 정리) ===
-    print("[Step 2/7] 키워드 정리 중...")
+    log("[Step 2/7] 키워드 정리 중...")
     keywords1, dur1 = BriefGenerator().run(product_name, positive_kw)
     timeline.append({"step": "BriefGenerator", "duration": dur1})
-    print(f"  ✓ 완료 ({dur1:.1f}s)")
-    print(f"  📝 Keywords: {keywords1[:100]}...\n")
+    log(f"  ✓ 완료 ({dur1:.1f}s)")
+    log(f"  📝 Keywords: {keywords1[:100]}...\n")
 
+    check()
     # === Step 3: PersonaWriter (감정 키워드 추가) ===
-    print("[Step 3/7] 감정 키워드 추가 중...")
+    log("[Step 3/7] 감정 키워드 추가 중...")
     keywords2, dur2 = PersonaWriter().run(keywords1, persona_name)
     timeline.append({"step": "PersonaWriter", "duration": dur2})
-    print(f"  ✓ 완료 ({dur2:.1f}s)")
-    print(f"  👤 Keywords: {keywords2[:100]}...\n")
+    log(f"  ✓ 완료 ({dur2:.1f}s)")
+    log(f"  👤 Keywords: {keywords2[:100]}...\n")
 
     # === Step 4: GoalSetter (CTA 키워드 추가) ===
-    print("[Step 4/7] CTA 키워드 추가 중...")
+    log("[Step 4/7] CTA 키워드 추가 중...")
     keywords3, dur3 = GoalSetter().run(keywords2, aarrr_stage)
     timeline.append({"step": "GoalSetter", "duration": dur3})
-    print(f"  ✓ 완료 ({dur3:.1f}s)")
-    print(f"  🎯 Keywords: {keywords3[:100]}...\n")
+    log(f"  ✓ 완료 ({dur3:.1f}s)")
+    log(f"  🎯 Keywords: {keywords3[:100]}...\n")
 
+    check()
     # === Step 5: BrandStyler (문장 조합) ===
-    print("[Step 5/7] 브랜드 스타일 문장 생성 중...")
-    styled, dur4 = BrandStyler().run(keywords3, args.brand)
+    log("[Step 5/7] 브랜드 스타일 문장 생성 중...")
+    styled, dur4 = BrandStyler().run(keywords3, brand)
     timeline.append({"step": "BrandStyler", "duration": dur4})
-    print(f"  ✓ 완료 ({dur4:.1f}s)")
-    print(f"  🎨 Styled: {styled}\n")
+    log(f"  ✓ 완료 ({dur4:.1f}s)")
+    log(f"  🎨 Styled: {styled}\n")
 
+    check()
     # === Step 6: FinalPolisher (본문 윤문 - 클로바) ===
-    print("[Step 6/6] 본문 윤문 중 (클로바)...")
+    log("[Step 6/6] 본문 윤문 중 (클로바)...")
     body, dur5 = FinalPolisher().run(styled)
     timeline.append({"step": "FinalPolisher", "duration": dur5})
-    print(f"  ✓ 완료 ({dur5:.1f}s)")
-    print(f"  ✨ Body: {body}\n")
+    log(f"  ✓ 완료 ({dur5:.1f}s)")
+    log(f"  ✨ Body: {body}\n")
 
     total_duration = time.time() - total_start
 
-    # === 결과 저장 ===
-    timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
-    output = {
-        "brand": args.brand,
+    return {
+        "brand": brand,
         "product": product_name,
         "persona": persona_name,
         "stage": aarrr_stage,
@@ -205,9 +191,56 @@ def main():
         "final_output": body,
         "timeline": timeline,
         "total_duration_seconds": total_duration,
-        "timestamp": timestamp,
     }
 
+
+def main():
+    parser = argparse.ArgumentParser(description='SLM-Optimized 6-Stage CRM Pipeline')
+    parser.add_argument('--persona', required=True, help='페르소나 인덱스(0~) 또는 이름')
+    parser.add_argument('--brand', required=True, help='브랜드명 (에뛰드, 설화수, 이니스프리, 라네즈, 헤라, 에스트라)')
+    parser.add_argument('--product', required=True, help='제품명 (부분 일치 가능)')
+    parser.add_argument('--stage_index', type=int, required=True, help='CRM 목적 인덱스 (0=Acquisition, 1=Activation, 2=Retention, 3=Revenue, 4=Referral)')
+    parser.add_argument('--top_k', type=int, default=3, help='리뷰 Top-K')
+    parser.add_argument('--out_dir', default=None, help='출력 디렉토리')
+    args = parser.parse_args()
+
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    data_dir = os.path.join(base, 'data')
+    
+    # 인덱스를 기반으로 AARRR 스테이지 문자열 설정
+    if 0 <= args.stage_index < len(STAGE_ORDER):
+        aarrr_stage = STAGE_ORDER[args.stage_index]
+    else:
+        aarrr_stage = STAGE_ORDER[0]
+        print(f"[경고] 잘못된 stage_index. 기본값({aarrr_stage})으로 진행합니다.")
+
+    # 데이터 로드
+    personas = load_json(os.path.join(data_dir, 'personas.json'))
+    products = load_json(os.path.join(data_dir, 'products.json'))
+    
+    persona = find_persona(personas, args.persona)
+    product = find_product(products, args.brand, args.product)
+    persona_name = persona.get('name', 'default')
+    product_name = product.get('name', args.product)
+    
+    # 출력 디렉토리 설정
+    out_dir = args.out_dir or os.path.join(base, 'outputs', 'slm_v2_logs')
+    os.makedirs(out_dir, exist_ok=True)
+
+    print(f"\n{'='*60}")
+    print(f"[SLM v2 Pipeline] {args.brand} - {product_name}")
+    print(f"[Persona] {persona_name} | [Stage] {aarrr_stage}")
+    print(f"{'='*60}\n")
+
+    highlights_data = top_highlights_for_product(persona, product, top_k=args.top_k)
+    result = run_steps(persona, product, args.brand, aarrr_stage, highlights_data)
+    body = result["final_output"]
+    total_duration = result["total_duration_seconds"]
+
+    # === 결과 저장 ===
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    output = dict(result, timestamp=timestamp)
+
     out_path = os.path.join(out_dir, f"slm_v2_{args.brand}_{timestamp}.json")
     with open(out_path, 'w', encoding='utf-8') as f:
         json.dump(output, f, ensure_ascii=False, indent=2)
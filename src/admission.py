@@ -0,0 +1,251 @@
+"""
+생성 서버 입장 제어(Admission control)
+
+동시에 처리할 수 있는 요청 수(슬롯)를 제한하고, 슬롯을 기다리는 요청은 레인별
+대기열에 쌓습니다. 대기열이 가득 차면 바로 `Overloaded`를 던져 429로 응답할 수
+있게 합니다(이미 연산을 쓴 뒤 타임아웃되는 것보다 빠르게 거절).
+
+레인
+  interactive : 프론트엔드 호출(/generate, /generate_stream). 빈 슬롯을 항상 먼저 받습니다.
+  bulk        : 배치/작업 호출. 전체 슬롯 중 bulk_share 비율까지만 사용해 UI를 굶기지 않습니다.
+
+테넌트(가중 공정 큐잉)
+  각 레인 안에서는 테넌트(API 키 또는 브랜드)별로 대기열을 나누고, 테넌트가 사용한
+  생성 시간을 가중치로 나눈 가상 시간(virtual time)이 가장 작은 테넌트에게 다음 슬롯을
+  줍니다. 큰 배치를 올린 팀이 있어도 다른 팀의 요청은 슬롯 하나가 빌 때마다 끼어들 수
+  있고, 테넌트별 동시 실행 상한(cap)으로 한 팀이 모든 슬롯을 차지하지 못하게 합니다.
+  실행/대기 중인 요청이 없고 가상 시간이 다른 테넌트보다 앞서지 않은 테넌트는 상태를 지웁니다
+  (다시 오면 현재 최솟값에서 시작하므로 결과는 같고, 테넌트 수가 계속 늘지 않습니다).
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+DEFAULT_TENANT = "default"
+# Bucket for tenants the server does not know (e.g. a brand outside the catalog).
+OTHER_TENANT = "other"
+
+
+class Overloaded(Exception):
+    """Raised when a lane's pending queue is full."""
+
+    def __init__(self, lane, retry_after):
+        super().__init__(f"{lane} queue is full, retry after {retry_after}s")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded concurrency with per-lane pending queues and strict interactive priority.
+
+    ``acquire(lane, tenant=...)`` returns a ``concurrent.futures.Future`` that
+    resolves to a ticket once a slot is granted; pass the ticket to
+    ``release``. The average slot hold time (EWMA) is used to estimate
+    ``Retry-After``.
+
+    Within a lane, waiting tenants are served in weighted fair order: each
+    grant charges the tenant the expected hold time divided by its weight
+    (corrected to the real hold time on release), and the tenant with the
+    least charged time goes next. ``tenant_caps`` (or ``tenant_max_concurrency``
+    for everyone else) limits how many slots one tenant may hold at once.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=8,
+        max_pending=64,
+        bulk_share=0.5,
+        ewma_alpha=0.2,
+        tenant_weights=None,
+        tenant_caps=None,
+        tenant_max_concurrency=0,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_pending = max(0, max_pending)
+        self.bulk_slots = max(1, int(self.max_concurrency * bulk_share))
+        self.ewma_alpha = ewma_alpha
+        self.service_time = None
+        self.tenant_weights = dict(tenant_weights or {})
+        self.tenant_caps = dict(tenant_caps or {})
+        self.tenant_max_concurrency = max(0, tenant_max_concurrency)
+        self._lock = threading.Lock()
+        self._active = {lane: 0 for lane in LANES}
+        self._pending = {lane: {} for lane in LANES}
+        self._rejected = {lane: 0 for lane in LANES}
+        self._tenants = {}
+
+    # ----- tenants (caller holds self._lock) -----
+    def _tenant(self, tenant):
+        state = self._tenants.get(tenant)
+        if state is None:
+            state = self._tenants[tenant] = {"active": 0, "vtime": 0.0, "usage": 0.0, "granted": 0}
+        return state
+
+    def _weight(self, tenant):
+        return max(1e-6, float(self.tenant_weights.get(tenant, 1.0)))
+
+    def _cap(self, tenant):
+        return self.tenant_caps.get(tenant, self.tenant_max_concurrency)
+
+    def _pending_count(self, lane):
+        return sum(len(q) for q in self._pending[lane].values())
+
+    def _backlogged(self, tenant):
+        return self._tenants[tenant]["active"] > 0 or any(tenant in self._pending[lane] for lane in LANES)
+
+    def _prune(self):
+        """Forget idle tenants whose state no longer matters for fairness.
+
+        A tenant with nothing running or queued would restart at the busy
+        minimum anyway, unless it is still ahead of it (it used more than its
+        share and must wait that off); only those stay.
+        """
+        busy = [state["vtime"] for t, state in self._tenants.items() if self._backlogged(t)]
+        floor = min(busy) if busy else None
+        for tenant in [t for t in self._tenants if not self._backlogged(t)]:
+            if floor is None or self._tenants[tenant]["vtime"] <= floor:
+                del self._tenants[tenant]
+
+    def _catch_up(self, tenant):
+        """A tenant returning from idle starts at the current minimum, not with banked credit."""
+        busy = [self._tenants[t]["vtime"] for t in self._tenants if t != tenant and self._backlogged(t)]
+        state = self._tenant(tenant)
+        if busy:
+            state["vtime"] = max(state["vtime"], min(busy))
+
+    # ----- slots (caller holds self._lock) -----
+    def _can_start(self, lane, tenant=None):
+        if sum(self._active.values()) >= self.max_concurrency:
+            return False
+        if lane == BULK and self._active[BULK] >= self.bulk_slots:
+            return False
+        if tenant is not None:
+            cap = self._cap(tenant)
+            state = self._tenants.get(tenant)
+            if cap and state is not None and state["active"] >= cap:
+                return False
+        return True
+
+    def _grant(self, lane, tenant, future):
+        # A waiter that gave up (e.g. client disconnected) is skipped.
+        if not future.set_running_or_notify_cancel():
+            return
+        state = self._tenant(tenant)
+        charge = (self.service_time or 1.0) / self._weight(tenant)
+        state["active"] += 1
+        state["granted"] += 1
+        state["vtime"] += charge
+        self._active[lane] += 1
+        future.set_result({"lane": lane, "tenant": tenant, "started_at": time.time(), "charge": charge})
+
+    def _next_tenant(self, lane):
+        eligible = [t for t, q in self._pending[lane].items() if q and self._can_start(lane, t)]
+        if not eligible:
+            return None
+        return min(eligible, key=lambda t: self._tenants[t]["vtime"])
+
+    def _dispatch(self):
+        for lane in LANES:
+            queues = self._pending[lane]
+            while self._can_start(lane):
+                tenant = self._next_tenant(lane)
+                if tenant is None:
+                    break
+                future = queues[tenant].popleft()
+                if not queues[tenant]:
+                    del queues[tenant]
+                self._grant(lane, tenant, future)
+
+    def retry_after(self):
+        """Seconds until a queued request would likely start, at least 1."""
+        service_time = self.service_time or 1.0
+        waiting = sum(self._pending_count(lane) for lane in LANES) + 1
+        return max(1, math.ceil(service_time * waiting / self.max_concurrency))
+
+    def check(self, lane=INTERACTIVE, tenant=DEFAULT_TENANT):
+        """Raise ``Overloaded`` if ``lane`` would reject a new request right now."""
+        lane = lane if lane in LANES else INTERACTIVE
+        with self._lock:
+            pending = self._pending_count(lane)
+            busy = bool(pending) or not self._can_start(lane, tenant)
+            if busy and pending >= self.max_pending:
+                self._rejected[lane] += 1
+                raise Overloaded(lane, self.retry_after())
+
+    def acquire(self, lane=INTERACTIVE, block=False, tenant=DEFAULT_TENANT):
+        """Request a slot. ``block=True`` queues even past ``max_pending`` (background work)."""
+        lane = lane if lane in LANES else INTERACTIVE
+        future = Future()
+        with self._lock:
+            if tenant not in self._tenants or not self._backlogged(tenant):
+                self._catch_up(tenant)
+            if not block and self._pending_count(lane) >= self.max_pending and not self._can_start(lane, tenant):
+                self._rejected[lane] += 1
+                self._prune()
+                raise Overloaded(lane, self.retry_after())
+            self._pending[lane].setdefault(tenant, deque()).append(future)
+            self._dispatch()
+        return future
+
+    def cancel(self, future):
+        """Give up a pending acquire; releases the slot if it was already granted."""
+        with self._lock:
+            for queues in self._pending.values():
+                for tenant, queue in queues.items():
+                    if future in queue:
+                        queue.remove(future)
+                        if not queue:
+                            del queues[tenant]
+                        self._prune()
+                        return
+        if future.done() and not future.cancelled():
+            self.release(future.result())
+
+    def release(self, ticket):
+        with self._lock:
+            lane, tenant = ticket["lane"], ticket["tenant"]
+            self._active[lane] -= 1
+            elapsed = time.time() - ticket["started_at"]
+            state = self._tenants[tenant]
+            state["active"] -= 1
+            state["usage"] += elapsed
+            # Replace the up-front estimate with the time the slot was really held.
+            state["vtime"] += elapsed / self._weight(tenant) - ticket["charge"]
+            if self.service_time is None:
+                self.service_time = elapsed
+            else:
+                self.service_time += self.ewma_alpha * (elapsed - self.service_time)
+            self._dispatch()
+            self._prune()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "service_time": self.service_time,
+                "lanes": {
+                    lane: {
+                        "active": self._active[lane],
+                        "pending": self._pending_count(lane),
+                        "rejected": self._rejected[lane],
+                    }
+                    for lane in LANES
+                },
+                "tenants": {
+                    tenant: {
+                        "active": state["active"],
+                        "pending": sum(len(self._pending[lane].get(tenant, ())) for lane in LANES),
+                        "granted": state["granted"],
+                        "usage_seconds": state["usage"],
+                        "weight": self._weight(tenant),
+                        "cap": self._cap(tenant),
+                    }
+                    for tenant, state in self._tenants.items()
+                },
+            }
@@ -0,0 +1,164 @@
+"""
+생성 취소(클라이언트 연결 끊김 / 요청 마감 시간)
+
+요청마다 CancelToken을 두고, 클라이언트가 떠나거나 마감 시간이 지나면 취소 상태가 됩니다.
+  - 대기 중인 배치 항목은 시작 전에 버려지고
+  - 진행 중인 `model.generate`는 StoppingCriteria로 다음 디코딩 스텝에서 해당 행만 멈춥니다
+    (배치의 다른 행은 계속 생성)
+
+마감 시간은 에포크 초(time.time)로 저장하므로 워커 프로세스에도 그대로 전달됩니다.
+"""
+
+import threading
+import time
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+
+class Cancelled(Exception):
+    """The request was cancelled (client disconnected or its deadline passed)."""
+
+
+class CancelToken:
+    """Cancellation flag for one request, with an optional absolute deadline (epoch seconds)."""
+
+    def __init__(self, deadline=None):
+        self._deadline = deadline
+        self._reason = None
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @classmethod
+    def with_timeout(cls, timeout_ms=None):
+        return cls(time.time() + timeout_ms / 1000.0 if timeout_ms else None)
+
+    @property
+    def deadline(self):
+        return self._deadline
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    @property
+    def reason(self):
+        if self._reason is None and self.deadline is not None and time.time() >= self.deadline:
+            return "deadline exceeded"
+        return self._reason
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self._reason is not None:
+                return
+            self._reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Call ``callback()`` once when ``cancel`` is called (not when the deadline passes)."""
+        with self._lock:
+            if self._reason is None:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def raise_if_cancelled(self):
+        reason = self.reason
+        if reason is not None:
+            raise Cancelled(reason)
+
+
+class JointToken(CancelToken):
+    """Cancelled only once every member is: work shared by several callers (coalesced requests)."""
+
+    def __init__(self, members=()):
+        super().__init__()
+        self._members = []
+        for member in members:
+            self.add(member)
+
+    def add(self, member):
+        with self._lock:
+            self._members.append(member)
+        member.on_cancel(self._check)
+
+    @property
+    def deadline(self):
+        """The latest member deadline, or None if any member can wait forever."""
+        with self._lock:
+            deadlines = [m.deadline for m in self._members]
+        if not deadlines or None in deadlines:
+            return None
+        return max(deadlines)
+
+    def _check(self):
+        with self._lock:
+            members = list(self._members)
+        if members and all(m.cancelled for m in members):
+            self.cancel(members[0].reason)
+
+    @property
+    def reason(self):
+        if self._reason is not None:
+            return self._reason
+        with self._lock:
+            members = list(self._members)
+        if members and all(m.cancelled for m in members):
+            return members[0].reason
+        return None
+
+
+class AnyToken(CancelToken):
+    """Cancelled as soon as any member is, e.g. a row's caller token plus its own fallback deadline."""
+
+    def __init__(self, members=()):
+        super().__init__()
+        self._members = [member for member in members if member is not None]
+
+    @property
+    def deadline(self):
+        deadlines = [m.deadline for m in self._members if m.deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    @property
+    def reason(self):
+        if self._reason is not None:
+            return self._reason
+        for member in self._members:
+            if member.cancelled:
+                return member.reason
+        return None
+
+
+def all_cancelled(tokens):
+    """True when there is at least one token and every row has a cancelled one."""
+    tokens = list(tokens)
+    return bool(tokens) and all(token is not None and token.cancelled for token in tokens)
+
+
+class CancelCriteria(StoppingCriteria):
+    """Stops each row of a ``generate`` call whose token is cancelled, at the next decode step.
+
+    ``tokens`` has one entry (or None) per input row; with ``num_return_sequences``
+    each input row's token covers its ``rows_per_token`` output rows.
+    """
+
+    def __init__(self, tokens, rows_per_token=1):
+        self.tokens = list(tokens)
+        self.rows_per_token = max(1, rows_per_token)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        flags = []
+        for token in self.tokens:
+            flags.extend([token is not None and token.cancelled] * self.rows_per_token)
+        return torch.tensor(flags, dtype=torch.bool, device=input_ids.device)
+
+
+def stopping_criteria(tokens, rows_per_token=1):
+    """A StoppingCriteriaList for ``model.generate``, or None when no row can be cancelled."""
+    tokens = list(tokens or [])
+    if not any(token is not None for token in tokens):
+        return None
+    return StoppingCriteriaList([CancelCriteria(tokens, rows_per_token=rows_per_token)])
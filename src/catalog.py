@@ -0,0 +1,98 @@
+"""
+프론트엔드용 제품 카탈로그
+
+products.json / brand_stories.json을 읽어 리뷰 등 무거운 필드를 뺀 목록을 만들고,
+브랜드/카테고리/검색어 필터와 페이지 단위 조회를 제공합니다.
+파일이 바뀌면(mtime) 다음 조회 때 다시 읽습니다.
+"""
+
+import json
+import os
+import threading
+
+PRODUCT_FIELDS = ("product_id", "name", "brand_name", "price", "category", "sub_category")
+
+
+def slim_product(product):
+    slim = {key: product.get(key) for key in PRODUCT_FIELDS}
+    images = product.get("image_urls") or []
+    slim["image_url"] = images[0] if images else None
+    return slim
+
+
+def product_category(product):
+    return product.get("sub_category") or product.get("category")
+
+
+class Catalog:
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._products = []
+        self._brands = []
+
+    def _path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def _mtime(self, name):
+        try:
+            return os.path.getmtime(self._path(name))
+        except OSError:
+            return None
+
+    def _load_json(self, name, default):
+        try:
+            with open(self._path(name), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            print(f"[Catalog] {name} not found; serving an empty list")
+            return default
+
+    def _refresh(self):
+        stamp = (self._mtime("products.json"), self._mtime("brand_stories.json"))
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            products = [slim_product(p) for p in self._load_json("products.json", [])]
+            stories = self._load_json("brand_stories.json", {})
+            counts = {}
+            for p in products:
+                counts[p["brand_name"]] = counts.get(p["brand_name"], 0) + 1
+            self._brands = [
+                {
+                    "name": name,
+                    "name_en": story.get("name_en"),
+                    "story": story.get("story"),
+                    "product_count": counts.get(name, 0),
+                }
+                for name, story in stories.items()
+            ]
+            self._products = products
+            self._stamp = stamp
+
+    def brands(self):
+        self._refresh()
+        return self._brands
+
+    def products(self, brand=None, category=None, q=None, page=1, page_size=12):
+        """One page of slim products plus the brand's categories (for the picker tabs)."""
+        self._refresh()
+        items = self._products
+        if brand:
+            items = [p for p in items if p["brand_name"] == brand]
+        categories = list(dict.fromkeys(product_category(p) for p in items if product_category(p)))
+        if category and category != "all":
+            items = [p for p in items if product_category(p) == category]
+        if q:
+            needle = q.strip().lower()
+            items = [p for p in items if needle in (p["name"] or "").lower()]
+        page = max(1, page)
+        start = (page - 1) * page_size
+        return {
+            "items": items[start:start + page_size],
+            "total": len(items),
+            "page": page,
+            "page_size": page_size,
+            "categories": categories,
+        }
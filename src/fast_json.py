@@ -0,0 +1,27 @@
+"""
+빠른 JSON 직렬화
+
+orjson이 설치되어 있으면 사용하고, 없으면 표준 json으로 같은 출력(UTF-8, 한글 그대로)을 만듭니다.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj, indent=False) -> bytes:
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj, indent=False) -> str:
+    return dumps(obj, indent=indent).decode("utf-8")
@@ -20,6 +20,7 @@ from transformers import AutoModelForCausalLM, AutoTokenizer
 
 sys.path.insert(0, os.path.dirname(__file__))
 from rag_utils import vectorize_texts, cosine, extract_candidate_texts, extract_highlight_snippet, build_persona_query
+from sampling import sampling
 
 
 @lru_cache(maxsize=None)
@@ -31,12 +32,24 @@ def load_json(path):
 
 _PERSONA_INDEX_CACHE = {}
 _PRODUCT_INDEX_CACHE = {}
+# Indexes are keyed by id(); a few are kept so data re-read per request cannot pile up.
+_INDEX_CACHE_SIZE = 8
+
+
+def _remember_index(cache, key, entry):
+    cache.pop(key, None)
+    while len(cache) >= _INDEX_CACHE_SIZE:
+        try:
+            cache.pop(next(iter(cache)), None)
+        except (StopIteration, RuntimeError):  # emptied/changed by another thread
+            break
+    cache[key] = entry
 
 
 def _get_persona_index(personas):
     key = id(personas)
     cached = _PERSONA_INDEX_CACHE.get(key)
-    if cached and cached.get("length") == len(personas):
+    if cached and cached.get("source") is personas and cached.get("length") == len(personas):
         return cached.get("index", {})
 
     index = {}
@@ -46,14 +59,14 @@ def _get_persona_index(personas):
             index[name] = persona
         index[str(idx)] = persona
 
-    _PERSONA_INDEX_CACHE[key] = {"length": len(personas), "index": index}
+    _remember_index(_PERSONA_INDEX_CACHE, key, {"source": personas, "length": len(personas), "index": index})
     return index
 
 
 def _get_product_index(products):
     key = id(products)
     cached = _PRODUCT_INDEX_CACHE.get(key)
-    if cached and cached.get("length") == len(products):
+    if cached and cached.get("source") is products and cached.get("length") == len(products):
         return cached
 
     exact = {}
@@ -66,8 +79,8 @@ def _get_product_index(products):
         if brand:
             by_brand.setdefault(brand, []).append(product)
 
-    cached = {"length": len(products), "exact": exact, "by_brand": by_brand}
-    _PRODUCT_INDEX_CACHE[key] = cached
+    cached = {"source": products, "length": len(products), "exact": exact, "by_brand": by_brand}
+    _remember_index(_PRODUCT_INDEX_CACHE, key, cached)
     return cached
 
 
@@ -165,8 +178,11 @@ class LocalQwenGenerator:
             }
         print("[로컬 Qwen] 모델 로딩 완료")
     
-    def generate_text(self, messages, max_tokens=512, temperature=0.1):
-        """Generate text using the local model."""
+    def generate_text(self, messages, max_tokens=512, temperature=0.1, seed=None, stopping_criteria=None):
+        """Generate text using the local model. A seed makes sampling reproducible.
+
+        ``stopping_criteria`` (e.g. from ``cancellation.stopping_criteria``) can end decoding early.
+        """
         try:
             input_text = self.tokenizer.apply_chat_template(
                 messages,
@@ -185,28 +201,31 @@ class LocalQwenGenerator:
             max_length=2048
         ).to(self.device)
         
-        try:
-            with torch.inference_mode():
-                output_ids = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_tokens,
-                    temperature=temperature,
-                    top_p=0.9,
-                    do_sample=True,
-                    repetition_penalty=1.1,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
-        except AttributeError:
-            with torch.no_grad():
-                output_ids = self.model.generate(
-                    **inputs,
-                    max_new_tokens=max_tokens,
-                    temperature=temperature,
-                    top_p=0.9,
-                    do_sample=True,
-                    repetition_penalty=1.1,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
+        with sampling(seed):
+            try:
+                with torch.inference_mode():
+                    output_ids = self.model.generate(
+                        **inputs,
+                        max_new_tokens=max_tokens,
+                        temperature=temperature,
+                        top_p=0.9,
+                        do_sample=True,
+                        repetition_penalty=1.1,
+                        pad_token_id=self.tokenizer.eos_token_id,
+                        stopping_criteria=stopping_criteria
+                    )
+            except AttributeError:
+                with torch.no_grad():
+                    output_ids = self.model.generate(
+                        **inputs,
+                        max_new_tokens=max_tokens,
+                        temperature=temperature,
+                        top_p=0.9,
+                        do_sample=True,
+                        repetition_penalty=1.1,
+                        pad_token_id=self.tokenizer.eos_token_id,
+                        stopping_criteria=stopping_criteria
+                    )
         
         t_end = time.time()
         
@@ -215,7 +234,47 @@ class LocalQwenGenerator:
         
         return generated_text.strip(), t_end - t_start
     
-    def generate_text_batch(self, messages_list, max_tokens=512, temperature=0.1):
+    def generate_text_candidates(self, messages, n, max_tokens=512, temperature=0.1, seed=None, stopping_criteria=None):
+        """Sample n continuations of one prompt in a single generate call (prefill runs once)."""
+        try:
+            input_text = self.tokenizer.apply_chat_template(
+                messages,
+                tokenize=False,
+                add_generation_prompt=True
+            )
+        except Exception:
+            input_text = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
+
+        t_start = time.time()
+        inputs = self.tokenizer(
+            input_text,
+            return_tensors="pt",
+            truncation=True,
+            max_length=2048
+        ).to(self.device)
+
+        with sampling(seed), torch.inference_mode():
+            output_ids = self.model.generate(
+                **inputs,
+                max_new_tokens=max_tokens,
+                temperature=temperature,
+                top_p=0.9,
+                do_sample=True,
+                repetition_penalty=1.1,
+                num_return_sequences=n,
+                pad_token_id=self.tokenizer.eos_token_id,
+                stopping_criteria=stopping_criteria
+            )
+        t_end = time.time()
+
+        prompt_len = inputs["input_ids"].shape[1]
+        outputs = [
+            self.tokenizer.decode(row[prompt_len:], skip_special_tokens=True).strip()
+            for row in output_ids
+        ]
+        return outputs, t_end - t_start
+
+    def generate_text_batch(self, messages_list, max_tokens=512, temperature=0.1, stopping_criteria=None):
         if not messages_list:
             return [], 0.0
 
@@ -234,6 +293,10 @@ class LocalQwenGenerator:
             input_texts.append(input_text)
 
         t_start = time.time()
+        # Decoder-only models must be left-padded so every row continues from its own prompt.
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
         inputs = self.tokenizer(
             input_texts,
             return_tensors="pt",
@@ -242,7 +305,7 @@ class LocalQwenGenerator:
             max_length=2048
         ).to(self.device)
 
-        with torch.inference_mode():
+        with sampling(), torch.inference_mode():
             output_ids = self.model.generate(
                 **inputs,
                 max_new_tokens=max_tokens,
@@ -250,14 +313,15 @@ class LocalQwenGenerator:
                 top_p=0.9,
                 do_sample=True,
                 repetition_penalty=1.1,
-                pad_token_id=self.tokenizer.eos_token_id
+                pad_token_id=self.tokenizer.eos_token_id,
+                stopping_criteria=stopping_criteria
             )
         t_end = time.time()
 
-        input_lengths = inputs["attention_mask"].sum(dim=1).tolist()
+        prompt_len = inputs["input_ids"].shape[1]
         outputs = []
-        for i, input_len in enumerate(input_lengths):
-            generated_ids = output_ids[i][int(input_len):]
+        for i in range(len(input_texts)):
+            generated_ids = output_ids[i][prompt_len:]
             generated_text = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
             outputs.append(generated_text.strip())
         return outputs, t_end - t_start
@@ -320,7 +384,7 @@ class LocalQwenGenerator:
             {"role": "user", "content": prompt},
         ]
 
-    def generate_marketing_draft(self, brand_name, product_name, persona, reviews, highlights, campaign_event_info=None):
+    def generate_marketing_draft(self, brand_name, product_name, persona, reviews, highlights, campaign_event_info=None, seed=None, stopping_criteria=None):
         """생성: 마케팅 초안 (One-Stage)."""
         messages = self.build_marketing_messages(
             brand_name,
@@ -330,10 +394,26 @@ class LocalQwenGenerator:
             highlights,
             campaign_event_info=campaign_event_info,
         )
-        marketing_draft, duration = self.generate_text(messages, max_tokens=512, temperature=0.1)
+        marketing_draft, duration = self.generate_text(
+            messages, max_tokens=512, temperature=0.1, seed=seed, stopping_criteria=stopping_criteria
+        )
         return marketing_draft, duration
 
-    def generate_marketing_draft_batch(self, items, max_tokens=512, temperature=0.1):
+    def generate_marketing_draft_candidates(self, brand_name, product_name, persona, reviews, highlights, n, campaign_event_info=None, seed=None, stopping_criteria=None):
+        """n sampled drafts for one prompt, sharing a single prefill."""
+        messages = self.build_marketing_messages(
+            brand_name,
+            product_name,
+            persona,
+            reviews,
+            highlights,
+            campaign_event_info=campaign_event_info,
+        )
+        return self.generate_text_candidates(
+            messages, n, max_tokens=512, temperature=0.1, seed=seed, stopping_criteria=stopping_criteria
+        )
+
+    def generate_marketing_draft_batch(self, items, max_tokens=512, temperature=0.1, stopping_criteria=None):
         messages_list = []
         for item in items:
             messages_list.append(
@@ -350,6 +430,7 @@ class LocalQwenGenerator:
             messages_list,
             max_tokens=max_tokens,
             temperature=temperature,
+            stopping_criteria=stopping_criteria,
         )
         return drafts, duration
 
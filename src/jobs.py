@@ -0,0 +1,203 @@
+"""
+대용량 캠페인 배치를 위한 비동기 작업(Job) 관리자
+
+작업 입력/진행 상태/결과를 작업별 디렉토리에 기록합니다.
+  jobs/<job_id>/meta.json     상태, 진행률
+  jobs/<job_id>/input.jsonl   입력 행
+  jobs/<job_id>/results.jsonl 결과 행 ({"index", "result"} 또는 {"index", "error"})
+
+백그라운드 스레드가 작업을 순서대로 처리하므로 클라이언트 연결이 끊겨도 계속 진행되고,
+서버가 재시작되면 끝나지 않은 작업을 이미 기록된 결과 다음 행부터 이어서 처리합니다.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+import fast_json
+
+
+class JobManager:
+    """Runs batch jobs in a background thread, chunk by chunk, persisting as it goes.
+
+    ``run_rows(rows)`` takes a list of row dicts and returns one result per
+    row; if it raises, the chunk's rows are retried one by one so a bad row
+    only marks itself as failed.
+    """
+
+    def __init__(self, root_dir, run_rows, chunk_size=32):
+        self.root_dir = root_dir
+        self.run_rows = run_rows
+        self.chunk_size = max(1, chunk_size)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._run_stats = {}
+        self._thread = None
+        os.makedirs(root_dir, exist_ok=True)
+
+    # ----- persistence -----
+    def _job_dir(self, job_id):
+        return os.path.join(self.root_dir, job_id)
+
+    def _write_meta(self, meta):
+        path = os.path.join(self._job_dir(meta["job_id"]), "meta.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def _read_rows(self, job_id):
+        with open(os.path.join(self._job_dir(job_id), "input.jsonl"), encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def results_path(self, job_id):
+        return os.path.join(self._job_dir(job_id), "results.jsonl")
+
+    def _count_results(self, job_id):
+        path = self.results_path(job_id)
+        if not os.path.exists(path):
+            return 0, 0
+        done = failed = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                done += 1
+                if "error" in json.loads(line):
+                    failed += 1
+        return done, failed
+
+    # ----- lifecycle -----
+    def start(self):
+        """Start the executor and re-queue jobs that were unfinished at shutdown."""
+        for job_id in sorted(os.listdir(self.root_dir)):
+            meta_path = os.path.join(self._job_dir(job_id), "meta.json")
+            if not os.path.exists(meta_path):
+                continue
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            self._meta[job_id] = meta
+            if meta["status"] in ("queued", "running"):
+                meta["done"], meta["failed"] = self._count_results(job_id)
+                meta["status"] = "queued"
+                self._write_meta(meta)
+                self._queue.put(job_id)
+        self._thread = threading.Thread(target=self._loop, name="job-executor", daemon=True)
+        self._thread.start()
+
+    def submit(self, rows, source="json"):
+        job_id = uuid.uuid4().hex[:12]
+        os.makedirs(self._job_dir(job_id))
+        with open(os.path.join(self._job_dir(job_id), "input.jsonl"), "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        meta = {
+            "job_id": job_id,
+            "status": "queued",
+            "source": source,
+            "total": len(rows),
+            "done": 0,
+            "failed": 0,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+        }
+        with self._lock:
+            self._meta[job_id] = meta
+            self._write_meta(meta)
+        self._queue.put(job_id)
+        return dict(meta)
+
+    def get(self, job_id):
+        with self._lock:
+            meta = self._meta.get(job_id)
+            if meta is None:
+                return None
+            status = dict(meta)
+            stats = self._run_stats.get(job_id)
+        status["progress"] = status["done"] / status["total"] if status["total"] else 1.0
+        status["rows_per_second"] = None
+        status["eta_seconds"] = None
+        if stats is not None:
+            end = status["finished_at"] or time.time()
+            elapsed = end - stats["started_at"]
+            processed = status["done"] - stats["done_at_start"]
+            if elapsed > 0 and processed > 0:
+                rate = processed / elapsed
+                status["rows_per_second"] = rate
+                if status["status"] in ("queued", "running"):
+                    status["eta_seconds"] = (status["total"] - status["done"]) / rate
+        return status
+
+    def list(self):
+        with self._lock:
+            job_ids = list(self._meta)
+        return [self.get(job_id) for job_id in job_ids]
+
+    # ----- execution -----
+    def _loop(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            try:
+                self._run_job(job_id)
+            except Exception as exc:
+                with self._lock:
+                    meta = self._meta[job_id]
+                    meta["status"] = "failed"
+                    meta["error"] = str(exc)
+                    meta["finished_at"] = time.time()
+                    self._write_meta(meta)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            meta = self._meta[job_id]
+            meta.update(fields)
+            self._write_meta(meta)
+
+    def _run_chunk(self, rows):
+        try:
+            return [("result", result) for result in self.run_rows(rows)]
+        except Exception:
+            if len(rows) == 1:
+                raise
+        out = []
+        for row in rows:
+            try:
+                out.append(("result", self.run_rows([row])[0]))
+            except Exception as exc:
+                out.append(("error", str(exc)))
+        return out
+
+    def _run_job(self, job_id):
+        rows = self._read_rows(job_id)
+        meta = self._meta[job_id]
+        start = meta["done"]
+        with self._lock:
+            self._run_stats[job_id] = {"started_at": time.time(), "done_at_start": start}
+        self._update(job_id, status="running", started_at=meta["started_at"] or time.time())
+
+        with open(self.results_path(job_id), "a", encoding="utf-8") as out:
+            for chunk_start in range(start, len(rows), self.chunk_size):
+                chunk = rows[chunk_start:chunk_start + self.chunk_size]
+                try:
+                    outcomes = self._run_chunk(chunk)
+                except Exception as exc:
+                    outcomes = [("error", str(exc))]
+                failed = 0
+                for offset, (kind, value) in enumerate(outcomes):
+                    out.write(fast_json.dumps_str({"index": chunk_start + offset, kind: value}) + "\n")
+                    failed += kind == "error"
+                out.flush()
+                self._update(job_id, done=meta["done"] + len(outcomes), failed=meta["failed"] + failed)
+
+        self._update(job_id, status="completed", finished_at=time.time())
+
+    def shutdown(self):
+        self._queue.put(None)
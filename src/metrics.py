@@ -0,0 +1,175 @@
+"""
+Prometheus 텍스트 포맷 메트릭
+
+외부 의존성 없이 카운터/게이지/요약(summary) 메트릭을 모아 `/metrics`에서
+Prometheus exposition 포맷으로 내보냅니다. 요약 메트릭은 최근 N개 관측값의
+슬라이딩 윈도우로 p50/p90/p99를 계산합니다.
+"""
+
+import threading
+from collections import deque
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value != value:
+        return "NaN"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text)
+        self._values = {}
+
+    def inc(self, amount=1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0.0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    """A gauge set directly or read from a callback at scrape time.
+
+    The callback returns either a number or a list of ``(labels_dict, value)``
+    pairs.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, func=None):
+        super().__init__(name, help_text)
+        self._values = {}
+        self._func = func
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self._func is not None:
+            try:
+                value = self._func()
+            except Exception:
+                return []
+            if isinstance(value, (int, float)):
+                items = [((), value)]
+            else:
+                items = [(_label_key(labels), v) for labels, v in value]
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(v)}" for key, v in items]
+
+
+class Summary(_Metric):
+    """Quantiles over the last ``window`` observations, plus lifetime _sum/_count."""
+
+    kind = "summary"
+
+    def __init__(self, name, help_text, window=1024):
+        super().__init__(name, help_text)
+        self.window = window
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"recent": deque(maxlen=self.window), "sum": 0.0, "count": 0}
+            series["recent"].append(value)
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(key, sorted(s["recent"]), s["sum"], s["count"]) for key, s in sorted(self._series.items())]
+        lines = []
+        for key, recent, total, count in items:
+            for q in QUANTILES:
+                value = recent[min(len(recent) - 1, int(q * len(recent)))] if recent else float("nan")
+                lines.append(f"{self.name}{_format_labels(key, [('quantile', str(q))])} {_format_value(value)}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {_format_value(count)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text):
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name, help_text, func=None):
+        return self._register(Gauge(name, help_text, func=func))
+
+    def summary(self, name, help_text, window=1024):
+        return self._register(Summary(name, help_text, window=window))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
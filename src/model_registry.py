@@ -0,0 +1,247 @@
+"""
+메모리 예산 기반 모델 레지스트리
+
+로드된 모델(생성기)을 한 곳에서 관리합니다.
+  - 로드 후 파라미터/버퍼 크기로 실제 메모리 사용량을 측정
+  - 예산을 넘으면 사용 중이 아닌 모델부터 LRU 순서로 언로드
+  - 일정 시간 사용되지 않은 모델은 자동 언로드
+  - 자리가 날 때까지 잠시 기다렸다가, 그래도 안 되면 ModelCapacityError
+
+사용 중인 모델은 lease로 참조 카운트를 잡아 두므로 요청 도중에 언로드되지 않습니다.
+교체된 모델(`retire`)은 진행 중인 lease가 모두 끝나는 즉시 언로드됩니다.
+"""
+
+import gc
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ModelCapacityError(RuntimeError):
+    """A model cannot be loaded within the memory budget."""
+
+
+def model_footprint(obj):
+    """Bytes held by a generator's ``model`` (or the object itself): parameters + buffers."""
+    model = getattr(obj, "model", obj)
+    total = 0
+    for attr in ("parameters", "buffers"):
+        tensors = getattr(model, attr, None)
+        if tensors is None:
+            continue
+        try:
+            total += sum(t.numel() * t.element_size() for t in tensors())
+        except Exception:
+            pass
+    return total
+
+
+def estimate_footprint(model_name, bytes_per_param=4):
+    """Best-effort size before loading, from the hub's safetensors header; None if unknown."""
+    try:
+        from huggingface_hub import get_safetensors_metadata
+
+        metadata = get_safetensors_metadata(model_name)
+        return sum(metadata.parameter_count.values()) * bytes_per_param
+    except Exception:
+        return None
+
+
+def default_budget_bytes():
+    """75% of physical RAM, or None (unlimited) where it cannot be read."""
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") * 0.75)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class ModelRegistry:
+    """LRU model cache bounded by a byte budget, with idle unloading and leases.
+
+    ``lease(key, loader)`` is a context manager that loads (or reuses) the
+    model for ``key`` and keeps it pinned while the block runs. ``get`` loads
+    or touches a model without pinning it.
+    """
+
+    def __init__(self, budget_bytes=None, idle_timeout=None, wait_timeout=30.0):
+        self.budget_bytes = budget_bytes
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self._cond = threading.Condition()
+        self._entries = {}
+        self._loading = set()
+        self._reserved = 0
+        self._known_sizes = {}
+        self._retired = set()
+        self._evictions = 0
+        if idle_timeout:
+            threading.Thread(target=self._reap_idle, name="model-registry-reaper", daemon=True).start()
+
+    # ----- bookkeeping (caller holds self._cond) -----
+    def _used(self):
+        return sum(entry["bytes"] for entry in self._entries.values()) + self._reserved
+
+    def _unload(self, key, reason):
+        entry = self._entries.pop(key)
+        self._evictions += 1
+        print(f"[ModelRegistry] unload {key} ({entry['bytes'] / 1e9:.2f}GB, {reason})")
+        del entry
+        gc.collect()
+        try:
+            import torch
+
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except Exception:
+            pass
+
+    def _evict_idle(self):
+        if not self.idle_timeout:
+            return
+        now = time.time()
+        for key, entry in list(self._entries.items()):
+            if entry["refs"] == 0 and now - entry["last_used"] > self.idle_timeout:
+                self._unload(key, "idle")
+
+    def _lru_victim(self, exclude=None):
+        idle = [(e["last_used"], k) for k, e in self._entries.items() if e["refs"] == 0 and k != exclude]
+        return min(idle)[1] if idle else None
+
+    def _make_room(self, need, key):
+        """Evict until ``need`` more bytes fit, waiting for leases to end; raise if impossible."""
+        if self.budget_bytes is None:
+            return
+        if need > self.budget_bytes:
+            raise ModelCapacityError(
+                f"{key} needs {need / 1e9:.2f}GB, more than the {self.budget_bytes / 1e9:.2f}GB model budget"
+            )
+        deadline = time.time() + self.wait_timeout
+        while self._used() + need > self.budget_bytes:
+            victim = self._lru_victim(exclude=key)
+            if victim is not None:
+                self._unload(victim, "lru")
+                continue
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise ModelCapacityError(
+                    f"no room for {key} ({need / 1e9:.2f}GB): models in use hold "
+                    f"{self._used() / 1e9:.2f}GB of the {self.budget_bytes / 1e9:.2f}GB budget"
+                )
+            self._cond.wait(remaining)
+
+    # ----- public API -----
+    def acquire(self, key, loader, estimate=None):
+        """Return the model for ``key``, loading it if needed, and pin it until ``release``.
+
+        ``estimate`` (bytes, or a callable returning bytes or None) sizes a
+        first-time load so room can be made before it starts; it is only
+        called on a cache miss.
+        """
+        estimated = None if callable(estimate) else estimate
+        while True:
+            with self._cond:
+                while key in self._loading:
+                    self._cond.wait()
+                self._evict_idle()
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry["refs"] += 1
+                    entry["last_used"] = time.time()
+                    return entry["obj"]
+                need = self._known_sizes.get(key) or estimated
+                if need is not None or not callable(estimate):
+                    need = need or 0
+                    self._make_room(need, key)
+                    self._reserved += need
+                    self._loading.add(key)
+                    break
+            # Size lookups may hit the network; do them outside the lock.
+            estimated = estimate() or 0
+            estimate = None
+
+        try:
+            obj = loader()
+            size = model_footprint(obj)
+        except BaseException:
+            with self._cond:
+                self._reserved -= need
+                self._loading.discard(key)
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            self._reserved -= need
+            self._loading.discard(key)
+            self._known_sizes[key] = size
+            try:
+                self._make_room(size, key)
+            except ModelCapacityError:
+                self._cond.notify_all()
+                raise
+            self._entries[key] = {"obj": obj, "bytes": size, "refs": 1, "last_used": time.time()}
+            self._cond.notify_all()
+        print(f"[ModelRegistry] loaded {key} ({size / 1e9:.2f}GB)")
+        return obj
+
+    def release(self, key):
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["refs"] -= 1
+                entry["last_used"] = time.time()
+                if entry["refs"] == 0 and key in self._retired:
+                    self._retired.discard(key)
+                    self._unload(key, "retired")
+            self._cond.notify_all()
+
+    def retire(self, key):
+        """Unload ``key`` once its last lease ends (now, if it is not in use)."""
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if entry["refs"] == 0:
+                self._unload(key, "retired")
+            else:
+                self._retired.add(key)
+            self._cond.notify_all()
+
+    @contextmanager
+    def lease(self, key, loader, estimate=None):
+        obj = self.acquire(key, loader, estimate=estimate)
+        try:
+            yield obj
+        finally:
+            self.release(key)
+
+    def get(self, key, loader, estimate=None):
+        obj = self.acquire(key, loader, estimate=estimate)
+        self.release(key)
+        return obj
+
+    def clear(self):
+        with self._cond:
+            for key in [k for k, e in self._entries.items() if e["refs"] == 0]:
+                self._unload(key, "clear")
+            self._cond.notify_all()
+
+    def _reap_idle(self):
+        while True:
+            time.sleep(max(1.0, self.idle_timeout / 2))
+            with self._cond:
+                self._evict_idle()
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "used_bytes": self._used(),
+                "evictions": self._evictions,
+                "retiring": [list(key) for key in self._retired],
+                "models": [
+                    {"key": list(key), "bytes": e["bytes"], "refs": e["refs"], "last_used": e["last_used"]}
+                    for key, e in self._entries.items()
+                ],
+            }
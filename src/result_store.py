@@ -0,0 +1,198 @@
+"""
+생성 결과 저장소 (SQLite, 백그라운드 기록)
+
+서버가 만든 결과를 요청 키, 모델, 어댑터, 처리 시간과 함께 SQLite 파일에 남깁니다.
+요청 스레드는 결과를 큐에 넣기만 하고, 백그라운드 스레드가 행을 만들고(JSON 직렬화 포함)
+모아서 한 번에 커밋하므로 응답 지연에는 영향이 없습니다.
+
+조회는 브랜드/단계/페르소나/기간으로 필터링하며 최신 결과부터 돌려줍니다.
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import fast_json
+
+_COLUMNS = (
+    "request_key",
+    "created_at",
+    "brand",
+    "product",
+    "persona",
+    "persona_name",
+    "stage_index",
+    "stage_name",
+    "style_index",
+    "seed",
+    "qwen_model",
+    "exa_model",
+    "adapter_id",
+    "total_seconds",
+    "result",
+)
+
+
+def result_row(request_key, result, adapter_id=None, created_at=None):
+    """Column values for one pipeline result."""
+    qwen = result.get("qwen") or {}
+    exaone = result.get("exaone") or {}
+    persona = result.get("persona_profile") or {}
+    return {
+        "request_key": request_key,
+        "created_at": created_at or time.time(),
+        "brand": result.get("brand"),
+        "product": (result.get("product_basic") or {}).get("name") or result.get("product_query"),
+        "persona": None if result.get("persona_input") is None else str(result.get("persona_input")),
+        "persona_name": persona.get("name"),
+        "stage_index": result.get("stage_index"),
+        "stage_name": result.get("stage_name"),
+        "style_index": result.get("style_index"),
+        "seed": result.get("seed"),
+        "qwen_model": qwen.get("model"),
+        "exa_model": exaone.get("model"),
+        "adapter_id": adapter_id,
+        "total_seconds": (result.get("timing") or {}).get("total"),
+        "result": fast_json.dumps_str(result),
+    }
+
+
+class ResultStore:
+    """Append-only SQLite store fed by a background writer thread.
+
+    ``record`` only enqueues the result as is; the writer builds and serializes
+    the rows, drains up to ``batch_size`` rows at a
+    time (or whatever arrived within ``flush_interval`` seconds) and commits
+    them in one transaction. ``query`` reads on its own connection, so lookups
+    do not wait for the writer.
+    """
+
+    def __init__(self, path, batch_size=64, flush_interval=1.0):
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval)
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._read_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self._connect()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, request_key TEXT, created_at REAL NOT NULL, "
+            "brand TEXT, product TEXT, persona TEXT, persona_name TEXT, stage_index INTEGER, stage_name TEXT, "
+            "style_index INTEGER, seed INTEGER, qwen_model TEXT, exa_model TEXT, adapter_id TEXT, "
+            "total_seconds REAL, result TEXT NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS results_brand_created ON results (brand, created_at)")
+        db.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created_at)")
+        db.commit()
+        db.close()
+        self._reader = self._connect()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL lets the query connection read while the writer commits.
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # ----- writing -----
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="result-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, request_key, result, adapter_id=None):
+        """Queue one result for writing; never blocks on the database or serializes."""
+        self._queue.put((request_key, result, adapter_id, time.time()))
+
+    def _drain(self, first):
+        rows = [first]
+        deadline = time.time() + self.flush_interval
+        while len(rows) < self.batch_size:
+            timeout = deadline - time.time()
+            try:
+                row = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            rows.append(row)
+        return rows
+
+    def _loop(self):
+        db = self._connect()
+        sql = f"INSERT INTO results ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is None:
+                break
+            rows = self._drain(first)
+            if None in rows:
+                stop = True
+                rows = [row for row in rows if row is not None]
+            try:
+                rows = [result_row(key, result, adapter_id=aid, created_at=at) for key, result, aid, at in rows]
+                db.executemany(sql, [tuple(row[col] for col in _COLUMNS) for row in rows])
+                db.commit()
+                self.written += len(rows)
+            except (sqlite3.Error, TypeError, ValueError) as exc:
+                self.dropped += len(rows)
+                print(f"[ResultStore] failed to write {len(rows)} results: {exc}")
+        db.close()
+
+    def shutdown(self):
+        """Write everything queued so far, then stop the writer."""
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+
+    # ----- reading -----
+    def query(self, brand=None, stage=None, persona=None, since=None, until=None, limit=50, offset=0):
+        """Newest-first results matching every given filter, plus the total match count.
+
+        ``stage`` is a stage index or name; ``persona`` matches the persona
+        input (index or name) or the resolved persona name; ``since``/``until``
+        are epoch seconds.
+        """
+        where, params = [], []
+        if brand:
+            where.append("brand = ?")
+            params.append(brand)
+        if stage is not None and str(stage).strip() != "":
+            stage = str(stage).strip()
+            if stage.isdigit():
+                where.append("stage_index = ?")
+                params.append(int(stage))
+            else:
+                where.append("lower(stage_name) = lower(?)")
+                params.append(stage)
+        if persona is not None and str(persona).strip() != "":
+            where.append("(persona = ? OR persona_name = ?)")
+            params.extend([str(persona), str(persona)])
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(until)
+        clause = f" WHERE {' AND '.join(where)}" if where else ""
+        with self._read_lock:
+            total = self._reader.execute(f"SELECT COUNT(*) FROM results{clause}", params).fetchone()[0]
+            rows = self._reader.execute(
+                f"SELECT id, {', '.join(_COLUMNS)} FROM results{clause} ORDER BY created_at DESC, id DESC "
+                "LIMIT ? OFFSET ?",
+                params + [max(1, limit), max(0, offset)],
+            ).fetchall()
+        items = []
+        for row in rows:
+            item = dict(zip(("id",) + _COLUMNS, row))
+            item["result"] = json.loads(item["result"])
+            items.append(item)
+        return {"items": items, "total": total, "limit": limit, "offset": offset}
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped}
@@ -20,40 +20,46 @@ import os
 import sys
 import time
 import random
+import threading
+from contextlib import ExitStack, contextmanager
 from datetime import datetime, timezone
 
 sys.path.insert(0, os.path.dirname(__file__))
 
-from rag_utils import build_persona_query, extract_candidate_texts, extract_highlight_snippet, vectorize_texts, cosine  # noqa: E402
-from generate_marketing import LocalQwenGenerator, find_persona, find_product, load_json  # noqa: E402
+import fast_json  # noqa: E402
+from cancellation import AnyToken, Cancelled, CancelToken, all_cancelled, stopping_criteria  # noqa: E402
+from rag_utils import (  # noqa: E402
+    build_persona_query,
+    cosine,
+    extract_candidate_texts,
+    extract_highlight_snippet,
+    get_embedder,
+    vectorize_texts,
+)
+from generate_marketing import (  # noqa: E402
+    LocalQwenGenerator,
+    find_persona,
+    find_product,
+    generate_marketing_draft as template_marketing_draft,
+    get_device,
+    load_json,
+)
+from model_registry import ModelRegistry, default_budget_bytes, estimate_footprint  # noqa: E402
+from semantic_cache import SemanticCache  # noqa: E402
+from stage_store import STAGES, StageStore, result_record, stage_id  # noqa: E402
 from tone_correction import (  # noqa: E402
     build_exaone_prompt,
     ExaoneToneCorrector,
     pick_brand_story,
     load_crm_goal_meta,
     select_stage_bucket,
-    rag_crm_snippets,
+    rag_crm_snippets_batch,
     format_fomo_examples,
     STAGE_ORDER,
 )
 
 
-def top_highlights_for_product(persona, product, top_k=3):
-    cache_key = None
-    if CACHE_ENABLED:
-        cache_key = _highlight_cache_key(persona, product, top_k)
-        cached = _HIGHLIGHT_CACHE.get(cache_key)
-        if cached is not None:
-            return cached
-    query = build_persona_query(persona)
-    candidates = extract_candidate_texts(product)
-    all_texts = [query] + candidates
-    vectors = vectorize_texts(all_texts)
-    if vectors is None or len(vectors) == 0:
-        return []
-    q_vec = vectors[0]
-    cand_vecs = vectors[1:]
-
+def _rank_highlights(q_vec, cand_vecs, candidates, top_k):
     scores = [(cosine(q_vec, v), i, candidates[i]) for i, v in enumerate(cand_vecs)]
     scores.sort(reverse=True, key=lambda x: x[0])
     top = scores[:top_k]
@@ -68,11 +74,53 @@ def top_highlights_for_product(persona, product, top_k=3):
                 "snippet": extract_highlight_snippet(text),
             }
         )
-    if CACHE_ENABLED and cache_key is not None:
-        _HIGHLIGHT_CACHE[cache_key] = highlights
     return highlights
 
 
+def top_highlights_for_product(persona, product, top_k=3):
+    return top_highlights_batch([(persona, product, top_k)])[0]
+
+
+def top_highlights_batch(requests, use_cache=True):
+    """Highlights for many (persona, product, top_k) triples with one embedding call.
+
+    Cached triples are answered from the highlight cache; the persona queries
+    and review candidates of the remaining ones are encoded together. With
+    ``use_cache=False`` the cache is neither read nor written.
+    """
+    results = [None] * len(requests)
+    pending = []
+    texts = []
+    for pos, (persona, product, top_k) in enumerate(requests):
+        cache_key = None
+        if use_cache:
+            cache_key = _highlight_cache_key(persona, product, top_k)
+            cached = _HIGHLIGHT_CACHE.get(cache_key)
+            if cached is not None:
+                results[pos] = cached
+                continue
+        candidates = extract_candidate_texts(product)
+        start = len(texts)
+        texts.append(build_persona_query(persona))
+        texts.extend(candidates)
+        pending.append((pos, cache_key, start, candidates, top_k))
+
+    if not pending:
+        return results
+    vectors = vectorize_texts(texts)
+    for pos, cache_key, start, candidates, top_k in pending:
+        if vectors is None or len(vectors) == 0:
+            results[pos] = []
+            continue
+        q_vec = vectors[start]
+        cand_vecs = vectors[start + 1:start + 1 + len(candidates)]
+        highlights = _rank_highlights(q_vec, cand_vecs, candidates, top_k)
+        if cache_key is not None:
+            _HIGHLIGHT_CACHE[cache_key] = highlights
+        results[pos] = highlights
+    return results
+
+
 STYLE_TYPES = [
     'Time_Urgency_Style',
     'Information_Universal_Style',
@@ -82,14 +130,13 @@ STYLE_TYPES = [
     'Mixed_Strategies'
 ]
 
-EXAONE_ADAPTER_ID = "jinn33/crm-dpo-adapter"
+ENGINE = "qwen_exaone"
+EXAONE_ADAPTER_ID = os.getenv("EXAONE_ADAPTER_ID", "jinn33/crm-dpo-adapter")
 
-_QWEN_GENERATOR_CACHE = {}
-_EXAONE_GENERATOR_CACHE = {}
 _STYLE_POOL_CACHE = {}
 _HIGHLIGHT_CACHE = {}
-CACHE_ENABLED = True
 _TIMING_WINDOW = 100
+_TIMING_LOCK = threading.Lock()
 _TIMING_AGG = {
     "count": 0,
     "sum": {
@@ -102,31 +149,223 @@ _TIMING_AGG = {
 }
 
 
+def _model_budget_bytes():
+    budget_gb = os.getenv("MODEL_RAM_BUDGET_GB")
+    if budget_gb is None:
+        return default_budget_bytes()
+    return int(float(budget_gb) * 1e9) or None
+
+
+_MODEL_REGISTRY = ModelRegistry(
+    budget_bytes=_model_budget_bytes(),
+    idle_timeout=float(os.getenv("MODEL_IDLE_TIMEOUT", "0")) or None,
+    wait_timeout=float(os.getenv("MODEL_LOAD_WAIT", "30")),
+)
+
+
+def _make_semantic_cache():
+    threshold = os.getenv("SEMANTIC_CACHE_THRESHOLD")
+    if not threshold:
+        return None
+    return SemanticCache(
+        threshold=float(threshold),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "4096")),
+        max_bytes=int(float(os.getenv("SEMANTIC_CACHE_MB", "64")) * 1024 * 1024),
+    )
+
+
+# Near-duplicate Exaone results (off unless SEMANTIC_CACHE_THRESHOLD is set).
+_SEMANTIC_CACHE = _make_semantic_cache()
+
+# Content-addressed stage outputs and result records (see stage_store), opened on first use.
+_STAGE_STORE = None
+_STAGE_STORE_LOCK = threading.Lock()
+
+
+def _stage_store():
+    global _STAGE_STORE
+    with _STAGE_STORE_LOCK:
+        if _STAGE_STORE is None:
+            base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            path = os.getenv("STAGE_STORE_PATH", os.path.join(base, "cache", "stages.sqlite"))
+            _STAGE_STORE = StageStore(
+                path=path or None,
+                max_entries=int(os.getenv("STAGE_STORE_SIZE", "2048")),
+                ttl_seconds=float(os.getenv("STAGE_STORE_TTL", "86400")),
+            )
+        return _STAGE_STORE
+
+
+def stage_record(result_id):
+    """The request parameters and stage ids behind ``result_id``, or None if unknown or expired."""
+    return _stage_store().get(result_id)
+
+
+def flush_stages():
+    """Write this process's queued stage records, so other processes sharing the store can read them."""
+    _stage_store().flush()
+
+
+def _estimate_model_bytes(model_name):
+    return estimate_footprint(model_name, bytes_per_param=2 if get_device() == "cuda" else 4)
+
+
+def _load_qwen_generator(model_name):
+    return LocalQwenGenerator(model_name=model_name, use_cache=False)
+
+
+def _load_exaone_generator(model_name, adapter_id=None):
+    generator = ExaoneToneCorrector(model_name=model_name, use_cache=False)
+    return _ensure_exaone_adapter(generator, adapter_id or serving()["adapter_id"])
+
+
+def _qwen_lease(model_name):
+    return _MODEL_REGISTRY.lease(
+        ("qwen", model_name),
+        lambda: _load_qwen_generator(model_name),
+        estimate=lambda: _estimate_model_bytes(model_name),
+    )
+
+
+def _exaone_lease(model_name, adapter_id=None):
+    adapter_id = adapter_id or serving()["adapter_id"]
+    return _MODEL_REGISTRY.lease(
+        ("exaone", model_name, adapter_id),
+        lambda: _load_exaone_generator(model_name, adapter_id),
+        estimate=lambda: _estimate_model_bytes(model_name),
+    )
+
+
+# ----- serving version (hot swap) -----
+# Requests get the models of the serving version: its Exaone adapter, and for a
+# requested model name that has been replaced, the model that replaced it.
+_SERVING_LOCK = threading.Lock()
+_SWAP_LOCK = threading.Lock()
+_SERVING = {
+    "version": os.getenv("MODEL_VERSION", "base"),
+    "adapter_id": EXAONE_ADAPTER_ID,
+    "models": {},
+    "generation": 0,
+    "activated_at": time.time(),
+}
+
+
+def serving():
+    """Snapshot of the serving version: tag, Exaone adapter and model replacements."""
+    with _SERVING_LOCK:
+        return dict(_SERVING, models=dict(_SERVING["models"]))
+
+
+def _served(kind, model_name, snapshot):
+    return snapshot["models"].get(f"{kind}:{model_name}", model_name)
+
+
+def _served_args(args_list, snapshot):
+    """Copies of ``args_list`` naming the models the serving version actually runs.
+
+    The names the caller asked for are kept in ``requested_models``, which is
+    what result records store.
+    """
+    if not snapshot["models"]:
+        return args_list
+    return [
+        argparse.Namespace(**dict(
+            vars(args),
+            qwen_model=_served("qwen", args.qwen_model, snapshot),
+            exa_model=_served("exaone", args.exa_model, snapshot),
+            requested_models={"qwen_model": args.qwen_model, "exa_model": args.exa_model},
+        ))
+        for args in args_list
+    ]
+
+
+@contextmanager
+def _serving_models(qwen_model, exa_model, q_generator=None, exa_generator=None):
+    """Lease the serving version's models; yields ``(snapshot, q_generator, exa_generator)``.
+
+    If a swap lands between taking the snapshot and getting the leases, the
+    leases are dropped and taken again for the new version, so a batch never
+    runs on a model that has already been retired.
+    """
+    while True:
+        snapshot = serving()
+        with ExitStack() as leases:
+            q_gen = q_generator
+            if q_gen is None:
+                q_gen = leases.enter_context(_qwen_lease(_served("qwen", qwen_model, snapshot)))
+            exa_gen = exa_generator
+            if exa_gen is None:
+                exa_gen = leases.enter_context(
+                    _exaone_lease(_served("exaone", exa_model, snapshot), snapshot["adapter_id"])
+                )
+            else:
+                exa_gen = _ensure_exaone_adapter(exa_gen, snapshot["adapter_id"])
+            if serving()["generation"] != snapshot["generation"]:
+                continue
+            yield snapshot, q_gen, exa_gen
+            return
+
+
+def swap_version(version, adapter_id=None, models=None, warm_args=None, data=None, load=True):
+    """Load a new serving version next to the current one, warm it, switch to it, retire the old one.
+
+    ``models`` maps ``"qwen:<requested name>"`` / ``"exaone:<requested name>"``
+    to the model that should serve it from now on. Each replaced model (and
+    the Exaone model of the default pair, when the adapter changes) is loaded
+    and pinned first; ``warm_args`` rows are then run end to end on the new
+    models. Only then is the serving version flipped, in one step. In-flight
+    batches keep their leases on the old models, which the registry unloads
+    as soon as the last one finishes. With ``load=False`` only the flip is
+    recorded (a process that serves no models itself).
+    """
+    with _SWAP_LOCK:
+        current = serving()
+        candidate = dict(
+            current,
+            version=version,
+            adapter_id=adapter_id or current["adapter_id"],
+            models=dict(current["models"], **(models or {})),
+        )
+        pairs = {(args.qwen_model, args.exa_model) for args in warm_args or []}
+        with ExitStack() as pins:
+            if load:
+                for qwen_model, exa_model in pairs:
+                    q_gen = pins.enter_context(_qwen_lease(_served("qwen", qwen_model, candidate)))
+                    exa_gen = pins.enter_context(
+                        _exaone_lease(_served("exaone", exa_model, candidate), candidate["adapter_id"])
+                    )
+                    warm_rows = [a for a in warm_args if (a.qwen_model, a.exa_model) == (qwen_model, exa_model)]
+                    warm_start = time.time()
+                    _run_batch_stages(_served_args(warm_rows, candidate), PipelineContext(data), q_gen, exa_gen, None)
+                    print(f"[Swap] warmed {version} for {qwen_model} + {exa_model} ({time.time() - warm_start:.2f}s)")
+            with _SERVING_LOCK:
+                _SERVING.update(candidate, generation=current["generation"] + 1, activated_at=time.time())
+        print(f"[Swap] serving {current['version']} -> {version}")
+
+        if load:
+            old_keys = set()
+            for qwen_model, exa_model in pairs:
+                old_keys.add(("qwen", _served("qwen", qwen_model, current)))
+                old_keys.add(("exaone", _served("exaone", exa_model, current), current["adapter_id"]))
+                old_keys.discard(("qwen", _served("qwen", qwen_model, candidate)))
+                old_keys.discard(("exaone", _served("exaone", exa_model, candidate), candidate["adapter_id"]))
+            for key in old_keys:
+                _MODEL_REGISTRY.retire(key)
+        return serving()
+
+
 def _get_qwen_generator(model_name):
-    if not CACHE_ENABLED:
-        return LocalQwenGenerator(model_name=model_name, use_cache=False)
-    cached = _QWEN_GENERATOR_CACHE.get(model_name)
-    if cached:
-        return cached
-    generator = LocalQwenGenerator(model_name=model_name, use_cache=True)
-    _QWEN_GENERATOR_CACHE[model_name] = generator
-    return generator
+    with _qwen_lease(model_name) as generator:
+        return generator
 
 
 def _get_exaone_generator(model_name):
-    if not CACHE_ENABLED:
-        generator = ExaoneToneCorrector(model_name=model_name, use_cache=False)
-        return _ensure_exaone_adapter(generator)
-    cached = _EXAONE_GENERATOR_CACHE.get(model_name)
-    if cached:
-        return _ensure_exaone_adapter(cached)
-    generator = ExaoneToneCorrector(model_name=model_name, use_cache=True)
-    generator = _ensure_exaone_adapter(generator)
-    _EXAONE_GENERATOR_CACHE[model_name] = generator
-    return generator
+    with _exaone_lease(model_name) as generator:
+        return generator
 
 
-def _ensure_exaone_adapter(generator, adapter_id=EXAONE_ADAPTER_ID):
+def _ensure_exaone_adapter(generator, adapter_id=None):
+    adapter_id = adapter_id or serving()["adapter_id"]
     if not adapter_id:
         return generator
     if getattr(generator, "_adapter_id", None) == adapter_id:
@@ -154,9 +393,9 @@ def _highlight_cache_key(persona, product, top_k):
     return persona_key, product_key, top_k
 
 
-def _get_style_candidates(style_data, aarrr_stage):
+def _get_style_candidates(style_data, aarrr_stage, use_cache=True):
     key = None
-    if CACHE_ENABLED:
+    if use_cache:
         key = (id(style_data), aarrr_stage)
         cached = _STYLE_POOL_CACHE.get(key)
         if cached is not None:
@@ -174,69 +413,79 @@ def _get_style_candidates(style_data, aarrr_stage):
                     if aarrr_stage in item['stage']:
                         candidates_pool.extend(item['data'])
 
-    if CACHE_ENABLED and key is not None:
+    if key is not None:
         _STYLE_POOL_CACHE[key] = candidates_pool
     return candidates_pool
 
 
-def _set_cache_enabled(enabled):
-    global CACHE_ENABLED
-    if CACHE_ENABLED == enabled:
-        return
-    CACHE_ENABLED = enabled
-    if not enabled:
-        _QWEN_GENERATOR_CACHE.clear()
-        _EXAONE_GENERATOR_CACHE.clear()
-        _STYLE_POOL_CACHE.clear()
-        _HIGHLIGHT_CACHE.clear()
-        if hasattr(load_json, "cache_clear"):
-            load_json.cache_clear()
-    try:
-        LocalQwenGenerator.CACHE_ENABLED = enabled
-        if not enabled:
-            LocalQwenGenerator._CACHE.clear()
-    except Exception:
-        pass
-    try:
-        ExaoneToneCorrector.CACHE_ENABLED = enabled
-        if not enabled:
-            ExaoneToneCorrector._CACHE.clear()
-    except Exception:
-        pass
-
-
 def _record_timing(timing):
     agg = _TIMING_AGG
-    agg["count"] += 1
-    for key in agg["sum"]:
-        agg["sum"][key] += timing.get(key, 0.0)
-    if agg["count"] % _TIMING_WINDOW == 0:
+    with _TIMING_LOCK:
+        agg["count"] += 1
+        for key in agg["sum"]:
+            agg["sum"][key] += timing.get(key, 0.0)
+        if agg["count"] % _TIMING_WINDOW != 0:
+            return
         avg = {key: agg["sum"][key] / _TIMING_WINDOW for key in agg["sum"]}
-        print(
-            "[TimingAvg] "
-            f"n={_TIMING_WINDOW} "
-            f"load={avg['load']:.2f}s "
-            f"qwen={avg['qwen']:.2f}s "
-            f"rag={avg['rag']:.2f}s "
-            f"exaone={avg['exaone']:.2f}s "
-            f"total={avg['total']:.2f}s"
-        )
         for key in agg["sum"]:
             agg["sum"][key] = 0.0
+    print(
+        "[TimingAvg] "
+        f"n={_TIMING_WINDOW} "
+        f"load={avg['load']:.2f}s "
+        f"qwen={avg['qwen']:.2f}s "
+        f"rag={avg['rag']:.2f}s "
+        f"exaone={avg['exaone']:.2f}s "
+        f"total={avg['total']:.2f}s"
+    )
 
-def _load_data(base):
+
+def _load_data(base, use_cache=True):
     data_dir = os.path.join(base, 'data')
+    # Without the cache every file is read again from disk (and not kept).
+    load = load_json if use_cache else getattr(load_json, "__wrapped__", load_json)
     return {
-        "personas": load_json(os.path.join(data_dir, 'personas.json')),
-        "products": load_json(os.path.join(data_dir, 'products.json')),
-        "brand_stories": load_json(os.path.join(data_dir, 'brand_stories.json')),
-        "crm_goals": load_json(os.path.join(data_dir, 'crm_goals.json')),
-        "crm_categorized": load_json(os.path.join(data_dir, 'crm_analysis_results_categorized.json')),
-        "campaign_events": load_json(os.path.join(data_dir, 'campaign_events.json')),
-        "integrated_templates": load_json(os.path.join(data_dir, 'integrated_crm_templates.json')),
+        "personas": load(os.path.join(data_dir, 'personas.json')),
+        "products": load(os.path.join(data_dir, 'products.json')),
+        "brand_stories": load(os.path.join(data_dir, 'brand_stories.json')),
+        "crm_goals": load(os.path.join(data_dir, 'crm_goals.json')),
+        "crm_categorized": load(os.path.join(data_dir, 'crm_analysis_results_categorized.json')),
+        "campaign_events": load(os.path.join(data_dir, 'campaign_events.json')),
+        "integrated_templates": load(os.path.join(data_dir, 'integrated_crm_templates.json')),
     }
 
 
+class PipelineContext:
+    """What one pipeline run works with: data, optional preloaded generators and cache policy.
+
+    The context belongs to a single request, so concurrent runs never share
+    switches. ``use_cache=False`` makes that request alone re-read the data
+    files and skip the highlight and style-pool caches (no lookups, no
+    stores); everyone else keeps their caches, and models still come from
+    the shared registry.
+    """
+
+    def __init__(self, data=None, q_generator=None, exa_generator=None, use_cache=True):
+        self.data = data
+        self.q_generator = q_generator
+        self.exa_generator = exa_generator
+        self.use_cache = use_cache
+
+    @classmethod
+    def for_args(cls, args, data=None, q_generator=None, exa_generator=None):
+        """A context whose cache policy follows ``args.disable_cache``."""
+        use_cache = not getattr(args, "disable_cache", False)
+        return cls(data if use_cache else None, q_generator, exa_generator, use_cache=use_cache)
+
+    def load_data(self):
+        """The request's data, loaded on first use; returns ``(data, seconds spent loading)``."""
+        if self.data is not None:
+            return self.data, 0.0
+        load_start = time.time()
+        self.data = _load_data(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), use_cache=self.use_cache)
+        return self.data, time.time() - load_start
+
+
 def _normalize_row(row):
     if not isinstance(row, dict):
         raise ValueError('Batch row must be a dict')
@@ -277,15 +526,7 @@ def _normalize_row(row):
     return normalized
 
 
-def _run_pipeline(args, data=None, q_generator=None, exa_generator=None):
-    total_start = time.time()
-    load_duration = 0.0
-    rag_duration = 0.0
-    qwen_duration = 0.0
-    if hasattr(args, "disable_cache"):
-        _set_cache_enabled(not args.disable_cache)
-        if not CACHE_ENABLED and hasattr(load_json, "cache_clear"):
-            load_json.cache_clear()
+def _resolve_stage_style(args):
     # Resolve stage and style indices with fallbacks
     if 0 <= args.stage_index < len(STAGE_ORDER):
         aarrr_stage = STAGE_ORDER[args.stage_index]
@@ -298,78 +539,118 @@ def _run_pipeline(args, data=None, q_generator=None, exa_generator=None):
     else:
         style_type = STYLE_TYPES[0]
         print(f"[WARN] Invalid style_index. Using default ({style_type}).")
+    return aarrr_stage, style_type
 
-    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    if data is None:
-        load_start = time.time()
-        data = _load_data(base)
-        load_duration = time.time() - load_start
 
-    personas = data['personas']
-    products = data['products']
-    brand_stories = data['brand_stories']
-    crm_goals = data['crm_goals']
-    crm_categorized = data['crm_categorized']
-    campaign_events = data['campaign_events']
-    integrated_templates = data['integrated_templates']
+def _reused_stages(args, use_cache=True):
+    """Stored outputs of the stages named in ``args.reuse`` (set by ``/regenerate``).
 
-    persona = find_persona(personas, args.persona)
-    product = find_product(products, args.brand, args.product)
+    Stages are taken in order up to the first one that is no longer stored;
+    everything after it is computed again.
+    """
+    reused = {}
+    ids = getattr(args, "reuse", None) or {}
+    if not use_cache:
+        return reused
+    for stage in STAGES:
+        value = _stage_store().get(ids[stage]) if stage in ids else None
+        if value is None:
+            break
+        reused[stage] = value
+    return reused
+
+
+def _prepare_rows(args_list, data, use_cache=True):
+    """Resolve persona/product for every row, then highlights and campaign events."""
+    rows = []
+    for args in args_list:
+        aarrr_stage, style_type = _resolve_stage_style(args)
+        seed = getattr(args, "seed", None)
+        rows.append({
+            "args": args,
+            "seed": seed,
+            # Seeded rows draw events/templates from their own RNG so they are reproducible.
+            "rng": random.Random(seed) if seed is not None else random,
+            "aarrr_stage": aarrr_stage,
+            "style_type": style_type,
+            "persona": find_persona(data['personas'], args.persona),
+            "product": find_product(data['products'], args.brand, args.product),
+            "reused": _reused_stages(args, use_cache),
+        })
 
     # Qwen highlights
-    highlights = top_highlights_for_product(persona, product, top_k=args.top_k)
-    highlight_texts = [h['snippet'] for h in highlights]
-
-    timeline = []
-
-    # Optionally select a campaign event
-    selected_event = None
-    if args.is_event == 1:
-        stage_events = campaign_events.get(aarrr_stage, {})
-        promo_y_list = stage_events.get("promotion_y", [])
-        if promo_y_list:
-            selected_event = random.choice(promo_y_list)
-
-    # Qwen draft
-    qwen_start = time.time()
-    if q_generator is None:
-        q_generator = _get_qwen_generator(args.qwen_model)
-    q_draft, q_dur = q_generator.generate_marketing_draft(
-        product.get('brand_name', ''),
-        product.get('name', ''),
-        persona,
-        product.get('reviews', []),
-        highlight_texts,
-        campaign_event_info=selected_event
+    pending = [row for row in rows if "highlights" not in row["reused"]]
+    all_highlights = top_highlights_batch(
+        [(row["persona"], row["product"], row["args"].top_k) for row in pending], use_cache=use_cache
     )
-    qwen_end = time.time()
-    qwen_duration = q_dur if q_dur is not None else (qwen_end - qwen_start)
-    timeline.append({
-        "step": "qwen_generation",
-        "model": args.qwen_model,
-        "started_at": datetime.fromtimestamp(qwen_start, timezone.utc).isoformat(),
-        "ended_at": datetime.fromtimestamp(qwen_end, timezone.utc).isoformat(),
-        "duration_seconds": qwen_duration,
-        "output_raw": q_draft
-    })
+    for row, highlights in zip(pending, all_highlights):
+        row["highlights"] = highlights
+
+    for row in rows:
+        row.setdefault("highlights", row["reused"].get("highlights"))
+        # Optionally select a campaign event
+        selected_event = None
+        if row["args"].is_event == 1:
+            stage_events = data['campaign_events'].get(row["aarrr_stage"], {})
+            promo_y_list = stage_events.get("promotion_y", [])
+            if promo_y_list:
+                selected_event = row["rng"].choice(promo_y_list)
+        if "qwen_draft" in row["reused"]:
+            # A reused draft keeps the event it was written for (the RNG above still advances as in a fresh run).
+            selected_event = row["reused"]["qwen_draft"]["selected_event"]
+        row["selected_event"] = selected_event
+    return rows
+
+
+def _qwen_draft_item(row):
+    product = row["product"]
+    return {
+        "brand_name": product.get('brand_name', ''),
+        "product_name": product.get('name', ''),
+        "persona": row["persona"],
+        "reviews": product.get('reviews', []),
+        "highlights": [h['snippet'] for h in row["highlights"]],
+        "campaign_event_info": row["selected_event"],
+    }
 
-    # Exaone prompt inputs (with RAG snippets)
-    brand_story = pick_brand_story(brand_stories, args.brand)
-    crm_goal = load_crm_goal_meta(crm_goals, args.stage_index)
-    bucket = select_stage_bucket(crm_categorized, args.stage_index)
-    rag_start = time.time()
-    crm_snippets = rag_crm_snippets(bucket, q_draft[:500], top_k=args.top_k)
-    rag_duration = time.time() - rag_start
+
+def _retrieve_crm_snippets(rows, q_drafts, data):
+    """CRM RAG for every row, one embedding call per (stage, top_k) group (reused snippets are kept)."""
+    snippets = [None] * len(rows)
+    groups = {}
+    for pos, row in enumerate(rows):
+        args = row["args"]
+        if "crm_snippets" in row.get("reused", {}):
+            snippets[pos] = row["reused"]["crm_snippets"]
+            continue
+        groups.setdefault((args.stage_index, args.top_k), []).append(pos)
+
+    for (stage_index, top_k), positions in groups.items():
+        bucket = select_stage_bucket(data['crm_categorized'], stage_index)
+        queries = [q_drafts[pos][:500] for pos in positions]
+        for pos, crm_snippets in zip(positions, rag_crm_snippets_batch(bucket, queries, top_k=top_k)):
+            snippets[pos] = crm_snippets
+    return snippets
+
+
+def _prepare_exaone(row, q_draft, crm_snippets, data, use_cache=True):
+    """Build the Exaone prompt (CRM RAG + style templates) for one row."""
+    args = row["args"]
+    crm_goal = load_crm_goal_meta(data['crm_goals'], args.stage_index)
+    reused = row.get("reused", {}).get("exaone_prompt")
+    if reused is not None:
+        return _set_exaone_prompt(row, q_draft, crm_goal, crm_snippets, reused["style_templates"], reused["messages"])
+    brand_story = pick_brand_story(data['brand_stories'], args.brand)
 
     # Pick CRM style templates for Exaone
     selected_templates = []
-    style_data = integrated_templates.get(style_type, {}).get("content", {})
-    candidates_pool = _get_style_candidates(style_data, aarrr_stage)
+    style_data = data['integrated_templates'].get(row["style_type"], {}).get("content", {})
+    candidates_pool = _get_style_candidates(style_data, row["aarrr_stage"], use_cache=use_cache)
 
     if candidates_pool:
         # Sample 2-3 templates
-        k = min(len(candidates_pool), random.randint(2, 3))
-        selected_templates = random.sample(candidates_pool, k)
+        k = min(len(candidates_pool), row["rng"].randint(2, 3))
+        selected_templates = row["rng"].sample(candidates_pool, k)
 
     # Build template reference strings
     style_ref_templates = []
@@ -384,44 +665,67 @@ def _run_pipeline(args, data=None, q_generator=None, exa_generator=None):
 
     exa_messages = build_exaone_prompt(
         qwen_draft=q_draft,
-        persona=persona,
+        persona=row["persona"],
         brand_story=brand_story,
         crm_goal=crm_goal,
         stage_index=args.stage_index,
         crm_snippets=crm_snippets,
         style_examples=style_ref_templates
     )
+    return _set_exaone_prompt(row, q_draft, crm_goal, crm_snippets, style_ref_templates, exa_messages)
+
+
+def _set_exaone_prompt(row, q_draft, crm_goal, crm_snippets, style_ref_templates, exa_messages):
     # Flatten prompt for logging
     exa_prompt_text = "\n\n".join(
         [f"[{m.get('role','')}] {m.get('content','')}" for m in exa_messages]
     )
-
-    # Exaone generation
-    exa_start = time.time()
-    if exa_generator is None:
-        exa_generator = _get_exaone_generator(args.exa_model)
-    else:
-        exa_generator = _ensure_exaone_adapter(exa_generator)
-    exa_output = exa_generator.generate(exa_messages)
-    exa_end = time.time()
-    timeline.append({
-        "step": "exaone_prompt",
-        "model": args.exa_model,
-        "prompt_preview": exa_prompt_text[:800]
-    })
-    timeline.append({
-        "step": "exaone_tone_correction",
-        "model": args.exa_model,
-        "started_at": datetime.fromtimestamp(exa_start, timezone.utc).isoformat(),
-        "ended_at": datetime.fromtimestamp(exa_end, timezone.utc).isoformat(),
-        "duration_seconds": exa_end - exa_start,
-        "output_raw": exa_output
+    row.update({
+        "q_draft": q_draft,
+        "crm_goal": crm_goal,
+        "crm_snippets": crm_snippets,
+        "style_templates": style_ref_templates,
+        "exa_messages": exa_messages,
+        "exa_prompt_text": exa_prompt_text,
     })
+    return row
 
-    # Build output
-    out = {
+
+def _build_output(row, exa_output, stage_times):
+    args = row["args"]
+    product = row["product"]
+    crm_goal = row["crm_goal"]
+    qwen_start, qwen_end, qwen_duration = stage_times["qwen"]
+    exa_start, exa_end = stage_times["exaone"]
+
+    timeline = [
+        {
+            "step": "qwen_generation",
+            "model": args.qwen_model,
+            "started_at": datetime.fromtimestamp(qwen_start, timezone.utc).isoformat(),
+            "ended_at": datetime.fromtimestamp(qwen_end, timezone.utc).isoformat(),
+            "duration_seconds": qwen_duration,
+            "output_raw": row["q_draft"]
+        },
+        {
+            "step": "exaone_prompt",
+            "model": args.exa_model,
+            "prompt_preview": row["exa_prompt_text"][:800]
+        },
+        {
+            "step": "exaone_tone_correction",
+            "model": args.exa_model,
+            "started_at": datetime.fromtimestamp(exa_start, timezone.utc).isoformat(),
+            "ended_at": datetime.fromtimestamp(exa_end, timezone.utc).isoformat(),
+            "duration_seconds": exa_end - exa_start,
+            "output_raw": exa_output
+        },
+    ]
+
+    return {
+        "engine": ENGINE,
         "persona_input": args.persona,
-        "persona_profile": persona,
+        "persona_profile": row["persona"],
         "brand": args.brand,
         "product_query": args.product,
         "product_basic": {
@@ -437,39 +741,661 @@ def _run_pipeline(args, data=None, q_generator=None, exa_generator=None):
         "objective": crm_goal.get('objective', ''),
         "target_state": crm_goal.get('target_state', ''),
         "style_index": args.style_index,
-        "style_type": style_type,
-        "style_templates": style_ref_templates,
+        "style_type": row["style_type"],
+        "style_templates": row["style_templates"],
         "is_event": True if args.is_event == 1 else False,
-        "selected_event": selected_event,
+        "selected_event": row["selected_event"],
+        "seed": row["seed"],
         "qwen": {
             "model": args.qwen_model,
-            "draft": q_draft,
-            "highlights": highlights
+            "draft": row["q_draft"],
+            "highlights": row["highlights"]
         },
         "exaone": {
             "model": args.exa_model,
-            "prompt_messages": exa_messages,
-            "prompt_text": exa_prompt_text,
-            "rag_crm_snippets": crm_snippets,
-            "selected_style_templates": style_ref_templates,
+            "prompt_messages": row["exa_messages"],
+            "prompt_text": row["exa_prompt_text"],
+            "rag_crm_snippets": row["crm_snippets"],
+            "selected_style_templates": row["style_templates"],
             "result_raw": exa_output
         },
         "timeline": timeline
     }
 
-    exa_duration = exa_end - exa_start
+
+# What a caller gets with ``verbose=False``: the message, what it was made for, and timing.
+SLIM_FIELDS = [
+    "engine",
+    "persona_input",
+    "persona_profile.name",
+    "brand",
+    "product_query",
+    "product_basic",
+    "stage_index",
+    "stage_name",
+    "style_index",
+    "style_type",
+    "is_event",
+    "selected_event",
+    "seed",
+    "candidate",
+    "tier",
+    "cache",
+    "result_id",
+    "reused_stages",
+    "qwen.draft",
+    "exaone.result_raw",
+    "timing",
+]
+
+
+def project_fields(output, fields):
+    """Keep only ``fields`` (dotted paths such as ``exaone.result_raw``) of a result dict."""
+    projected = {}
+    for field in fields:
+        parts = field.split(".")
+        value = output
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            target = projected
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return projected
+
+
+def _split_seeded(rows):
+    # Rows whose request was cancelled before their stage starts are dropped (left as "").
+    live = [i for i, row in enumerate(rows) if not _row_cancelled(row)]
+    batched = [i for i in live if rows[i]["seed"] is None]
+    seeded = [i for i in live if rows[i]["seed"] is not None]
+    return batched, seeded
+
+
+def _row_stop(row):
+    """What stops a row's generation: its caller's cancel token and/or its fallback deadline."""
+    cancel, deadline = row.get("cancel"), row.get("deadline")
+    if cancel is None or deadline is None:
+        return cancel or deadline
+    return AnyToken([cancel, deadline])
+
+
+def _row_cancelled(row):
+    token = _row_stop(row)
+    return token is not None and token.cancelled
+
+
+def _past_deadline(row):
+    """The row ran out of its ``deadline_ms`` budget (its caller is still waiting)."""
+    deadline = row.get("deadline")
+    return deadline is not None and deadline.cancelled and not (row.get("cancel") and row["cancel"].cancelled)
+
+
+def _template_draft(row):
+    return template_marketing_draft(row["persona"], row["product"], [h['snippet'] for h in row["highlights"]])
+
+
+def _stopping(rows, indices, rows_per_token=1):
+    """Per-row cancellation for one ``generate`` call over ``rows[i] for i in indices``."""
+    return stopping_criteria([_row_stop(rows[i]) for i in indices], rows_per_token=rows_per_token)
+
+
+def _raise_if_all_cancelled(rows):
+    tokens = [row.get("cancel") for row in rows]
+    if all_cancelled(tokens):
+        raise Cancelled(tokens[0].reason)
+
+
+def _generate_drafts(q_generator, rows):
+    """Qwen drafts: unseeded rows in one batched call, seeded rows one at a time.
+
+    A seeded row is decoded alone because its sampled tokens would otherwise
+    depend on which other rows shared the batch. Rows with a reused draft
+    (``/regenerate``) are not decoded at all.
+    """
+    drafts = [""] * len(rows)
+    duration = 0.0
+    reused = {i for i, row in enumerate(rows) if "qwen_draft" in row.get("reused", {})}
+    for i in reused:
+        drafts[i] = rows[i]["reused"]["qwen_draft"]["draft"]
+    batched, seeded = [[i for i in part if i not in reused] for part in _split_seeded(rows)]
+    if len(batched) == 1:
+        drafts[batched[0]], duration = q_generator.generate_marketing_draft(
+            **_qwen_draft_item(rows[batched[0]]), stopping_criteria=_stopping(rows, batched)
+        )
+    elif batched:
+        batch_drafts, duration = q_generator.generate_marketing_draft_batch(
+            [_qwen_draft_item(rows[i]) for i in batched], stopping_criteria=_stopping(rows, batched)
+        )
+        for i, q_draft in zip(batched, batch_drafts):
+            drafts[i] = q_draft
+    for i in seeded:
+        if _row_cancelled(rows[i]):
+            continue
+        drafts[i], q_dur = q_generator.generate_marketing_draft(
+            **_qwen_draft_item(rows[i]), seed=rows[i]["seed"], stopping_criteria=_stopping(rows, [i])
+        )
+        duration += q_dur or 0.0
+    return drafts, duration
+
+
+def _generate_exaone(exa_generator, rows, on_text=None, on_finish=None):
+    """Exaone outputs with the same batched/seeded split as ``_generate_drafts``."""
+    outputs = [""] * len(rows)
+    batched, seeded = _split_seeded(rows)
+
+    def remap(callback, index_of):
+        if callback is None:
+            return None
+        return lambda row, text: callback(index_of(row), text)
+
+    def single(i):
+        return {
+            "on_text": remap(on_text, lambda _: i),
+            "on_finish": remap(on_finish, lambda _: i),
+            "stopping_criteria": _stopping(rows, [i]),
+        }
+
+    if len(batched) == 1:
+        i = batched[0]
+        outputs[i] = exa_generator.generate(rows[i]["exa_messages"], **single(i))
+    elif batched:
+        batch_outputs = exa_generator.generate_batch(
+            [rows[i]["exa_messages"] for i in batched],
+            on_text=remap(on_text, batched.__getitem__),
+            on_finish=remap(on_finish, batched.__getitem__),
+            stopping_criteria=_stopping(rows, batched),
+        )
+        for i, exa_output in zip(batched, batch_outputs):
+            outputs[i] = exa_output
+    for i in seeded:
+        if _row_cancelled(rows[i]):
+            continue
+        outputs[i] = exa_generator.generate(rows[i]["exa_messages"], seed=rows[i]["seed"], **single(i))
+    return outputs
+
+
+def _semantic_partition(row, snapshot):
+    """Cache partition: every Exaone prompt input that is not embedded must match exactly.
+
+    Rows for a different persona, campaign event or retrieved CRM snippet set never share a cached message.
+    """
+    args = row["args"]
+    adapter_id = snapshot["adapter_id"] if snapshot else None
+    event = json.dumps(row["selected_event"], ensure_ascii=False, sort_keys=True) if row["selected_event"] else None
+    snippets = tuple((s.get("source_index"), s.get("filename")) for s in row["crm_snippets"] or [])
+    # A persona given as 0 or "0" is the same persona.
+    persona = str(args.persona)
+    return persona, args.brand, args.stage_index, args.style_index, args.exa_model, adapter_id, event, snippets
+
+
+def _semantic_text(row):
+    # Brand story, stage goal, event and CRM snippets are fixed within a partition; what varies is who it is for and the draft.
+    return f"{row['persona'].get('name', '')}\n{row['q_draft']}"
+
+
+def _generate_exaone_cached(exa_generator, rows, use_cache=True, snapshot=None, on_text=None, on_finish=None):
+    """``_generate_exaone`` behind the semantic cache (``SEMANTIC_CACHE_THRESHOLD``).
+
+    The rows' prompt inputs are embedded in one ``get_embedder`` call. A row
+    close enough to a cached row of the same persona, brand, stage, style, Exaone
+    model, campaign event and CRM snippets takes that row's text without decoding and is marked
+    ``cache="semantic"``; the rest are generated, and those that finished
+    (not cancelled or out of time) are stored. Seeded rows promise a
+    reproducible result, so they skip the cache both ways.
+    """
+    if _SEMANTIC_CACHE is None or not use_cache:
+        return _generate_exaone(exa_generator, rows, on_text=on_text, on_finish=on_finish)
+    outputs = [""] * len(rows)
+    live = [i for i, row in enumerate(rows) if not _row_cancelled(row) and row["seed"] is None]
+    vectors = get_embedder().encode([_semantic_text(rows[i]) for i in live], convert_to_tensor=False) if live else []
+    misses = [i for i, row in enumerate(rows) if not _row_cancelled(row) and row["seed"] is not None]
+    for i, vector in zip(live, vectors):
+        partition = _semantic_partition(rows[i], snapshot)
+        rows[i]["semantic"] = (partition, vector)
+        cached, similarity = _SEMANTIC_CACHE.get(partition, vector)
+        if cached is None:
+            misses.append(i)
+            continue
+        outputs[i] = cached
+        rows[i]["cache"] = "semantic"
+        rows[i]["semantic_similarity"] = similarity
+        if on_finish is not None:
+            on_finish(i, cached)
+
+    def remap(callback):
+        if callback is None:
+            return None
+        return lambda idx, text: callback(misses[idx], text)
+
+    misses.sort()
+    if misses:
+        generated = _generate_exaone(
+            exa_generator, [rows[i] for i in misses], on_text=remap(on_text), on_finish=remap(on_finish)
+        )
+        for i, exa_output in zip(misses, generated):
+            outputs[i] = exa_output
+            if exa_output and "semantic" in rows[i] and not _row_cancelled(rows[i]):
+                _SEMANTIC_CACHE.put(*rows[i]["semantic"], exa_output)
+    return outputs
+
+
+def _generate_candidates(q_generator, row, n):
+    """n Qwen drafts for one row from a single shared-prefill call."""
+    return q_generator.generate_marketing_draft_candidates(
+        **_qwen_draft_item(row), n=n, seed=row["seed"], stopping_criteria=_stopping([row], [0], rows_per_token=n)
+    )
+
+
+def _run_pipeline_batch(args_list, data=None, q_generator=None, exa_generator=None, on_event=None, n=1, cancel_tokens=None,
+                        context=None):
+    """Run several rows that share one Qwen/Exaone pair, one batched pass per model.
+
+    Work is done stage by stage across all rows: persona/product lookup, one
+    embedding call for highlights, one ``generate_marketing_draft_batch`` call,
+    one CRM RAG embedding call per stage and one Exaone ``generate_batch``
+    call. Results are returned in input order.
+
+    ``on_event(name, payload)``, if given, receives progress as it happens:
+    ``qwen_done`` and ``rag_done`` per row, then ``token`` events carrying the
+    Exaone text each row gained while decoding and ``exaone_done`` with a
+    row's final text as soon as that row stops (before the rest of the batch).
+
+    With ``n > 1`` (single row only) the result is ``n`` candidates: lookup,
+    highlights and the Qwen prefill are done once and ``n`` drafts sampled
+    with ``num_return_sequences``; CRM retrieval and Exaone then run as one
+    batch over the ``n`` drafts.
+
+    ``cancel_tokens`` (one ``CancelToken`` or None per row) cancel rows whose
+    caller went away: a cancelled row is skipped by stages that have not
+    started yet and stops decoding at the next step of a running ``generate``
+    (the rest of the batch carries on). If every row is cancelled the batch
+    raises ``Cancelled`` between stages.
+
+    ``context`` (a ``PipelineContext``) carries the data, generators and cache
+    policy; without one it is built from ``data``/the generators and the
+    first row's ``disable_cache``. Nothing module-global is switched, so
+    concurrent calls from a thread pool do not interfere.
+    """
+    if not args_list:
+        return []
+    first = args_list[0]
+    if context is None:
+        context = PipelineContext.for_args(first, data, q_generator, exa_generator)
+
+    # Models come from the registry and stay leased (not evictable) for the whole batch.
+    with _serving_models(
+        first.qwen_model, first.exa_model, context.q_generator, context.exa_generator
+    ) as (snapshot, q_gen, exa_gen):
+        return _run_batch_stages(
+            _served_args(args_list, snapshot), context, q_gen, exa_gen, on_event, n=n, cancel_tokens=cancel_tokens,
+            snapshot=snapshot,
+        )
+
+
+def _run_batch_stages(args_list, context, q_generator, exa_generator, on_event, n=1, cancel_tokens=None, snapshot=None):
+    emit = on_event or (lambda name, payload: None)
+    total_start = time.time()
+    data, load_duration = context.load_data()
+
+    rows = _prepare_rows(args_list, data, use_cache=context.use_cache)
+    for row, token in zip(rows, cancel_tokens or []):
+        row["cancel"] = token
+    for row in rows:
+        deadline_at = getattr(row["args"], "deadline_at", None)
+        row["deadline"] = CancelToken(deadline_at) if deadline_at else None
+    _raise_if_all_cancelled(rows)
+
+    # Qwen drafts (one batched forward pass)
+    qwen_start = time.time()
+    if n > 1:
+        if len(rows) != 1:
+            raise ValueError("n > 1 candidates are generated for a single request at a time")
+        q_drafts, q_dur = _generate_candidates(q_generator, rows[0], n)
+        rows = [dict(rows[0], candidate=i) for i in range(n)]
+    else:
+        q_drafts, q_dur = _generate_drafts(q_generator, rows)
+    qwen_end = time.time()
+    qwen_duration = q_dur if q_dur is not None else (qwen_end - qwen_start)
+    for idx, row in enumerate(rows):
+        row["tier"] = "exaone"
+        if _past_deadline(row) and "qwen_draft" not in row["reused"]:
+            # Out of time before the draft was finished: fall back to the template drafter.
+            row["tier"] = "template"
+            q_drafts[idx] = _template_draft(row)
+        emit("qwen_done", {"index": idx, "draft": q_drafts[idx]})
+
+    # Exaone prompt inputs (with RAG snippets)
+    rag_start = time.time()
+    all_snippets = _retrieve_crm_snippets(rows, q_drafts, data)
+    rag_duration = time.time() - rag_start
+    for idx, (row, q_draft, crm_snippets) in enumerate(zip(rows, q_drafts, all_snippets)):
+        _prepare_exaone(row, q_draft, crm_snippets, data, use_cache=context.use_cache)
+        emit("rag_done", {"index": idx})
+
+    # Exaone generation (one batched forward pass)
+    _raise_if_all_cancelled(rows)
+    exa_start = time.time()
+    on_text = on_finish = None
+    if on_event is not None:
+        on_text = lambda idx, text: emit("token", {"index": idx, "text": text})  # noqa: E731
+        on_finish = lambda idx, text: emit("exaone_done", {"index": idx, "text": text})  # noqa: E731
+    if n > 1:
+        # Candidates always share one batch, so a seed stays reproducible here.
+        exa_outputs = exa_generator.generate_batch(
+            [row["exa_messages"] for row in rows], on_text=on_text, seed=rows[0]["seed"], on_finish=on_finish,
+            stopping_criteria=_stopping(rows, range(n)),
+        )
+    else:
+        exa_outputs = _generate_exaone_cached(
+            exa_generator, rows, context.use_cache, snapshot, on_text=on_text, on_finish=on_finish
+        )
+    exa_end = time.time()
+    for idx, row in enumerate(rows):
+        if row["tier"] == "template":
+            exa_outputs[idx] = q_drafts[idx]
+        elif row.get("cache") != "semantic" and _past_deadline(row):
+            # Exaone did not finish in time: serve the raw Qwen draft instead of a cut-off message.
+            row["tier"] = "qwen"
+            exa_outputs[idx] = q_drafts[idx]
+
+    stage_times = {
+        "qwen": (qwen_start, qwen_end, qwen_duration),
+        "exaone": (exa_start, exa_end),
+    }
     total_duration = time.time() - total_start
-    timing = {
-        "load": load_duration,
-        "qwen": qwen_duration,
-        "rag": rag_duration,
-        "exaone": exa_duration,
-        "total": total_duration,
+    q_tokens = _count_tokens(q_generator, q_drafts)
+    exa_tokens = _count_tokens(exa_generator, exa_outputs)
+    outputs = []
+    stage_items = []
+    for idx, (row, exa_output) in enumerate(zip(rows, exa_outputs)):
+        out = _build_output(row, exa_output, stage_times)
+        if "candidate" in row:
+            out["candidate"] = row["candidate"]
+        out["tier"] = row["tier"]
+        _mark_semantic(out, row)
+        _stamp_version(out, snapshot)
+        stage_items += _record_stages(out, row, context.use_cache)
+        timing = {
+            "load": load_duration,
+            "qwen": qwen_duration,
+            "rag": rag_duration,
+            "exaone": exa_end - exa_start,
+            "total": total_duration,
+            "qwen_tokens": q_tokens[idx],
+            "exaone_tokens": exa_tokens[idx],
+        }
+        if n > 1:
+            timing["candidates"] = n
+        elif len(rows) > 1:
+            timing["batch_size"] = len(rows)
+        out["timing"] = timing
+        _record_timing(timing)
+        print(
+            "[Timing] "
+            f"load={timing['load']:.2f}s "
+            f"qwen={timing['qwen']:.2f}s "
+            f"rag={timing['rag']:.2f}s "
+            f"exaone={timing['exaone']:.2f}s "
+            f"total={timing['total']:.2f}s"
+        )
+        outputs.append(out)
+    _stage_store().put_many(stage_items)
+    return outputs
+
+
+def _matrix_cells(spec, data):
+    """Expand a campaign-matrix spec into one args namespace per (persona, stage, style) cell."""
+    personas = spec.personas if spec.personas else list(range(len(data['personas'])))
+    stages = spec.stage_indices if spec.stage_indices else list(range(len(STAGE_ORDER)))
+    styles = spec.style_indices if spec.style_indices else list(range(len(STYLE_TYPES)))
+    cells = []
+    for persona in personas:
+        for stage_index in stages:
+            for style_index in styles:
+                cells.append(argparse.Namespace(
+                    persona=persona,
+                    brand=spec.brand,
+                    product=spec.product,
+                    stage_index=stage_index,
+                    style_index=style_index,
+                    is_event=spec.is_event,
+                    top_k=spec.top_k,
+                    qwen_model=spec.qwen_model,
+                    exa_model=spec.exa_model,
+                    requested_models=getattr(spec, "requested_models", None),
+                    out_path=None,
+                    batch_json=None,
+                    disable_cache=spec.disable_cache,
+                    seed=spec.seed,
+                ))
+    return cells
+
+
+def _run_campaign_matrix(spec, data=None, q_generator=None, exa_generator=None, on_event=None, batch_size=8,
+                         cancel_token=None, context=None):
+    """Every persona x stage x style cell for one product, computing shared work once.
+
+    The grid is planned as a dependency graph so each distinct intermediate is
+    computed exactly once and reused by every cell that needs it:
+
+    - persona/product lookup and review highlights: one per persona
+    - campaign event: one per stage (only with ``is_event``)
+    - Qwen draft: one per (persona, event); the draft ignores stage and style
+    - CRM retrieval: one per (stage, draft)
+    - style template pool: one per (style, stage)
+
+    Only the Exaone prompt is per cell; drafts and Exaone prompts are then
+    generated in batches of ``batch_size``. ``on_event`` receives ``plan``
+    (the counts above) up front, ``qwen_done`` per draft and ``cell`` with
+    each cell's result as soon as its Exaone batch finishes.
+
+    Returns ``(outputs, plan)`` with outputs in cell order.
+    """
+    if context is None:
+        context = PipelineContext.for_args(spec, data, q_generator, exa_generator)
+    with _serving_models(
+        spec.qwen_model, spec.exa_model, context.q_generator, context.exa_generator
+    ) as (snapshot, q_gen, exa_gen):
+        spec = _served_args([spec], snapshot)[0]
+        return _run_matrix_stages(spec, context, q_gen, exa_gen, on_event, batch_size, cancel_token, snapshot)
+
+
+def _run_matrix_stages(spec, context, q_generator, exa_generator, on_event, batch_size, cancel_token, snapshot=None):
+    emit = on_event or (lambda name, payload: None)
+    batch_size = max(1, batch_size)
+    total_start = time.time()
+    data, load_duration = context.load_data()
+
+    cells = _matrix_cells(spec, data)
+    product = find_product(data['products'], spec.brand, spec.product)
+    rng = random.Random(spec.seed) if spec.seed is not None else random
+
+    # One lookup and one highlight set per persona.
+    persona_keys = list(dict.fromkeys(str(args.persona) for args in cells))
+    personas = {key: find_persona(data['personas'], key) for key in persona_keys}
+    highlights = dict(zip(persona_keys, top_highlights_batch(
+        [(personas[key], product, spec.top_k) for key in persona_keys], use_cache=context.use_cache
+    )))
+
+    # One campaign event per stage.
+    events = {}
+    for args in cells:
+        aarrr_stage, _ = _resolve_stage_style(args)
+        if aarrr_stage not in events:
+            promo_y_list = data['campaign_events'].get(aarrr_stage, {}).get("promotion_y", [])
+            events[aarrr_stage] = rng.choice(promo_y_list) if spec.is_event == 1 and promo_y_list else None
+
+    rows = []
+    draft_rows = {}
+    rag_rows = {}
+    for args in cells:
+        aarrr_stage, style_type = _resolve_stage_style(args)
+        persona_key = str(args.persona)
+        row = {
+            "args": args,
+            "seed": spec.seed,
+            "rng": random.Random(spec.seed) if spec.seed is not None else random,
+            "aarrr_stage": aarrr_stage,
+            "style_type": style_type,
+            "persona": personas[persona_key],
+            "product": product,
+            "highlights": highlights[persona_key],
+            "selected_event": events[aarrr_stage],
+            "cancel": cancel_token,
+        }
+        # The Qwen draft depends only on the persona and the event it mentions.
+        row["draft_key"] = (persona_key, json.dumps(row["selected_event"], ensure_ascii=False, sort_keys=True))
+        draft_rows.setdefault(row["draft_key"], row)
+        rag_rows.setdefault((args.stage_index, row["draft_key"]), row)
+        rows.append(row)
+    draft_keys = list(draft_rows)
+    rag_keys = list(rag_rows)
+    plan = {
+        "cells": len(rows),
+        "personas": len(persona_keys),
+        "highlights": len(persona_keys),
+        "events": sum(event is not None for event in events.values()),
+        "drafts": len(draft_keys),
+        "crm_retrievals": len(rag_keys),
+        "template_pools": len({(row["style_type"], row["aarrr_stage"]) for row in rows}),
+        "exaone": len(rows),
     }
-    out["timing"] = timing
-    _record_timing(timing)
+    emit("plan", plan)
+    _raise_if_all_cancelled(rows)
+
+    # Qwen drafts, batched across distinct drafts.
+    qwen_start = time.time()
+    drafts = {}
+    qwen_duration = 0.0
+    for start in range(0, len(draft_keys), batch_size):
+        keys = draft_keys[start:start + batch_size]
+        chunk_drafts, q_dur = _generate_drafts(q_generator, [draft_rows[key] for key in keys])
+        qwen_duration += q_dur or 0.0
+        for key, q_draft in zip(keys, chunk_drafts):
+            drafts[key] = q_draft
+            emit("qwen_done", {"persona": key[0], "draft": q_draft})
+    qwen_end = time.time()
+
+    # CRM retrieval per (stage, draft); prompts per cell.
+    rag_start = time.time()
+    retrieved = _retrieve_crm_snippets([rag_rows[key] for key in rag_keys], [drafts[key[1]] for key in rag_keys], data)
+    snippets = dict(zip(rag_keys, retrieved))
+    for row in rows:
+        _prepare_exaone(
+            row, drafts[row["draft_key"]], snippets[(row["args"].stage_index, row["draft_key"])], data,
+            use_cache=context.use_cache,
+        )
+    rag_duration = time.time() - rag_start
+
+    # Exaone, batched across cells.
+    _raise_if_all_cancelled(rows)
+    outputs = [None] * len(rows)
+    stage_items = []
+    q_tokens = dict(zip(draft_keys, _count_tokens(q_generator, [drafts[key] for key in draft_keys])))
+    for start in range(0, len(rows), batch_size):
+        chunk = rows[start:start + batch_size]
+        exa_start = time.time()
+        exa_outputs = _generate_exaone_cached(exa_generator, chunk, context.use_cache, snapshot)
+        exa_end = time.time()
+        stage_times = {"qwen": (qwen_start, qwen_end, qwen_duration), "exaone": (exa_start, exa_end)}
+        exa_tokens = _count_tokens(exa_generator, exa_outputs)
+        for offset, (row, exa_output) in enumerate(zip(chunk, exa_outputs)):
+            out = _build_output(row, exa_output, stage_times)
+            out["timing"] = {
+                "load": load_duration,
+                "qwen": qwen_duration,
+                "rag": rag_duration,
+                "exaone": exa_end - exa_start,
+                "total": time.time() - total_start,
+                "qwen_tokens": q_tokens[row["draft_key"]],
+                "exaone_tokens": exa_tokens[offset],
+                "batch_size": len(chunk),
+            }
+            _mark_semantic(out, row)
+            _stamp_version(out, snapshot)
+            stage_items += _record_stages(out, row, context.use_cache)
+            outputs[start + offset] = out
+            emit("cell", {"index": start + offset, "result": out})
+    _stage_store().put_many(stage_items)
+    print(
+        "[Matrix] "
+        f"cells={plan['cells']} drafts={plan['drafts']} crm={plan['crm_retrievals']} "
+        f"qwen={qwen_duration:.2f}s rag={rag_duration:.2f}s total={time.time() - total_start:.2f}s"
+    )
+    return outputs, plan
+
+
+def _mark_semantic(out, row):
+    if row.get("cache") == "semantic":
+        out["cache"] = "semantic"
+        out["exaone"]["semantic_similarity"] = row["semantic_similarity"]
+
+
+def _record_stages(out, row, use_cache=True):
+    """Tag ``out`` with its stage content ids and ``result_id``; returns the store entries to write.
+
+    Template-tier rows (no Qwen draft) and rows whose caller went away are
+    not recorded, nor is anything for ``disable_cache`` requests.
+    """
+    cancel = row.get("cancel")
+    if not use_cache or row.get("tier") == "template" or (cancel is not None and cancel.cancelled):
+        return []
+    values = {
+        "highlights": row["highlights"],
+        "qwen_draft": {"draft": row["q_draft"], "selected_event": row["selected_event"]},
+        "crm_snippets": row["crm_snippets"],
+        "exaone_prompt": {"messages": row["exa_messages"], "style_templates": row["style_templates"]},
+    }
+    stages = {stage: stage_id(stage, values[stage]) for stage in STAGES}
+    # Record the request as the caller sent it, not with the hot-swapped model names.
+    request = dict(vars(row["args"]), **(getattr(row["args"], "requested_models", None) or {}))
+    result_id, record = result_record(request, stages)
+    out["stages"] = stages
+    out["result_id"] = result_id
+    if row.get("reused"):
+        out["reused_stages"] = [stage for stage in STAGES if stage in row["reused"]]
+    return [(stages[stage], values[stage]) for stage in STAGES] + [(result_id, record)]
+
+
+def _stamp_version(out, snapshot):
+    """Tag a result with the serving version (and Exaone adapter) that produced it."""
+    if snapshot is None:
+        return
+    out["version"] = snapshot["version"]
+    out["exaone"]["adapter_id"] = snapshot["adapter_id"]
+
+
+def _count_tokens(generator, texts):
+    """Generated-token counts per text, using the generator's own tokenizer."""
+    tokenizer = getattr(generator, "tokenizer", None)
+    if tokenizer is None:
+        return [0] * len(texts)
+    return [len(tokenizer(text or "", add_special_tokens=False)["input_ids"]) for text in texts]
+
+
+def _group_batches(items, batch_size, key=lambda a: (a.qwen_model, a.exa_model)):
+    """Split items into same-model chunks of at most batch_size, yielding input positions."""
+    groups = {}
+    for idx, item in enumerate(items):
+        groups.setdefault(key(item), []).append(idx)
+    batch_size = max(1, batch_size)
+    for indices in groups.values():
+        for start in range(0, len(indices), batch_size):
+            yield indices[start:start + batch_size]
+
+
+def _run_pipeline(args, data=None, q_generator=None, exa_generator=None, context=None):
+    """One request end to end; reentrant, all per-request state lives in ``context``."""
+    out = _run_pipeline_batch(
+        [args], data=data, q_generator=q_generator, exa_generator=exa_generator, context=context
+    )[0]
 
     # # Write log output
+    # base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     # log_dir = os.path.join(base, 'log')
     # os.makedirs(log_dir, exist_ok=True)
 
@@ -487,15 +1413,15 @@ def _run_pipeline(args, data=None, q_generator=None, exa_generator=None):
     # # Minimal result for user
     # user_output = {
     #     "persona_id": args.persona,
-    #     "product_id": product.get('product_id'),
+    #     "product_id": out["product_basic"].get('product_id'),
     #     "send_purpose": STAGE_ORDER[args.stage_index],
-    #     "customer_segment": persona.get('name'),
-    #     "has_event": True if args.is_event == 1 else False,
-    #     "marketing_draft": q_draft,
-    #     "crm_message": exa_output
+    #     "customer_segment": out["persona_profile"].get('name'),
+    #     "has_event": out["is_event"],
+    #     "marketing_draft": out["qwen"]["draft"],
+    #     "crm_message": out["exaone"]["result_raw"]
     # }
-    # if selected_event:
-    #     user_output["event_info"] = selected_event
+    # if out["selected_event"]:
+    #     user_output["event_info"] = out["selected_event"]
 
     # output_filename = f"result_{args.brand}_{timestamp_str}.json"
     # output_path = args.out_path or os.path.join(final_output_dir, output_filename)
@@ -505,21 +1431,6 @@ def _run_pipeline(args, data=None, q_generator=None, exa_generator=None):
 
     # print("Log saved:", log_path)
     # print("Result saved:", output_path)
-    # print("--- Qwen draft ---")
-    # print(q_draft[:400])
-    # print("\n--- Exaone refined ---")
-    # print(exa_output[:400])
-    # print("\n--- Exaone prompt ---")
-    # print(exa_prompt_text[:1200])
-
-    print(
-        "[Timing] "
-        f"load={timing['load']:.2f}s "
-        f"qwen={timing['qwen']:.2f}s "
-        f"rag={timing['rag']:.2f}s "
-        f"exaone={timing['exaone']:.2f}s "
-        f"total={timing['total']:.2f}s"
-    )
     return out
 
 
@@ -536,11 +1447,12 @@ def main():
     parser.add_argument('--style_index', type=int, default=0, help='CRM template style index (0~5)')
     parser.add_argument('--out_path', default=None, help='Output path')
     parser.add_argument('--batch_json', default=None, help='Batch input JSON path (list of rows)')
+    parser.add_argument('--batch_size', type=int, default=8, help='Rows per batched Qwen/Exaone pass (with --batch_json)')
     parser.add_argument('--disable_cache', action='store_true', help='Disable in-process caches')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible event/template sampling and decoding')
     args = parser.parse_args()
 
     base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    _set_cache_enabled(not args.disable_cache)
 
     if args.batch_json:
         with open(args.batch_json, 'r', encoding='utf-8') as f:
@@ -548,15 +1460,7 @@ def main():
         if not isinstance(rows, list):
             raise ValueError('batch_json must be a list of row dicts')
 
-        data = None
-        q_generator = None
-        exa_generator = None
-        if not args.disable_cache:
-            data = _load_data(base)
-            q_generator = _get_qwen_generator(args.qwen_model)
-            exa_generator = _get_exaone_generator(args.exa_model)
-        outputs = []
-
+        row_args_list = []
         for idx, row in enumerate(rows, start=1):
             normalized = _normalize_row(row)
             row_args = argparse.Namespace(**vars(args))
@@ -565,11 +1469,21 @@ def main():
                     setattr(row_args, key, value)
             if row_args.persona is None or row_args.brand is None or row_args.product is None or row_args.stage_index is None:
                 raise ValueError(f"Missing required fields in batch row {idx}")
-            outputs.append(_run_pipeline(row_args, data=data, q_generator=q_generator, exa_generator=exa_generator))
+            row_args_list.append(row_args)
+
+        data = None
+        if not args.disable_cache:
+            data = _load_data(base)
+        outputs = [None] * len(row_args_list)
+        for indices in _group_batches(row_args_list, args.batch_size):
+            chunk = [row_args_list[i] for i in indices]
+            results = _run_pipeline_batch(chunk, data=data)
+            for i, result in zip(indices, results):
+                outputs[i] = result
 
         if args.out_path:
-            with open(args.out_path, 'w', encoding='utf-8') as f:
-                json.dump(outputs, f, ensure_ascii=False, indent=2)
+            with open(args.out_path, 'wb') as f:
+                f.write(fast_json.dumps(outputs, indent=True))
         return outputs
 
     # Single run
@@ -578,7 +1492,7 @@ def main():
         if getattr(args, key) is None:
             parser.error(f"--{key} is required unless --batch_json is provided")
 
-    data = _load_data(base)
+    data = None if args.disable_cache else _load_data(base)
     return _run_pipeline(args, data=data)
 if __name__ == '__main__':
     main()
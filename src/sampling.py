@@ -0,0 +1,67 @@
+"""
+샘플링 RNG 잠금
+
+torch의 샘플링 난수 상태는 프로세스 전체에서 하나이므로, Qwen과 Exaone의 모든 `model.generate`
+호출이 이 모듈의 잠금 하나를 함께 씁니다.
+  - 시드 없는 호출은 공유 모드로 잡아 서로 동시에 실행됩니다
+  - 시드가 있는 호출은 단독으로 잡고 `torch.manual_seed` 후 디코딩이 끝날 때까지 유지합니다
+    (그동안 다른 샘플링 호출이 난수를 소비하지 않으므로 같은 시드 ⇒ 같은 결과)
+"""
+
+import threading
+from contextlib import contextmanager
+
+import torch
+
+
+class _SamplingLock:
+    """Shared for unseeded decodes, exclusive for seeded ones; waiting seeded calls go first."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            while self._exclusive or self._waiting:
+                self._cond.wait()
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._shared -= 1
+                self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            self._waiting += 1
+            while self._exclusive or self._shared:
+                self._cond.wait()
+            self._waiting -= 1
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+_LOCK = _SamplingLock()
+
+
+@contextmanager
+def sampling(seed=None):
+    """Hold the process-wide sampling lock around one ``generate`` call, seeding torch first if ``seed`` is given."""
+    if seed is None:
+        with _LOCK.shared():
+            yield
+        return
+    with _LOCK.exclusive():
+        torch.manual_seed(seed)
+        yield
@@ -0,0 +1,102 @@
+"""
+의미 기반(near-duplicate) 응답 캐시
+
+EXAONE 단계 앞에서, 조립된 프롬프트 입력을 임베딩해 같은 파티션(브랜드, 스테이지, 스타일 등)에
+이미 만든 결과 중 코사인 유사도가 임계값 이상인 것이 있으면 EXAONE을 돌리지 않고 그 결과를
+재사용합니다. 같은 라인의 비슷한 제품이나 표현만 바뀐 캠페인 문구처럼, 결과가 사실상 같아질
+요청을 한 번만 생성하기 위한 것입니다.
+
+항목은 LRU 순서로 관리하며 항목 수와 추정 메모리 사용량이 한도를 넘으면 오래 쓰지 않은 것부터 버립니다.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+class SemanticCache:
+    """Nearest-neighbour cache: a stored value answers any query vector close enough to its own.
+
+    ``get(partition, vector)`` compares only against entries of the same
+    partition and returns the most similar value whose cosine similarity is
+    at least ``threshold``. Least recently used entries are evicted once
+    there are more than ``max_entries`` or their estimated size (vector plus
+    value) exceeds ``max_bytes``.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=4096, max_bytes=64 * 1024 * 1024):
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # entry id -> (partition, vector, value, size)
+        self._partitions = {}  # partition -> {entry id: vector}
+        self._next_id = 0
+
+    def get(self, partition, vector):
+        """``(value, similarity)`` of the closest entry at or above the threshold, else ``(None, best)``."""
+        query = _unit(vector)
+        with self._lock:
+            members = self._partitions.get(partition)
+            best_id, best = None, 0.0
+            if members:
+                ids = list(members)
+                scores = np.stack([members[i] for i in ids]) @ query
+                pos = int(np.argmax(scores))
+                best_id, best = ids[pos], float(scores[pos])
+            if best_id is None or best < self.threshold:
+                self.misses += 1
+                return None, best
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][2], best
+
+    def put(self, partition, vector, value):
+        vector = _unit(vector)
+        size = vector.nbytes + len(str(value).encode("utf-8")) + 200
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (partition, vector, value, size)
+            self._partitions.setdefault(partition, {})[entry_id] = vector
+            self.bytes += size
+            while len(self._entries) > self.max_entries or (self.bytes > self.max_bytes and len(self._entries) > 1):
+                self._evict()
+
+    def _evict(self):
+        entry_id, (partition, _, _, size) = self._entries.popitem(last=False)
+        members = self._partitions[partition]
+        del members[entry_id]
+        if not members:
+            del self._partitions[partition]
+        self.bytes -= size
+        self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._partitions.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "partitions": len(self._partitions),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "threshold": self.threshold,
+            }
@@ -0,0 +1,87 @@
+"""
+진행 중인 동일 요청 합치기(singleflight)
+
+같은 파라미터(시드 포함)의 요청이 이미 생성 중이면 새로 Qwen+EXAONE를 돌리지 않고
+진행 중인 계산에 합류해 같은 결과를 받습니다. 먼저 들어온 요청(leader)이 계산하고,
+뒤에 들어온 요청(follower)은 leader의 Future를 기다립니다.
+
+leader가 보내는 진행 이벤트(qwen_done, token 등)는 기록해 두었다가 늦게 합류한
+follower에게도 처음부터 다시 전달하므로 스트리밍 응답도 그대로 동작합니다.
+"""
+
+import threading
+from concurrent.futures import Future
+
+
+class Flight:
+    """One in-flight computation: a Future for its result plus its event history.
+
+    ``token`` is free for the caller, e.g. a cancel token shared by everyone
+    waiting on the flight; it is set before any other caller can see the flight.
+    """
+
+    def __init__(self, key, token=None):
+        self.key = key
+        self.future = Future()
+        self.followers = 0
+        self.token = token
+        self._lock = threading.Lock()
+        self._events = []
+        self._listeners = []
+
+    def emit(self, name, payload):
+        with self._lock:
+            self._events.append((name, payload))
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(name, payload)
+
+    def subscribe(self, listener):
+        """Deliver every event so far, then each new one, to ``listener(name, payload)``."""
+        with self._lock:
+            history = list(self._events)
+            self._listeners.append(listener)
+        for name, payload in history:
+            listener(name, payload)
+
+
+class SingleFlight:
+    """Registry of in-flight computations keyed by request parameters.
+
+    ``join(key, token_factory)`` returns ``(flight, leader)``; a new flight's
+    ``token`` comes from ``token_factory()``, made under the registry lock so
+    a concurrent follower never sees a flight without one. The leader must call
+    ``finish(flight, result=...)`` or ``finish(flight, exc=...)`` exactly once;
+    followers wait on ``flight.future``. A finished key is forgotten, so the
+    next identical request starts a fresh computation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def join(self, key, token_factory=None):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.followers += 1
+                return flight, False
+            flight = self._flights[key] = Flight(key, token_factory() if token_factory is not None else None)
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, flight, result=None, exc=None):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        if exc is not None:
+            flight.future.set_exception(exc)
+        else:
+            flight.future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {"inflight": len(self._flights), "leaders": self.leaders, "followers": self.followers}
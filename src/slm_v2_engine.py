@@ -0,0 +1,167 @@
+"""
+slm_v2 엔진 (GGUF / llama.cpp) 서버 연결
+
+slm_v2_pipeline의 6단계 파이프라인을 서버 안에서 계속 띄워 둔 채로 실행합니다.
+  - 모델(Qwen3 0.6B/4B, HyperCLOVAX)은 서버 시작 시 한 번만 로드하고
+  - 데이터와 리뷰 하이라이트는 Qwen→Exaone 파이프라인과 같은 PipelineContext/캐시를 씁니다
+  - 결과 파일을 쓰지 않고, Qwen→Exaone 결과와 같은 모양의 dict를 돌려줍니다
+    (최종 메시지는 `exaone.result_raw`, 브랜드 스타일 문장은 `qwen.draft`)
+
+CPU 전용 노드에서는 float32 transformers 경로보다 훨씬 가볍습니다. llama-cpp-python이 필요합니다.
+"""
+
+import os
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.append(REPO_DIR)
+
+from cancellation import Cancelled, all_cancelled  # noqa: E402
+from generate_marketing import find_persona, find_product  # noqa: E402
+from tone_correction import load_crm_goal_meta, STAGE_ORDER  # noqa: E402
+import run_qwen_exaone_pipeline as pipeline  # noqa: E402
+from slm_v2_pipeline import keyword_tokenizer, model as slm_model  # noqa: E402
+from slm_v2_pipeline.run_slm_v2 import run_steps  # noqa: E402
+
+ENGINE = "slm_v2"
+DRAFT_MODEL = os.path.basename(slm_model.QWEN_4B_PATH)
+POLISH_MODEL = os.path.basename(slm_model.HYPERCLOVAX_PATH)
+
+
+def _require_llama_cpp():
+    try:
+        import llama_cpp  # noqa: F401
+    except ImportError as exc:
+        raise RuntimeError("llama-cpp-python is required for the slm_v2 engine.") from exc
+
+
+def preload():
+    """Load every GGUF model (and the keyword sentiment model) once, up front."""
+    _require_llama_cpp()
+    slm_model.get_creator()
+    slm_model.get_validator()
+    slm_model.get_styler()
+    slm_model.get_polisher()
+    keyword_tokenizer.get_sentiment_model()
+
+
+def _stopper(token):
+    if token is None:
+        return None
+
+    def check():
+        if token.cancelled:
+            raise Cancelled(token.reason)
+
+    return check
+
+
+def _build_output(args, persona, product, crm_goal, highlights, steps, load_duration, rag_duration):
+    timeline = [
+        {"step": step["step"], "duration_seconds": step["duration"]}
+        for step in steps["timeline"]
+    ]
+    durations = {step["step"]: step["duration"] for step in steps["timeline"]}
+    polish = durations.get("FinalPolisher", 0.0)
+    return {
+        "engine": ENGINE,
+        "persona_input": args.persona,
+        "persona_profile": persona,
+        "brand": args.brand,
+        "product_query": args.product,
+        "product_basic": {
+            "product_id": product.get('product_id'),
+            "name": product.get('name'),
+            "brand_name": product.get('brand_name'),
+            "price": product.get('price'),
+            "url": product.get('url')
+        },
+        "stage_index": args.stage_index,
+        "stage_name": STAGE_ORDER[args.stage_index],
+        "stage_kr": crm_goal.get('stage_kr', ''),
+        "objective": crm_goal.get('objective', ''),
+        "target_state": crm_goal.get('target_state', ''),
+        "style_index": args.style_index,
+        "style_type": None,
+        "style_templates": [],
+        "is_event": False,
+        "selected_event": None,
+        "seed": getattr(args, "seed", None),
+        "tier": ENGINE,
+        "qwen": {
+            "model": DRAFT_MODEL,
+            "draft": steps["steps"]["styled_message"],
+            "highlights": highlights,
+        },
+        "exaone": {
+            "model": POLISH_MODEL,
+            "result_raw": steps["final_output"],
+        },
+        "slm_v2": steps["steps"],
+        "timeline": timeline,
+        "timing": {
+            "load": load_duration,
+            "rag": rag_duration,
+            "qwen": sum(durations.values()) - polish,
+            "exaone": polish,
+            "total": load_duration + rag_duration + steps["total_duration_seconds"],
+        },
+    }
+
+
+def run_batch(args_list, context, on_event=None, cancel_tokens=None):
+    """Run rows through the slm_v2 steps, one row after another (llama.cpp decodes one sequence).
+
+    Highlights for all rows come from one embedding call through the shared
+    highlight cache. ``on_event`` gets ``qwen_done`` (brand-styled sentence)
+    and ``exaone_done`` (polished message) per row. A row whose token is
+    cancelled stops before its next model step; like the Qwen→Exaone path,
+    ``Cancelled`` is raised only when every row is cancelled.
+    """
+    _require_llama_cpp()
+    emit = on_event or (lambda name, payload: None)
+    tokens = list(cancel_tokens or [None] * len(args_list))
+    data, load_duration = context.load_data()
+
+    rag_start = time.time()
+    personas = [find_persona(data['personas'], args.persona) for args in args_list]
+    products = [find_product(data['products'], args.brand, args.product) for args in args_list]
+    all_highlights = pipeline.top_highlights_batch(
+        [(persona, product, args.top_k) for persona, product, args in zip(personas, products, args_list)],
+        use_cache=context.use_cache,
+    )
+    rag_duration = time.time() - rag_start
+
+    outputs = []
+    for idx, args in enumerate(args_list):
+        if all_cancelled(tokens):
+            raise Cancelled(tokens[0].reason)
+        if tokens[idx] is not None and tokens[idx].cancelled:
+            outputs.append(Cancelled(tokens[idx].reason))
+            continue
+        aarrr_stage = STAGE_ORDER[args.stage_index] if 0 <= args.stage_index < len(STAGE_ORDER) else STAGE_ORDER[0]
+        try:
+            steps = run_steps(
+                personas[idx], products[idx], args.brand, aarrr_stage, all_highlights[idx],
+                log=lambda *a, **k: None, check=_stopper(tokens[idx]),
+            )
+        except Cancelled as exc:
+            outputs.append(exc)
+            continue
+        emit("qwen_done", {"index": idx, "draft": steps["steps"]["styled_message"]})
+        emit("exaone_done", {"index": idx, "text": steps["final_output"]})
+        out = _build_output(
+            args, personas[idx], products[idx], load_crm_goal_meta(data['crm_goals'], args.stage_index),
+            all_highlights[idx], steps, load_duration, rag_duration,
+        )
+        print(
+            "[SLMv2] "
+            f"rag={rag_duration:.2f}s "
+            f"steps={out['timing']['qwen']:.2f}s "
+            f"polish={out['timing']['exaone']:.2f}s "
+            f"total={out['timing']['total']:.2f}s"
+        )
+        outputs.append(out)
+    return outputs
@@ -0,0 +1,170 @@
+"""
+단계별 중간 결과 ID (content-addressed)와 재계산 범위
+
+Qwen→Exaone 파이프라인의 단계 출력(리뷰 하이라이트, Qwen 초안, CRM 스니펫, Exaone 프롬프트)은
+내용의 해시를 ID로 저장됩니다. 결과에는 단계별 ID(`stages`)와, 요청 파라미터 + 단계 ID를 묶은
+기록의 ID(`result_id`)가 붙습니다. `/regenerate`는 이 기록에서 바뀐 파라미터가 영향을 주지 않는
+앞쪽 단계를 그대로 재사용하고 나머지만 다시 계산합니다.
+
+단계 의존 관계 (각 단계는 앞 단계의 출력도 입력으로 씁니다)
+  highlights    : persona, brand, product, top_k
+  qwen_draft    : qwen_model, seed, is_event (이벤트를 넣을 때는 stage_index도: 이벤트가 스테이지별)
+  crm_snippets  : stage_index, top_k
+  exaone_prompt : stage_index, style_index, seed (스타일 템플릿 샘플링)
+Exaone 생성은 항상 다시 합니다.
+
+저장은 요청 스레드가 큐에 넣기만 하고 백그라운드 스레드가 모아서 한 번에 커밋합니다(ResultStore와 같은 방식).
+아직 기록되지 않은 항목도 같은 프로세스에서는 바로 조회됩니다. 다른 프로세스(API 서버)가 읽어야 하는
+워커 프로세스는 결과를 돌려주기 전에 `flush`로 기록을 마칩니다.
+"""
+
+import atexit
+import queue
+import threading
+import time
+
+from response_cache import ResponseCache, make_cache_key
+
+STAGES = ("highlights", "qwen_draft", "crm_snippets", "exaone_prompt")
+
+# Request parameters each stage reads directly, besides the output of the stage before it.
+STAGE_INPUTS = {
+    "highlights": ("persona", "brand", "product", "top_k"),
+    "qwen_draft": ("qwen_model", "seed", "is_event"),
+    "crm_snippets": ("stage_index", "top_k"),
+    "exaone_prompt": ("stage_index", "style_index", "seed"),
+}
+
+# What a result record keeps of its request, i.e. what ``/regenerate`` starts from.
+REQUEST_FIELDS = (
+    "persona",
+    "brand",
+    "product",
+    "stage_index",
+    "style_index",
+    "is_event",
+    "top_k",
+    "qwen_model",
+    "exa_model",
+    "seed",
+)
+
+
+def stage_id(stage, value):
+    """Content address of one stage output."""
+    return make_cache_key({"stage": stage, "value": value})
+
+
+def result_record(request, stages):
+    """``(result_id, record)`` for a result made from ``request`` with the given stage ids."""
+    record = {"request": {field: request.get(field) for field in REQUEST_FIELDS}, "stages": dict(stages)}
+    return stage_id("result", record), record
+
+
+def _inputs(stage, request):
+    fields = STAGE_INPUTS[stage]
+    if stage == "qwen_draft" and request.get("is_event") == 1:
+        fields += ("stage_index",)
+    # A persona given as 0 or "0" is the same persona.
+    return {field: str(request.get(field)) if field == "persona" else request.get(field) for field in fields}
+
+
+def reusable_stages(record, request):
+    """Stage ids of ``record`` still valid for ``request``: the leading stages none of whose inputs changed."""
+    reuse = {}
+    for stage in STAGES:
+        if stage not in record["stages"] or _inputs(stage, record["request"]) != _inputs(stage, request):
+            break
+        reuse[stage] = record["stages"][stage]
+    return reuse
+
+
+class StageStore:
+    """Stage outputs and result records in a ``ResponseCache``, written by a background thread.
+
+    ``put_many`` only enqueues (entries stay readable from memory until the
+    writer has stored them); the writer drains up to ``batch_size`` queued
+    calls, or whatever arrived within ``flush_interval`` seconds, and commits
+    them in one transaction. ``flush`` cuts the wait short and returns once
+    everything queued before it is stored.
+    """
+
+    def __init__(self, path=None, max_entries=2048, ttl_seconds=86400, batch_size=64, flush_interval=0.2):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval)
+        self._cache = ResponseCache(path=path, max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="stage-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def get(self, key):
+        with self._lock:
+            value = self._pending.get(key)
+        return value if value is not None else self._cache.get(key)
+
+    def put_many(self, items):
+        """Queue ``(key, value)`` pairs for writing; never touches the database."""
+        if not items:
+            return
+        with self._lock:
+            self._pending.update(items)
+        self._queue.put(list(items))
+
+    def _drain(self, first):
+        batches = [first]
+        deadline = time.time() + self.flush_interval
+        while len(batches) < self.batch_size:
+            timeout = deadline - time.time()
+            try:
+                batch = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batches.append(batch)
+            if isinstance(batch, threading.Event):
+                break
+        return batches
+
+    def _loop(self):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is None:
+                break
+            batches = self._drain(first)
+            if None in batches:
+                stop = True
+                batches = [batch for batch in batches if batch is not None]
+            flushes = [batch for batch in batches if isinstance(batch, threading.Event)]
+            items = [item for batch in batches if isinstance(batch, list) for item in batch]
+            if items:
+                try:
+                    self._cache.put_many(items)
+                except Exception as exc:
+                    print(f"[StageStore] failed to write {len(items)} stage outputs: {exc}")
+                with self._lock:
+                    for key, value in items:
+                        if self._pending.get(key) is value:
+                            del self._pending[key]
+            for done in flushes:
+                done.set()
+
+    def flush(self):
+        """Block until everything queued so far has been written."""
+        if self._thread.is_alive():
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+
+    def shutdown(self):
+        """Write everything queued so far, then stop the writer."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return dict(self._cache.stats(), queued=self._queue.qsize(), pending=pending)
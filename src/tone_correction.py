@@ -25,10 +25,12 @@ from typing import Dict, List, Any
 
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers.generation.streamers import BaseStreamer
 
 # 내부 유틸
 sys.path.insert(0, os.path.dirname(__file__))
 from rag_utils import vectorize_texts, cosine  # noqa: E402
+from sampling import sampling  # noqa: E402
 
 
 STAGE_ORDER = ['Acquisition', 'Activation', 'Retention', 'Revenue', 'Referral']
@@ -66,24 +68,32 @@ def select_stage_bucket(categorized: List[Dict[str, Any]], stage_index: int) ->
 
 
 def rag_crm_snippets(bucket: Dict[str, Any], query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    return rag_crm_snippets_batch(bucket, [query], top_k=top_k)[0]
+
+
+def rag_crm_snippets_batch(bucket: Dict[str, Any], queries: List[str], top_k: int = 5) -> List[List[Dict[str, Any]]]:
+    """CRM RAG for several queries against one stage bucket with a single embedding call."""
     items = bucket.get('items', [])
     docs = [f"{it.get('description','')} {it.get('extracted_text','')}".strip() for it in items]
     if not docs:
-        return []
-
-    vectors = vectorize_texts([query] + docs)
-    q_vec, doc_vecs = vectors[0], vectors[1:]
-
-    scored = []
-    for doc_vec, item, text in zip(doc_vecs, items, docs):
-        scored.append({
-            'score': cosine(q_vec, doc_vec),
-            'source_index': item.get('source_index'),
-            'filename': item.get('filename'),
-            'text': text[:800]
-        })
-    scored.sort(key=lambda x: x['score'], reverse=True)
-    return scored[:top_k]
+        return [[] for _ in queries]
+
+    vectors = vectorize_texts(list(queries) + docs)
+    q_vecs, doc_vecs = vectors[:len(queries)], vectors[len(queries):]
+
+    results = []
+    for q_vec in q_vecs:
+        scored = []
+        for doc_vec, item, text in zip(doc_vecs, items, docs):
+            scored.append({
+                'score': cosine(q_vec, doc_vec),
+                'source_index': item.get('source_index'),
+                'filename': item.get('filename'),
+                'text': text[:800]
+            })
+        scored.sort(key=lambda x: x['score'], reverse=True)
+        results.append(scored[:top_k])
+    return results
 
 
 def summarize_persona(persona: Dict[str, Any]) -> str:
@@ -197,6 +207,71 @@ def get_device() -> str:
     return "cpu"
 
 
+class BatchTextStreamer(BaseStreamer):
+    """Streams newly decoded text for every row of a (batched) ``generate`` call.
+
+    ``on_text(row, text)`` is called with the text each row gained since the
+    previous step. Rows stop streaming once they emit an EOS token, at which
+    point ``on_finish(row, text)`` (if given) receives the row's full text.
+    """
+
+    def __init__(self, tokenizer, on_text=None, eos_token_ids=None, on_finish=None):
+        self.tokenizer = tokenizer
+        self.on_text = on_text
+        self.on_finish = on_finish
+        self.eos_token_ids = set(eos_token_ids or [])
+        self._prompt_seen = False
+        self._tokens = None
+        self._emitted = None
+        self._finished = None
+
+    def put(self, value):
+        # The first call carries the prompt ids.
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        if value.dim() > 1:
+            value = value[:, -1]
+        token_ids = value.tolist()
+        if self._tokens is None:
+            self._tokens = [[] for _ in token_ids]
+            self._emitted = ["" for _ in token_ids]
+            self._finished = [False for _ in token_ids]
+        for row, token_id in enumerate(token_ids):
+            if self._finished[row]:
+                continue
+            if token_id in self.eos_token_ids:
+                self._finish(row)
+                continue
+            self._tokens[row].append(token_id)
+            self._flush(row, partial=True)
+
+    def end(self):
+        if self._tokens is None:
+            return
+        for row in range(len(self._tokens)):
+            if not self._finished[row]:
+                self._finish(row)
+
+    def _finish(self, row):
+        self._finished[row] = True
+        self._flush(row)
+        if self.on_finish is not None:
+            text = self.tokenizer.decode(self._tokens[row], skip_special_tokens=True)
+            self.on_finish(row, text.strip())
+
+    def _flush(self, row, partial=False):
+        text = self.tokenizer.decode(self._tokens[row], skip_special_tokens=True)
+        # Hold back incomplete multi-byte characters until the next token arrives.
+        if partial and text.endswith("\ufffd"):
+            return
+        delta = text[len(self._emitted[row]):]
+        if delta:
+            self._emitted[row] = text
+            if self.on_text is not None:
+                self.on_text(row, delta)
+
+
 class ExaoneToneCorrector:
     """Exaone 로컬 모델을 통한 톤 보정."""
     _CACHE = {}
@@ -236,7 +311,18 @@ class ExaoneToneCorrector:
             }
         print("[Exaone] 모델 로딩 완료")
 
-    def generate(self, messages: List[Dict[str, str]], max_tokens: int = 512, temperature: float = 0.4):
+    def _make_streamer(self, on_text, on_finish=None):
+        if on_text is None and on_finish is None:
+            return None
+        eos_ids = self.model.generation_config.eos_token_id
+        if not isinstance(eos_ids, (list, tuple, set)):
+            eos_ids = [eos_ids]
+        eos_ids = {i for i in eos_ids if i is not None}
+        if self.tokenizer.eos_token_id is not None:
+            eos_ids.add(self.tokenizer.eos_token_id)
+        return BatchTextStreamer(self.tokenizer, on_text, eos_token_ids=eos_ids, on_finish=on_finish)
+
+    def generate(self, messages: List[Dict[str, str]], max_tokens: int = 512, temperature: float = 0.4, on_text=None, seed=None, on_finish=None, stopping_criteria=None):
         try:
             input_text = self.tokenizer.apply_chat_template(
                 messages,
@@ -253,7 +339,7 @@ class ExaoneToneCorrector:
             max_length=3072
         ).to(self.device)
 
-        with torch.inference_mode():
+        with sampling(seed), torch.inference_mode():
             output_ids = self.model.generate(
                 **inputs,
                 max_new_tokens=max_tokens,
@@ -261,7 +347,9 @@ class ExaoneToneCorrector:
                 top_p=0.9,
                 do_sample=True,
                 repetition_penalty=1.1,
-                pad_token_id=self.tokenizer.eos_token_id
+                pad_token_id=self.tokenizer.eos_token_id,
+                streamer=self._make_streamer(on_text, on_finish),
+                stopping_criteria=stopping_criteria
             )
 
         generated_ids = output_ids[0][inputs['input_ids'].shape[1]:]
@@ -269,7 +357,7 @@ class ExaoneToneCorrector:
         return text.strip()
 
 
-    def generate_batch(self, messages_list, max_tokens: int = 512, temperature: float = 0.4):
+    def generate_batch(self, messages_list, max_tokens: int = 512, temperature: float = 0.4, on_text=None, seed=None, on_finish=None, stopping_criteria=None):
         if not messages_list:
             return []
 
@@ -287,6 +375,10 @@ class ExaoneToneCorrector:
                 )
             input_texts.append(input_text)
 
+        # Decoder-only models must be left-padded so every row continues from its own prompt.
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
         inputs = self.tokenizer(
             input_texts,
             return_tensors="pt",
@@ -295,7 +387,8 @@ class ExaoneToneCorrector:
             max_length=3072
         ).to(self.device)
 
-        with torch.inference_mode():
+        # With a seed, reproducible only for the same batch composition (e.g. the n candidates of one request).
+        with sampling(seed), torch.inference_mode():
             output_ids = self.model.generate(
                 **inputs,
                 max_new_tokens=max_tokens,
@@ -303,13 +396,15 @@ class ExaoneToneCorrector:
                 top_p=0.9,
                 do_sample=True,
                 repetition_penalty=1.1,
-                pad_token_id=self.tokenizer.eos_token_id
+                pad_token_id=self.tokenizer.eos_token_id,
+                streamer=self._make_streamer(on_text, on_finish),
+                stopping_criteria=stopping_criteria
             )
 
-        input_lengths = inputs["attention_mask"].sum(dim=1).tolist()
+        prompt_len = inputs["input_ids"].shape[1]
         outputs = []
-        for i, input_len in enumerate(input_lengths):
-            generated_ids = output_ids[i][int(input_len):]
+        for i in range(len(input_texts)):
+            generated_ids = output_ids[i][prompt_len:]
             text = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
             outputs.append(text.strip())
         return outputs
@@ -0,0 +1,307 @@
+"""
+멀티 프로세스 모델 워커 풀
+
+각 워커 프로세스가 자신만의 Qwen/Exaone/임베더 세트를 로드하고, 할당된 CPU 코어에
+고정된 상태로 `torch.set_num_threads`를 나눠 사용합니다. API 프로세스는 진행 중인
+작업 수가 가장 적은 워커로 요청을 보냅니다.
+
+작업 함수는 모듈 최상위 함수여야 합니다(프로세스 간 pickle 전달).
+실행 중인 작업의 행 단위 취소는 워커별 제어 큐로 전달됩니다(`WorkerPool.cancel`).
+워커 프로세스가 죽으면 그 워커에 걸려 있던 작업은 `WorkerDied`로 실패 처리되고, 이후 요청은
+살아 있는 워커로만 보냅니다.
+"""
+
+import itertools
+import multiprocessing as mp
+import os
+import pickle
+import threading
+import traceback
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(cores, num_workers):
+    """Split cores into num_workers contiguous, near-equal slices."""
+    num_workers = max(1, num_workers)
+    size, extra = divmod(len(cores), num_workers)
+    slices = []
+    start = 0
+    for i in range(num_workers):
+        end = start + size + (1 if i < extra else 0)
+        # More workers than cores: share cores round-robin.
+        slices.append(cores[start:end] or [cores[i % len(cores)]])
+        start = end
+    return slices
+
+
+class WorkerDied(RuntimeError):
+    """The worker process running a task exited before the task finished."""
+
+
+class TaskCancel:
+    """Worker-side cancel tokens of one task, cancelled by messages from the API process.
+
+    ``token(row, deadline)`` returns that row's ``CancelToken``; a cancel that
+    arrives before the task asks for the token is remembered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._cancelled = set()
+
+    def token(self, row, deadline=None):
+        from cancellation import CancelToken
+
+        with self._lock:
+            token = self._tokens[row] = CancelToken(deadline)
+            cancelled = row in self._cancelled
+        if cancelled:
+            token.cancel("client disconnected")
+        return token
+
+    def cancel(self, row):
+        with self._lock:
+            self._cancelled.add(row)
+            token = self._tokens.get(row)
+        if token is not None:
+            token.cancel("client disconnected")
+
+
+def _read_controls(control_queue, task_cancels, lock):
+    while True:
+        msg = control_queue.get()
+        if msg is None:
+            break
+        _, task_id, row = msg
+        # The task may not have started yet; its TaskCancel then starts out cancelled.
+        with lock:
+            cancel = task_cancels.setdefault(task_id, TaskCancel())
+        cancel.cancel(row)
+
+
+def _worker_main(worker_id, cores, task_queue, result_queue, init_func, control_queue=None):
+    if cores and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError:
+            pass
+    import torch
+
+    torch.set_num_threads(max(1, len(cores)))
+    print(f"[WorkerPool] worker {worker_id} pid={os.getpid()} cores={cores} threads={torch.get_num_threads()}")
+
+    init_error = None
+    if init_func is not None:
+        try:
+            init_func()
+        except Exception as exc:
+            traceback.print_exc()
+            init_error = f"{type(exc).__name__}: {exc}"
+    result_queue.put(("ready", worker_id, init_error, None))
+
+    task_cancels = {}
+    cancels_lock = threading.Lock()
+    if control_queue is not None:
+        threading.Thread(
+            target=_read_controls, args=(control_queue, task_cancels, cancels_lock), name="worker-control", daemon=True
+        ).start()
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, func, args = task
+
+        def on_event(name, payload, task_id=task_id):
+            result_queue.put(("event", task_id, name, payload))
+
+        with cancels_lock:
+            cancel = task_cancels.setdefault(task_id, TaskCancel())
+        try:
+            result = func(*args, on_event=on_event, cancel=cancel)
+        except Exception as exc:
+            # Send the exception itself when it pickles so callers can tell error types apart.
+            try:
+                pickle.dumps(exc)
+                error = exc
+            except Exception:
+                error = f"{type(exc).__name__}: {exc}"
+            result_queue.put(("error", task_id, error, None))
+        else:
+            result_queue.put(("done", task_id, result, None))
+        finally:
+            with cancels_lock:
+                task_cancels.pop(task_id, None)
+
+
+class WorkerPool:
+    """Routes tasks to N model worker processes, least-loaded first.
+
+    ``submit(func, *args, on_event=None)`` returns a ``concurrent.futures.Future``.
+    ``func`` runs in a worker as ``func(*args, on_event=..., cancel=...)``;
+    events it emits are delivered to ``on_event`` in the API process from a
+    reader thread, and ``cancel(future, row)`` cancels the token the task got
+    from ``cancel.token(row)``.
+    """
+
+    def __init__(self, num_workers, init_func=None, cores=None):
+        self.num_workers = max(1, num_workers)
+        self._ctx = mp.get_context("spawn")
+        self._result_queue = self._ctx.Queue()
+        self._task_queues = []
+        self._control_queues = []
+        self._processes = []
+        self._inflight = [0] * self.num_workers
+        self._ready = {}
+        self._dead = set()
+        self._closing = threading.Event()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._rr = itertools.count()
+
+        core_slices = split_cores(cores or available_cores(), self.num_workers)
+        for worker_id, worker_cores in enumerate(core_slices):
+            task_queue = self._ctx.Queue()
+            control_queue = self._ctx.Queue()
+            proc = self._ctx.Process(
+                target=_worker_main,
+                args=(worker_id, worker_cores, task_queue, self._result_queue, init_func, control_queue),
+                name=f"model-worker-{worker_id}",
+                daemon=True,
+            )
+            proc.start()
+            self._task_queues.append(task_queue)
+            self._control_queues.append(control_queue)
+            self._processes.append(proc)
+
+        self._reader = threading.Thread(target=self._read_results, name="worker-pool-reader", daemon=True)
+        self._reader.start()
+        self._monitor = threading.Thread(target=self._watch_workers, name="worker-pool-monitor", daemon=True)
+        self._monitor.start()
+
+    def _live(self, worker_id):
+        return worker_id not in self._dead and self._processes[worker_id].is_alive()
+
+    def _pick_worker(self):
+        alive = [i for i in range(self.num_workers) if self._live(i)]
+        if not alive:
+            raise RuntimeError("No live model workers")
+        start = next(self._rr)
+        order = sorted(alive, key=lambda i: (self._inflight[i], (i - start) % self.num_workers))
+        return order[0]
+
+    def submit(self, func, *args, on_event=None, worker=None):
+        """Queue ``func(*args)`` on the least-loaded worker, or on worker ``worker``."""
+        future = Future()
+        with self._lock:
+            worker_id = self._pick_worker() if worker is None else worker
+            if not self._live(worker_id):
+                raise WorkerDied(f"Model worker {worker_id} is not running")
+            task_id = next(self._ids)
+            self._inflight[worker_id] += 1
+            self._pending[task_id] = (future, on_event, worker_id)
+        future.task_id = task_id
+        self._task_queues[worker_id].put((task_id, func, args))
+        return future
+
+    def cancel(self, future, row=0):
+        """Cancel row ``row`` of a submitted task, if it has not finished yet."""
+        task_id = getattr(future, "task_id", None)
+        with self._lock:
+            entry = self._pending.get(task_id)
+        if entry is not None:
+            self._control_queues[entry[2]].put(("cancel", task_id, row))
+
+    def _read_results(self):
+        while True:
+            msg = self._result_queue.get()
+            if msg is None:
+                break
+            kind, task_id, value, extra = msg
+            if kind == "ready":
+                self._ready[task_id] = value
+                continue
+            with self._lock:
+                entry = self._pending.get(task_id)
+            if entry is None:
+                continue
+            future, on_event, worker_id = entry
+            if kind == "event":
+                if on_event is not None:
+                    try:
+                        on_event(value, extra)
+                    except Exception:
+                        traceback.print_exc()
+                continue
+            with self._lock:
+                self._pending.pop(task_id, None)
+                self._inflight[worker_id] -= 1
+            if kind == "done":
+                future.set_result(value)
+            else:
+                future.set_exception(value if isinstance(value, BaseException) else RuntimeError(value))
+
+    def _watch_workers(self):
+        """Wait on the worker processes' sentinels and fail the tasks of any worker that exits."""
+        while not self._closing.is_set():
+            live = {p.sentinel: i for i, p in enumerate(self._processes) if i not in self._dead}
+            if not live:
+                break
+            for sentinel in wait(list(live), timeout=1.0):
+                self._worker_died(live[sentinel])
+
+    def _worker_died(self, worker_id):
+        if self._closing.is_set():
+            return
+        with self._lock:
+            self._dead.add(worker_id)
+            lost = [task_id for task_id, entry in self._pending.items() if entry[2] == worker_id]
+            futures = [self._pending.pop(task_id)[0] for task_id in lost]
+            self._inflight[worker_id] = 0
+        process = self._processes[worker_id]
+        process.join(timeout=1.0)
+        code = process.exitcode
+        print(f"[WorkerPool] worker {worker_id} exited (code {code}); failing {len(futures)} task(s)")
+        for future in futures:
+            if not future.done():
+                future.set_exception(WorkerDied(f"Model worker {worker_id} exited (code {code}) during the task"))
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    "worker": i,
+                    "pid": p.pid,
+                    "alive": self._live(i),
+                    "ready": i in self._ready,
+                    "init_error": self._ready.get(i),
+                    "inflight": self._inflight[i],
+                }
+                for i, p in enumerate(self._processes)
+            ]
+
+    def shutdown(self):
+        self._closing.set()
+        for task_queue, control_queue in zip(self._task_queues, self._control_queues):
+            task_queue.put(None)
+            control_queue.put(None)
+        for proc in self._processes:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        self._result_queue.put(None)
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future, _, _ in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Worker pool shut down"))